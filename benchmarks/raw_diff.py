@@ -0,0 +1,67 @@
+"""Benchmark parse_raw_diff against the streaming iter_raw_diff.
+
+Usage: python -m benchmarks.raw_diff [num_files]
+
+Generates synthetic `git diff --raw -z --numstat` output with a mix of
+modifications, renames, additions and binary files, then reports the time
+and peak memory of each parser.
+"""
+
+import io
+import sys
+import time
+import tracemalloc
+
+from webdiff.unified_diff import iter_raw_diff, parse_raw_diff
+
+SHA = '0' * 40
+
+
+def make_output(num_files: int) -> bytes:
+    raw = []
+    numstat = []
+    for i in range(num_files):
+        a = f'/tmp/left/src/module{i // 100}/file{i}.py'
+        b = f'/tmp/right/src/module{i // 100}/file{i}.py'
+        kind = i % 10
+        if kind == 0:
+            b = f'/tmp/right/src/module{i // 100}/renamed{i}.py'
+            raw += [f':100644 100644 {SHA} {SHA} R087', a, b]
+            numstat += ['3\t2\t', a, b]
+        elif kind == 1:
+            raw += [f':000000 100644 {SHA} {SHA} A', b]
+            numstat += ['12\t0\t', '/dev/null', b]
+        elif kind == 2:
+            raw += [f':100644 100644 {SHA} {SHA} M', a]
+            numstat += ['-\t-\t', a, b]
+        else:
+            raw += [f':100644 100644 {SHA} {SHA} M', a]
+            numstat += [f'{i % 17}\t{i % 5}\t', a, b]
+    return ('\0'.join(raw + numstat) + '\0').encode('utf8')
+
+
+def measure(fn):
+    tracemalloc.start()
+    start = time.perf_counter()
+    result = fn()
+    elapsed = time.perf_counter() - start
+    _, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    return result, elapsed, peak
+
+
+def main():
+    num_files = int(sys.argv[1]) if len(sys.argv) > 1 else 100_000
+    data = make_output(num_files)
+    print(f'{num_files} files, {len(data) / 1e6:.1f} MB of git output')
+
+    old, old_secs, old_peak = measure(lambda: parse_raw_diff(data.decode('utf8')))
+    new, new_secs, new_peak = measure(lambda: list(iter_raw_diff(io.BytesIO(data))))
+    assert old == new, 'parsers disagree'
+
+    print(f'parse_raw_diff: {old_secs:6.3f}s  peak {old_peak / 1e6:7.1f} MB')
+    print(f'iter_raw_diff:  {new_secs:6.3f}s  peak {new_peak / 1e6:7.1f} MB')
+
+
+if __name__ == '__main__':
+    main()
@@ -29,6 +29,7 @@ fi
 
 webdiff_args=()
 git_args=()
+native=0
 
 # Function to show help
 show_help() {
@@ -52,7 +53,20 @@ options:
   --max-diff-width WIDTH       Maximum width for diff display (default: 120)
   --theme THEME                Color theme for syntax highlighting (default: googlecode)
   --max-lines-for-syntax LINES Maximum lines for syntax highlighting (default: 25000)
+  --server-highlight           Highlight larger files on the server (requires Pygments)
   --diff-algorithm ALGORITHM   Diff algorithm: myers, minimal, patience, histogram
+  --diff-backend BACKEND       How to compute file diffs: git (default) or python
+  --max-workers N              Maximum number of diffs to compute concurrently (default: 8)
+  --cache-size MB              Memory for caching computed diffs (default: 64)
+  --cache-dir DIR              Keep computed diffs in DIR between runs (default: off)
+  --cache-dir-size MB          Maximum size of --cache-dir (default: 1024)
+  --scratch-size MB            Temporary files to keep before deleting old ones (default: 1024)
+  --precompute                 Compute all file diffs in the background at startup
+  --precompute-workers N       Files to precompute at once, out of --max-workers (default: 4)
+  --watch                      Update the diff as files in the working tree change
+  --native                     Read files straight from git as they're viewed, instead of
+                               checking out both sides with git difftool (faster for big repos)
+  --git-processes N            Long-running git processes to read files with for --native (default: 4)
   --color-insert COLOR         Background color for inserted lines (default: #efe)
   --color-delete COLOR         Background color for deleted lines (default: #fee)
   --color-char-insert COLOR    Background color for inserted characters (default: #cfc)
@@ -103,7 +117,7 @@ while [[ $# -gt 0 ]]; do
             show_help
             exit 0
             ;;
-        -p|--port|--timeout|--unified|--max-diff-width|--max-lines-for-syntax)
+        -p|--port|--timeout|--unified|--max-diff-width|--max-lines-for-syntax|--max-workers|--cache-size|--cache-dir-size|--scratch-size|--precompute-workers|--git-processes)
             if [[ -z "$2" || ! "$2" =~ ^[0-9]+$ ]]; then
                 echo "Error: $1 requires a numeric argument" >&2
                 exit 1
@@ -111,7 +125,15 @@ while [[ $# -gt 0 ]]; do
             webdiff_args+=("$1" "$2")
             shift 2
             ;;
-        --host|--root-path|--theme|--diff-algorithm|--color-insert|--color-delete|--color-char-insert|--color-char-delete|--extra-dir-diff-args|--extra-file-diff-args)
+        --precompute|--watch|--server-highlight)
+            webdiff_args+=("$1")
+            shift
+            ;;
+        --native)
+            native=1
+            shift
+            ;;
+        --host|--root-path|--cache-dir|--theme|--diff-algorithm|--diff-backend|--color-insert|--color-delete|--color-char-insert|--color-char-delete|--extra-dir-diff-args|--extra-file-diff-args)
             if [[ -z "$2" ]]; then
                 echo "Error: $1 requires an argument" >&2
                 exit 1
@@ -161,6 +183,15 @@ if [ $has_diff -eq 0 ]; then
     exit 1
 fi
 
+if [ $native -eq 1 ]; then
+    # Skip git difftool; webdiff runs git diff itself, so stay in this directory.
+    SCRIPT_DIR="$(cd "$(dirname "$(realpath "$0")")" && pwd)"
+    if [ ${#git_args[@]} -eq 0 ]; then
+        git_args=(HEAD)
+    fi
+    exec uv run --project "$SCRIPT_DIR" -m webdiff.app "${webdiff_args[@]}" --git="$(printf "%q " "${git_args[@]}")"
+fi
+
 # There are differences, run git difftool
 git_cmd=(git difftool -d -x "$(realpath "$0")" "${git_args[@]}")
 exec "${git_cmd[@]}"
@@ -4,6 +4,9 @@ import {CodeDiff, PatchOptions} from './codediff/codediff';
 import {guessLanguageUsingContents, guessLanguageUsingFileName} from './codediff/language';
 import {ServerConfig} from './options';
 import {DiffRange} from './codediff/codes';
+import {CharacterDiffRow} from './codediff/char-diffs';
+import {HighlightLoader} from './codediff/server-highlight';
+import {getHighlighting} from './unified-api';
 
 interface BaseFilePair {
   idx: number;
@@ -77,6 +80,7 @@ export interface CodeDiffContainerProps {
     content_a: string | null;
     content_b: string | null;
     diff_ops: DiffRange[];
+    char_diffs?: CharacterDiffRow[];
   };
 }
 
@@ -88,7 +92,8 @@ export function CodeDiffContainer(props: CodeDiffContainerProps) {
   const contents = {
     before: preloadedData.content_a,
     after: preloadedData.content_b,
-    diffOps: preloadedData.diff_ops
+    diffOps: preloadedData.diff_ops,
+    charDiffs: preloadedData.char_diffs,
   };
 
   const isEqualAfterNormalization = React.useMemo(() => {
@@ -104,6 +109,8 @@ export function CodeDiffContainer(props: CodeDiffContainerProps) {
             contentsBefore={contents.before}
             contentsAfter={contents.after}
             diffOps={contents.diffOps}
+            charDiffs={contents.charDiffs}
+            normalizeJSON={normalizeJSON}
             isEqualAfterNormalization={!!isEqualAfterNormalization}
           />
         ) : (
@@ -119,6 +126,8 @@ interface FileDiffProps {
   contentsBefore: string | null;
   contentsAfter: string | null;
   diffOps: DiffRange[];
+  charDiffs?: CharacterDiffRow[];
+  normalizeJSON: boolean;
   isEqualAfterNormalization: boolean;
 }
 
@@ -134,7 +143,15 @@ function lengthOrZero(data: unknown[] | string | null | undefined) {
 }
 
 function FileDiff(props: FileDiffProps) {
-  const {filePair, contentsBefore, contentsAfter, diffOps, isEqualAfterNormalization} = props;
+  const {
+    filePair,
+    contentsBefore,
+    contentsAfter,
+    diffOps,
+    charDiffs,
+    normalizeJSON,
+    isEqualAfterNormalization,
+  } = props;
   const pathBefore = filePair.a;
   const pathAfter = filePair.b;
   // build the diff view and add it to the current DOM
@@ -169,6 +186,13 @@ function FileDiff(props: FileDiffProps) {
     [language],
   );
 
+  // Files too big to highlight in the browser can be highlighted by the server.
+  const loadHighlighting = React.useMemo((): HighlightLoader | undefined => {
+    if (!SERVER_CONFIG.webdiff.serverHighlight) return undefined;
+    return (side, ranges) =>
+      getHighlighting(filePair.idx, side === 'before' ? 'a' : 'b', ranges, normalizeJSON);
+  }, [filePair.idx, normalizeJSON]);
+
   return (
     <div className="diff">
       <NoChanges filePair={filePair} isEqualAfterNormalization={isEqualAfterNormalization} />
@@ -177,6 +201,8 @@ function FileDiff(props: FileDiffProps) {
         afterText={contentsAfter}
         ops={diffOps}
         params={opts}
+        charDiffs={charDiffs}
+        loadHighlighting={loadHighlighting}
       />
     </div>
   );
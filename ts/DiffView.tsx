@@ -1,7 +1,7 @@
 import React from 'react';
 import {CodeDiffContainer, FilePair} from './CodeDiffContainer';
 import {GitDiffOptions, gitDiffOptionsToFlags} from './diff-options';
-import {getUnifiedFileData, UnifiedFileData} from './unified-api';
+import {loadUnifiedFileData, UnifiedFileData} from './unified-api';
 import {ImageDiff} from './ImageDiff';
 import {ImageDiffMode} from './ImageDiffModeSelector';
 
@@ -25,8 +25,8 @@ export function DiffView(props: Props) {
   React.useEffect(() => {
     (async () => {
       try {
-        // Fetch everything in one request
-        const data = await getUnifiedFileData(
+        // Fetch everything in one request, shared with the other files on the page
+        const data = await loadUnifiedFileData(
           thinFilePair.idx,
           gitDiffOptionsToFlags(diffOptions),
           normalizeJSON
@@ -61,7 +61,8 @@ export function DiffView(props: Props) {
         preloadedData={{
           content_a: unifiedData.content_a,
           content_b: unifiedData.content_b,
-          diff_ops: unifiedData.diff_ops
+          diff_ops: unifiedData.diff_ops,
+          char_diffs: unifiedData.char_diffs,
         }}
       />
     );
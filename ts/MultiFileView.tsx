@@ -89,6 +89,8 @@ function FileView({
 
 export interface MultiFileViewProps {
   filePairs: FilePair[];
+  /** Per-index counters; a file's view is reloaded whenever its counter changes. */
+  revisions?: Record<number, number>;
   imageDiffMode: ImageDiffMode;
   pdiffMode: PerceptualDiffMode;
   diffOptions: Partial<GitDiffOptions>;
@@ -99,12 +101,22 @@ export interface MultiFileViewProps {
 }
 
 export function MultiFileView(props: MultiFileViewProps) {
-  const {filePairs, ...diffProps} = props;
+  const {filePairs, revisions, ...diffProps} = props;
   const [expandedFiles, setExpandedFiles] = React.useState<Set<number>>(
     new Set(filePairs.map((_, idx) => idx))
   );
   const [hiddenFiles, setHiddenFiles] = React.useState<Set<number>>(new Set());
 
+  // Files which appear later (with --watch) start out expanded, too.
+  const numFiles = React.useRef(filePairs.length);
+  React.useEffect(() => {
+    if (filePairs.length > numFiles.current) {
+      const start = numFiles.current;
+      setExpandedFiles(prev => new Set([...prev, ...filePairs.slice(start).map((_, i) => start + i)]));
+    }
+    numFiles.current = filePairs.length;
+  }, [filePairs]);
+
   // Calculate file counts by type and total line changes
   const {fileCounts, lineCounts} = React.useMemo(() => {
     const visiblePairs = filePairs.filter((_, idx) => !hiddenFiles.has(idx));
@@ -208,7 +220,7 @@ export function MultiFileView(props: MultiFileViewProps) {
       {filePairs.map((filePair, idx) => 
         hiddenFiles.has(idx) ? null : (
           <FileView
-            key={idx}
+            key={`${idx}-${revisions?.[idx] ?? 0}`}
             filePair={filePair}
             isExpanded={expandedFiles.has(idx)}
             onToggle={() => toggleFile(idx)}
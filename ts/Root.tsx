@@ -8,22 +8,52 @@ import { DiffOptionsControl } from './DiffOptions';
 import { KeyboardShortcuts } from './codediff/KeyboardShortcuts';
 import { Options, encodeOptions, ServerConfig, parseOptions, UpdateOptionsFn } from './options';
 import { MultiFileView } from './MultiFileView';
+import { apiUrl } from './api-utils';
 
 declare const pairs: FilePair[];
 declare const SERVER_CONFIG: ServerConfig;
 
+interface DiffEvent {
+  pairs: FilePair[];
+  /** Indices of the entries which need to be fetched again. */
+  changed: number[];
+}
+
 // Webdiff application root.
 export function Root() {
   const [pdiffMode, setPDiffMode] = React.useState<PerceptualDiffMode>('off');
   const [imageDiffMode, setImageDiffMode] = React.useState<ImageDiffMode>('side-by-side');
   const [showKeyboardHelp, setShowKeyboardHelp] = React.useState(false);
   const [showOptions, setShowOptions] = React.useState(false);
+  const [filePairs, setFilePairs] = React.useState<FilePair[]>(pairs);
+  // Bumped for each file which changes on disk, to make its view reload.
+  const [revisions, setRevisions] = React.useState<Record<number, number>>({});
 
   const [searchParams, setSearchParams] = useSearchParams();
 
   // Set document title
   React.useEffect(() => {
-    document.title = `Diff: ${pairs.length} file${pairs.length !== 1 ? 's' : ''}`;
+    document.title = `Diff: ${filePairs.length} file${filePairs.length !== 1 ? 's' : ''}`;
+  }, [filePairs]);
+
+  // With --watch, the server pushes the new file list whenever files change.
+  React.useEffect(() => {
+    if (!SERVER_CONFIG.webdiff.watch) return;
+    const events = new EventSource(apiUrl('/events'));
+    events.addEventListener('diff', e => {
+      const {pairs: newPairs, changed} = JSON.parse((e as MessageEvent).data) as DiffEvent;
+      setFilePairs(newPairs);
+      setRevisions(prev => {
+        const next = {...prev};
+        for (const idx of changed) {
+          next[idx] = (next[idx] ?? 0) + 1;
+        }
+        return next;
+      });
+    });
+    return () => {
+      events.close();
+    };
   }, []);
 
   const options = React.useMemo(() => parseOptions(searchParams), [searchParams]);
@@ -166,7 +196,8 @@ export function Root() {
           />
         ) : null}
         <MultiFileView
-          filePairs={pairs}
+          filePairs={filePairs}
+          revisions={revisions}
           imageDiffMode={imageDiffMode}
           pdiffMode={pdiffMode}
           diffOptions={options}
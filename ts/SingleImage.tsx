@@ -4,6 +4,9 @@ import {ImageDiffProps} from './ImageDiff';
 import {makePerceptualBoxDiv} from './image_utils';
 import {apiUrl} from './api-utils';
 
+// The largest max_size which the server's image variants accept.
+const MAX_VARIANT_SIZE = 8192;
+
 export interface Props extends ImageDiffProps {
   maxWidth: number | null;
   side: 'a' | 'b';
@@ -15,14 +18,23 @@ export function SingleImage(props: Props) {
     return null; // or: return empty <img> same size as other image?
   }
 
-  const url = side == 'a' ? apiUrl('/a/image/' + filePair.a) : apiUrl('/b/image/' + filePair.b);
-  const im = _.clone(side === 'a' ? filePair.image_a : filePair.image_b);
+  let url = side == 'a' ? apiUrl('/a/image/' + filePair.a) : apiUrl('/b/image/' + filePair.b);
+  const fullSize = side === 'a' ? filePair.image_a : filePair.image_b;
+  const im = _.clone(fullSize);
   let scaleDown = 1.0;
   const {maxWidth} = props;
   if (maxWidth !== null && maxWidth < im.width) {
     scaleDown = maxWidth / im.width;
     im.width *= scaleDown;
     im.height *= scaleDown;
+    // Have the server shrink the image rather than sending it at full size.
+    const maxSize = Math.min(
+      MAX_VARIANT_SIZE,
+      Math.ceil(Math.max(im.width, im.height) * window.devicePixelRatio),
+    );
+    if (maxSize < Math.max(fullSize.width, fullSize.height)) {
+      url += `?max_size=${maxSize}`;
+    }
   }
   const diffBoxDiv = makePerceptualBoxDiv(props.pdiffMode, filePair, scaleDown);
 
@@ -1,5 +1,5 @@
 import React from 'react';
-import {addCharacterDiffs} from './char-diffs';
+import {addCharacterDiffs, applyCharacterDiffs, CharacterDiffSpans} from './char-diffs';
 import {DiffRange} from './codes';
 import {scrollIntoViewIfNeeded} from './dom-utils';
 
@@ -12,10 +12,12 @@ interface DiffRowProps {
   beforeHTML?: string;
   afterText: string | undefined;
   afterHTML?: string;
+  /** Precomputed character diffs for a replace row; null for none, undefined to compute them here. */
+  charDiffs?: CharacterDiffSpans | null;
   isSelected: boolean;
 }
 
-function escapeHtml(unsafe: string) {
+export function escapeHtml(unsafe: string) {
   return unsafe
     .replaceAll('&', '&amp;')
     .replaceAll('<', '&lt;')
@@ -44,7 +46,15 @@ function DiffRowImpl(props: DiffRowProps) {
     makeCodeTd(type, props.afterText, props.afterHTML),
   ];
   let [beforeHtml, afterHtml] = [cells[0].html, cells[1].html];
-  if (type === 'replace') {
+  if (type === 'replace' && props.charDiffs) {
+    [beforeHtml, afterHtml] = applyCharacterDiffs(
+      cells[0].text,
+      cells[0].html,
+      cells[1].text,
+      cells[1].html,
+      props.charDiffs,
+    );
+  } else if (type === 'replace' && props.charDiffs === undefined) {
     [beforeHtml, afterHtml] = addCharacterDiffs(
       cells[0].text,
       cells[0].html,
@@ -81,6 +91,7 @@ export const DiffRow = React.memo(DiffRowImpl, (prevProps, nextProps) => {
     prevProps.afterText === nextProps.afterText &&
     prevProps.beforeHTML === nextProps.beforeHTML &&
     prevProps.afterHTML === nextProps.afterHTML &&
+    prevProps.charDiffs === nextProps.charDiffs &&
     prevProps.type === nextProps.type &&
     prevProps.isSelected === nextProps.isSelected
   );
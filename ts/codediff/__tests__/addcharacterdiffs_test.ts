@@ -2,6 +2,7 @@
 import {
   CharacterDiff,
   addCharacterDiffs,
+  applyCharacterDiffs,
   codesToHtml,
   computeCharacterDiffs,
   simplifyCodes,
@@ -165,6 +166,35 @@ describe('add character diffs', () => {
     );
   });
 
+  test('precomputed char diffs with markup', () => {
+    const beforeHtml = "    <kw>return</kw> <q>''</q> + date.getFullYear();";
+    const afterHtml = "    <kw>return</kw> <q>'xx'</q> + date.getFullYear();";
+
+    const beforeText = htmlToText(beforeHtml);
+    const afterText = htmlToText(afterHtml);
+
+    const [before, after] = applyCharacterDiffs(beforeText, beforeHtml, afterText, afterHtml, [
+      [],
+      [12, 14],
+    ]);
+    expect(before).toEqual("    <kw>return</kw> <q>''</q> + date.getFullYear();");
+    expect(after).toEqual(
+      '    <kw>return</kw> <q>\'</q><span class="char-insert"><q>xx</q></span><q>\'</q> + date.getFullYear();',
+    );
+  });
+
+  test('precomputed char diffs -- delete', () => {
+    const [before, after] = applyCharacterDiffs(
+      'foo(a, c, b)',
+      'foo(a, c, b)',
+      'foo(a, b)',
+      'foo(a, b)',
+      [[7, 10], []],
+    );
+    expect(before).toEqual('foo(a, <span class="char-delete">c, </span>b)');
+    expect(after).toEqual('foo(a, b)');
+  });
+
   function assertCharDiff(
     beforeText: string,
     beforeExpectation: string,
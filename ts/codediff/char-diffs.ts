@@ -4,6 +4,20 @@ import * as Diff from 'diff';
 
 export type CharacterDiff = [OpType | 'skip' | null, number, number];
 
+/**
+ * Character diffs computed by the server (see webdiff/chardiff.py): the
+ * changed spans of each side, flattened into [start, end, start, end, ...].
+ */
+export type CharacterDiffSpans = [before: number[], after: number[]];
+
+/** The character diffs for one row of a replace range; line numbers are 0-based. */
+export type CharacterDiffRow = [
+  beforeIdx: number | null,
+  afterIdx: number | null,
+  before: number[],
+  after: number[],
+];
+
 function strArrayLen(x: string[]) {
   return x.reduce((a, b) => a + b.length, 0);
 }
@@ -90,8 +104,48 @@ export function addCharacterDiffs(
   if (codes == null) {
     return [beforeHtml, afterHtml];
   }
-  const [beforeOut, afterOut] = codes;
+  return codesToHtmlPair(beforeText, beforeHtml, afterText, afterHtml, codes);
+}
+
+/** Like addCharacterDiffs, but with character diffs which were computed elsewhere. */
+export function applyCharacterDiffs(
+  beforeText: string,
+  beforeHtml: string,
+  afterText: string,
+  afterHtml: string,
+  spans: CharacterDiffSpans,
+): [string, string] {
+  const codes: [CharacterDiff[], CharacterDiff[]] = [
+    spansToCodes(spans[0], beforeText.length, 'delete'),
+    spansToCodes(spans[1], afterText.length, 'insert'),
+  ];
+  return codesToHtmlPair(beforeText, beforeHtml, afterText, afterHtml, codes);
+}
+
+/** Fill in the unchanged runs between the changed spans. */
+function spansToCodes(spans: number[], length: number, type: OpType): CharacterDiff[] {
+  const codes: CharacterDiff[] = [];
+  let idx = 0;
+  for (let i = 0; i < spans.length; i += 2) {
+    if (spans[i] > idx) {
+      codes.push([null, idx, spans[i]]);
+    }
+    codes.push([type, spans[i], spans[i + 1]]);
+    idx = spans[i + 1];
+  }
+  if (idx < length) {
+    codes.push([null, idx, length]);
+  }
+  return codes;
+}
 
+function codesToHtmlPair(
+  beforeText: string,
+  beforeHtml: string,
+  afterText: string,
+  afterHtml: string,
+  [beforeOut, afterOut]: [CharacterDiff[], CharacterDiff[]],
+): [string, string] {
   // Splice in "insert", "delete" and "replace" tags.
   // This is made more difficult by the presence of syntax highlighting, which
   // has its own set of tags. The two can co-exists if we're careful to only
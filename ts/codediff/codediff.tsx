@@ -5,6 +5,8 @@ import {closest, copyOnlyMatching, distributeSpans} from './dom-utils';
 import {stringAsLines} from './string-utils';
 import {isLegitKeypress} from '../utils';
 import {DiffRow} from './DiffRow';
+import {CharacterDiffRow, CharacterDiffSpans} from './char-diffs';
+import {HighlightLoader, useLoadedHighlighting} from './server-highlight';
 import {SkipRange, SkipRow} from './SkipRow';
 import {ServerConfig} from '../options';
 
@@ -61,12 +63,20 @@ export interface Props {
   afterText: string | null;
   ops: DiffRange[];
   params: Partial<PatchOptions>;
+  /**
+   * Character diffs for the rows of replace ranges, if the server computed
+   * them. Rows which aren't listed get none. Without this, they're computed
+   * in the browser.
+   */
+  charDiffs?: CharacterDiffRow[];
+  /** Fetches syntax highlighting for files which are too big to highlight here. */
+  loadHighlighting?: HighlightLoader;
 }
 
 declare const SERVER_CONFIG: ServerConfig;
 
 export function CodeDiff(props: Props) {
-  const {beforeText, afterText, ops, params} = props;
+  const {beforeText, afterText, ops, params, charDiffs, loadHighlighting} = props;
 
   const beforeLines = React.useMemo(
     () => (beforeText ? stringAsLines(beforeText) : []),
@@ -78,6 +88,12 @@ export function CodeDiff(props: Props) {
     () => enforceMinJumpSize(ops, fullParams.minJumpSize),
     [ops, fullParams],
   );
+  const charDiffsByRow = React.useMemo(
+    () =>
+      charDiffs &&
+      new Map(charDiffs.map(([b, a, ...spans]) => [`${b}-${a}`, spans])),
+    [charDiffs],
+  );
   const {language} = fullParams;
   const numLines = Math.max(beforeLines.length, afterLines.length);
 
@@ -107,6 +123,10 @@ export function CodeDiff(props: Props) {
       afterLinesHighlighted={afterLinesHighlighted}
       params={fullParams}
       ops={diffRanges}
+      charDiffsByRow={charDiffsByRow}
+      loadHighlighting={
+        numLines > SERVER_CONFIG.webdiff.maxLinesForSyntax ? loadHighlighting : undefined
+      }
     />
   ) : (
     <div className="diff">
@@ -170,6 +190,9 @@ interface CodeDiffViewProps {
   afterLinesHighlighted: readonly string[] | null;
   params: PatchOptions;
   ops: readonly DiffRange[];
+  /** Keyed by `${beforeIdx}-${afterIdx}`, like the rows. */
+  charDiffsByRow: Map<string, CharacterDiffSpans> | undefined;
+  loadHighlighting: HighlightLoader | undefined;
 }
 
 const CodeDiffView = React.memo((props: CodeDiffViewProps) => {
@@ -177,9 +200,9 @@ const CodeDiffView = React.memo((props: CodeDiffViewProps) => {
     params,
     ops: initOps,
     afterLines,
-    afterLinesHighlighted,
     beforeLines,
-    beforeLinesHighlighted,
+    charDiffsByRow,
+    loadHighlighting,
   } = props;
   const {expandLines} = params;
   // Clicking a "show more lines" link can change the diffops
@@ -189,6 +212,9 @@ const CodeDiffView = React.memo((props: CodeDiffViewProps) => {
     // this will blow away all "show more lines" actions
     setOps(initOps);
   }, [initOps]);
+  const loadedHighlighting = useLoadedHighlighting(loadHighlighting, ops, beforeLines, afterLines);
+  const beforeLinesHighlighted = props.beforeLinesHighlighted ?? loadedHighlighting?.[0];
+  const afterLinesHighlighted = props.afterLinesHighlighted ?? loadedHighlighting?.[1];
   const [selectedLine, setSelectedLine] = React.useState<number | undefined>();
   const handleShowMore = (existing: SkipRange, num: number) => {
     setOps(oldOps =>
@@ -287,6 +313,11 @@ const CodeDiffView = React.memo((props: CodeDiffViewProps) => {
               beforeHTML={beforeHTML}
               afterText={afterText}
               afterHTML={afterHTML}
+              charDiffs={
+                type === 'replace' && charDiffsByRow
+                  ? charDiffsByRow.get(`${beforeIdx}-${afterIdx}`) ?? null
+                  : undefined
+              }
               isSelected={j === 0 && isSelected}
             />,
           );
@@ -294,7 +325,7 @@ const CodeDiffView = React.memo((props: CodeDiffViewProps) => {
       }
     }
     return rows;
-  }, [ops, beforeLines, afterLines, beforeLinesHighlighted, afterLinesHighlighted, selectedLine, expandLines, handleShowMore]);
+  }, [ops, beforeLines, afterLines, beforeLinesHighlighted, afterLinesHighlighted, charDiffsByRow, selectedLine, expandLines, handleShowMore]);
 
   const [selectingState, setSelectingState] = React.useState<'left' | 'right' | null>(null);
   const handleMouseDown = (e: React.MouseEvent) => {
@@ -0,0 +1,104 @@
+import React from 'react';
+import {DiffRange, LineRange} from './codes';
+import {escapeHtml} from './DiffRow';
+
+/**
+ * Each line is a flattened list of [length, class, length, class, ...]
+ * tokens. Lengths are in UTF-16 code units; a null class is plain text.
+ */
+export interface HighlightedWindow {
+  start: number;
+  end: number;
+  lines: (number | string | null)[][];
+}
+
+/** Fetches syntax highlighting for some lines of one side, e.g. from the server. */
+export type HighlightLoader = (
+  side: 'before' | 'after',
+  ranges: LineRange[],
+) => Promise<HighlightedWindow[]>;
+
+export function tokensToHtml(text: string, tokens: (number | string | null)[]): string {
+  let html = '';
+  let pos = 0;
+  for (let i = 0; i < tokens.length; i += 2) {
+    const length = tokens[i] as number;
+    const className = tokens[i + 1] as string | null;
+    const part = escapeHtml(text.slice(pos, pos + length));
+    html += className ? `<span class="${className}">${part}</span>` : part;
+    pos += length;
+  }
+  return html + escapeHtml(text.slice(pos));
+}
+
+/** The lines which ops show that aren't in requested yet, as ranges. Adds them to requested. */
+function missingRanges(ops: readonly DiffRange[], side: 'before' | 'after', requested: Set<number>) {
+  const ranges: LineRange[] = [];
+  for (const op of ops) {
+    if (op.type === 'skip') continue;
+    const [start, end] = op[side];
+    for (let i = start; i < end; ) {
+      while (i < end && requested.has(i)) i++;
+      const rangeStart = i;
+      while (i < end && !requested.has(i)) requested.add(i++);
+      if (i > rangeStart) {
+        ranges.push([rangeStart, i]);
+      }
+    }
+  }
+  return ranges;
+}
+
+interface Loaded {
+  loader: HighlightLoader;
+  before: string[];
+  after: string[];
+}
+
+/**
+ * Highlighted HTML for the lines which ops show, fetched with loader as they
+ * come into view (e.g. by expanding a skip). Lines which haven't loaded yet
+ * are undefined.
+ */
+export function useLoadedHighlighting(
+  loader: HighlightLoader | undefined,
+  ops: readonly DiffRange[],
+  beforeLines: readonly string[],
+  afterLines: readonly string[],
+): [string[], string[]] | null {
+  const [loaded, setLoaded] = React.useState<Loaded | null>(null);
+  const requested = React.useRef<{loader?: HighlightLoader; before: Set<number>; after: Set<number>}>(
+    {before: new Set(), after: new Set()},
+  );
+
+  React.useEffect(() => {
+    if (!loader) return;
+    if (requested.current.loader !== loader) {
+      requested.current = {loader, before: new Set(), after: new Set()};
+    }
+    for (const side of ['before', 'after'] as const) {
+      const ranges = missingRanges(ops, side, requested.current[side]);
+      if (ranges.length === 0) continue;
+      const lines = side === 'before' ? beforeLines : afterLines;
+      loader(side, ranges).then(
+        windows => {
+          setLoaded(old => {
+            const base = old?.loader === loader ? old : {loader, before: [], after: []};
+            const html = [...base[side]];
+            for (const {start, lines: tokens} of windows) {
+              tokens.forEach((lineTokens, i) => {
+                html[start + i] = tokensToHtml(lines[start + i] ?? '', lineTokens);
+              });
+            }
+            return {...base, [side]: html};
+          });
+        },
+        (e: unknown) => {
+          console.error('Failed to load syntax highlighting:', e);
+        },
+      );
+    }
+  }, [loader, ops, beforeLines, afterLines]);
+
+  return loader && loaded?.loader === loader ? [loaded.before, loaded.after] : null;
+}
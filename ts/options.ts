@@ -23,6 +23,10 @@ export interface WebdiffConfig {
   maxDiffWidth: number;
   theme: string;
   maxLinesForSyntax: number;
+  /** Can files over maxLinesForSyntax be highlighted by the server (--server-highlight)? */
+  serverHighlight?: boolean;
+  /** Is the server watching the directories for changes (--watch)? */
+  watch?: boolean;
 }
 
 export interface ColorsConfig {
@@ -1,5 +1,7 @@
 import {FilePair} from './CodeDiffContainer';
-import {DiffRange} from './codediff/codes';
+import {DiffRange, LineRange} from './codediff/codes';
+import {CharacterDiffRow} from './codediff/char-diffs';
+import {HighlightedWindow} from './codediff/server-highlight';
 import {apiUrl} from './api-utils';
 
 export interface UnifiedFileData {
@@ -9,6 +11,8 @@ export interface UnifiedFileData {
   content_b: string | null;
   diff_ops: DiffRange[];
   diff_error?: string;
+  /** Intra-line diffs for the rows of replace ranges */
+  char_diffs?: CharacterDiffRow[];
 }
 
 /**
@@ -22,6 +26,7 @@ export async function getUnifiedFileData(
 ): Promise<UnifiedFileData> {
   const params = new URLSearchParams();
   params.set('normalize_json', String(normalizeJson));
+  params.set('char_diffs', 'true');
   if (options.length > 0) {
     params.set('options', options.join(','));
   }
@@ -31,19 +36,162 @@ export async function getUnifiedFileData(
     throw new Error(`Failed to fetch file data: ${response.statusText}`);
   }
   
-  const data = await response.json();
-  
-  // Transform the response to match our expected types
+  return toUnifiedFileData((await response.json()) as FileResponse);
+}
+
+// What /file/{idx} and each line of /files return.
+interface FileResponse extends Omit<UnifiedFileData, 'diff_ops'> {
+  diff_ops?: DiffRange[];
+}
+
+// Transform a response to match our expected types
+function toUnifiedFileData(data: FileResponse): UnifiedFileData {
   return {
     idx: data.idx,
     thick: data.thick,
     content_a: data.content_a,
     content_b: data.content_b,
-    diff_ops: data.diff_ops || [],
-    diff_error: data.diff_error
+    diff_ops: data.diff_ops ?? [],
+    diff_error: data.diff_error,
+    char_diffs: data.char_diffs,
   };
 }
 
+interface PendingRequest {
+  idx: number;
+  resolve: (data: UnifiedFileData) => void;
+  reject: (error: unknown) => void;
+}
+
+// Keep each /files URL well under the server's request line limit.
+const MAX_FILES_PER_REQUEST = 200;
+
+// Requests waiting to be sent, keyed by their options.
+const pendingBatches: Map<string, PendingRequest[]> = new Map();
+
+/**
+ * Like getUnifiedFileData, but requests made in the same tick (e.g. by every
+ * file in the multi-file view) are combined into /files requests of up to
+ * MAX_FILES_PER_REQUEST files. The server computes those concurrently and
+ * streams each file back as soon as it's ready.
+ */
+export function loadUnifiedFileData(
+  idx: number,
+  options: string[],
+  normalizeJson: boolean
+): Promise<UnifiedFileData> {
+  const key = `${options.join(',')}-${normalizeJson}`;
+  return new Promise((resolve, reject) => {
+    let batch = pendingBatches.get(key);
+    if (!batch) {
+      const newBatch: PendingRequest[] = [];
+      pendingBatches.set(key, newBatch);
+      setTimeout(() => {
+        pendingBatches.delete(key);
+        for (let i = 0; i < newBatch.length; i += MAX_FILES_PER_REQUEST) {
+          void fetchBatch(newBatch.slice(i, i + MAX_FILES_PER_REQUEST), options, normalizeJson);
+        }
+      }, 0);
+      batch = newBatch;
+    }
+    batch.push({idx, resolve, reject});
+  });
+}
+
+async function fetchBatch(batch: PendingRequest[], options: string[], normalizeJson: boolean) {
+  if (batch.length === 1) {
+    const {idx, resolve, reject} = batch[0];
+    getUnifiedFileData(idx, options, normalizeJson).then(resolve, reject);
+    return;
+  }
+
+  const waiting: Map<number, PendingRequest[]> = new Map();
+  for (const request of batch) {
+    waiting.set(request.idx, [...(waiting.get(request.idx) ?? []), request]);
+  }
+  const params = new URLSearchParams();
+  params.set('indices', [...waiting.keys()].join(','));
+  params.set('normalize_json', String(normalizeJson));
+  params.set('char_diffs', 'true');
+  if (options.length > 0) {
+    params.set('options', options.join(','));
+  }
+
+  try {
+    const response = await fetch(apiUrl(`/files?${params}`));
+    if (!response.ok || !response.body) {
+      throw new Error(`Failed to fetch file data: ${response.statusText}`);
+    }
+    // Each line is one file's data, in whatever order they finish.
+    const reader = response.body.getReader();
+    const decoder = new TextDecoder();
+    let buffer = '';
+    for (;;) {
+      const {done, value} = await reader.read();
+      buffer += decoder.decode(value, {stream: !done});
+      let newline;
+      while ((newline = buffer.indexOf('\n')) >= 0) {
+        const data = JSON.parse(buffer.slice(0, newline)) as FileResponse & {error?: string};
+        buffer = buffer.slice(newline + 1);
+        for (const {resolve, reject} of waiting.get(data.idx) ?? []) {
+          if (data.error) {
+            reject(new Error(data.error));
+          } else {
+            resolve(toUnifiedFileData(data));
+          }
+        }
+        waiting.delete(data.idx);
+      }
+      if (done) break;
+    }
+    if (waiting.size > 0) {
+      throw new Error('Incomplete response from /files');
+    }
+  } catch (e) {
+    for (const requests of waiting.values()) {
+      for (const {reject} of requests) {
+        reject(e);
+      }
+    }
+  }
+}
+
+// Keep URLs well under the server's limits.
+const MAX_RANGES_PER_REQUEST = 500;
+
+/**
+ * Fetches syntax highlighting computed by the server (--server-highlight) for
+ * some lines of one side of a file.
+ */
+export async function getHighlighting(
+  idx: number,
+  side: 'a' | 'b',
+  ranges: LineRange[],
+  normalizeJson: boolean,
+): Promise<HighlightedWindow[]> {
+  const requests = [];
+  for (let i = 0; i < ranges.length; i += MAX_RANGES_PER_REQUEST) {
+    const params = new URLSearchParams();
+    params.set(
+      'ranges',
+      ranges
+        .slice(i, i + MAX_RANGES_PER_REQUEST)
+        .map(([start, end]) => `${start}-${end}`)
+        .join(','),
+    );
+    params.set('normalize_json', String(normalizeJson));
+    requests.push(
+      fetch(apiUrl(`/file/${idx}/highlight/${side}?${params}`)).then(async response => {
+        if (!response.ok) {
+          throw new Error(`Failed to fetch highlighting: ${response.statusText}`);
+        }
+        return ((await response.json()) as {windows: HighlightedWindow[]}).windows;
+      }),
+    );
+  }
+  return (await Promise.all(requests)).flat();
+}
+
 // Cache for unified file data
 const unifiedCache: Map<string, UnifiedFileData> = new Map();
 
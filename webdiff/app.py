@@ -1,6 +1,9 @@
 #!/usr/bin/env python
 
+import asyncio
+import contextlib
 import dataclasses
+import hashlib
 import json
 import logging
 import mimetypes
@@ -9,19 +12,21 @@ import socket
 import sys
 import threading
 import time
+from concurrent.futures import ThreadPoolExecutor
 from typing import Optional
 
 from fastapi import FastAPI, Request, Form
 from fastapi.middleware.gzip import GZipMiddleware
-from fastapi.responses import FileResponse, HTMLResponse, JSONResponse, PlainTextResponse, Response
+from fastapi.responses import FileResponse, HTMLResponse, JSONResponse, PlainTextResponse, Response, StreamingResponse
 from fastapi.staticfiles import StaticFiles
 from starlette.middleware.base import BaseHTTPMiddleware
+from starlette.middleware.gzip import GZipResponder
 from starlette.requests import ClientDisconnect
+from starlette.background import BackgroundTask
 from starlette.datastructures import Headers
-from binaryornot.check import is_binary
 import uvicorn
 
-from . import argparser, diff, dirdiff, util
+from . import argparser, binarydiff, cache, chardiff, diff, dirdiff, diskcache, gitobjects, highlight, imagevariant, lineindex, pdiff, precompute, scratch, util, watch
 
 def determine_path():
     """Borrowed from wxglade.py"""
@@ -41,6 +46,13 @@ DIFF = None
 PORT = None
 HOSTNAME = 'localhost'
 DEBUG = os.environ.get('DEBUG')
+RESPONSE_CACHE = None
+PRECOMPUTER = None
+EXECUTOR = None
+WATCHER = None
+# (event loop, asyncio.Queue) for each browser listening on /events.
+SUBSCRIBERS = set()
+SSE_KEEPALIVE_SECS = 15
 WEBDIFF_DIR = determine_path()
 
 class ClientDisconnectMiddleware(BaseHTTPMiddleware):
@@ -53,6 +65,28 @@ class ClientDisconnectMiddleware(BaseHTTPMiddleware):
             # Client disconnected, just return a simple response
             return JSONResponse({'error': 'Client disconnected'}, status_code=499)
 
+class FlushingGZipResponder(GZipResponder):
+    """Compresses each chunk of a streaming response as it's sent.
+
+    GZipResponder holds a stream's output back until zlib has filled a
+    block, so NDJSON lines wouldn't reach the browser as they're ready.
+    """
+    def apply_compression(self, body: bytes, *, more_body: bool) -> bytes:
+        if more_body:
+            self.gzip_file.write(body)
+            self.gzip_file.flush()  # zlib.Z_SYNC_FLUSH
+            body = b''
+        return super().apply_compression(body, more_body=more_body)
+
+class StreamingGZipMiddleware(GZipMiddleware):
+    """GZipMiddleware which compresses streamed responses chunk by chunk."""
+    async def __call__(self, scope, receive, send):
+        if scope['type'] == 'http' and 'gzip' in Headers(scope=scope).get('Accept-Encoding', ''):
+            responder = FlushingGZipResponder(self.app, self.minimum_size, compresslevel=self.compresslevel)
+            await responder(scope, receive, send)
+        else:
+            await super().__call__(scope, receive, send)
+
 class CachedStaticFiles(StaticFiles):
     """Static files handler with caching headers."""
     async def get_response(self, path: str, scope):
@@ -71,13 +105,333 @@ class CachedStaticFiles(StaticFiles):
 
         return response
 
+def file_diff_options(options: Optional[str]) -> list[str]:
+    """Combine the comma-separated options from a request with the configured extras."""
+    diff_options = options.split(',') if options else []
+    extra_args = SERVER_CONFIG['webdiff'].get('extraFileDiffArgs', '')
+    if extra_args:
+        diff_options += extra_args.split(' ')
+    return diff_options
+
+
+def binary_placeholder(data) -> Optional[str]:
+    """Returns the text to show in place of binary contents, or None for text."""
+    if binarydiff.is_binary_data(data):
+        return f'Binary file ({len(data)} bytes)'
+    return None
+
+
+def side_placeholder(path: str) -> Optional[str]:
+    """Returns the text to show in place of a binary file, or None for a text file."""
+    with lineindex.file_buffer(path) as data:
+        return binary_placeholder(data)
+
+
+def read_side(path: str, normalize_json: bool) -> str:
+    try:
+        # The binary check and the UTF-8 decoding share one (possibly mmap'd) read.
+        with lineindex.file_buffer(path) as data:
+            placeholder = binary_placeholder(data)
+            if placeholder is not None:
+                return placeholder
+            if normalize_json and (normalized := util.normalized_json_bytes(path)) is not None:
+                return normalized.decode('utf8')
+            return lineindex.decode(data)
+    except Exception as e:
+        return f'Error reading file: {str(e)}'
+
+
+def side_line_index(path: str, normalize_json: bool) -> lineindex.LineIndex:
+    """A LineIndex for one side, over its normalized contents if it's JSON and normalize_json."""
+    if normalize_json and (normalized := util.normalized_json_bytes(path)) is not None:
+        return lineindex.LineIndex(path, normalized)
+    return lineindex.line_index(path)
+
+
+def compute_diff_ops(file_pair, diff_options: list[str], normalize_json: bool) -> dict:
+    """Returns the diff_ops (or diff_error) fields of a /file response."""
+    backend = SERVER_CONFIG['webdiff'].get('diffBackend', 'git')
+    try:
+        return {
+            'diff_ops': [
+                dataclasses.asdict(op)
+                for op in diff.get_diff_ops(
+                    file_pair, diff_options, normalize_json=normalize_json, backend=backend
+                )
+            ]
+        }
+    except Exception as e:
+        # Still return file contents even if diff fails
+        return {'diff_ops': [], 'diff_error': str(e)}
+
+
+def render_file_response(
+    diffs: list, idx: int, normalize_json: bool = False, options: Optional[str] = None, char_diffs: bool = False
+) -> bytes:
+    """Returns the JSON body for /file/{idx}, from the response cache if possible.
+
+    diffs is the DIFF which the request was checked against. --watch can swap
+    in a new DIFF at any time, so the render functions never read it again.
+
+    With char_diffs, this includes the intra-line diffs for the rows of
+    replace ranges (see chardiff.replace_char_diffs).
+    """
+    file_pair = diffs[idx]
+    diff_options = file_diff_options(options)
+
+    # Identical requests for unchanged files get the same bytes back.
+    cache_key = (
+        idx,
+        file_pair.a_path,
+        file_pair.b_path,
+        cache.file_identity(file_pair.a_path),
+        cache.file_identity(file_pair.b_path),
+        tuple(diff_options),
+        normalize_json,
+        char_diffs,
+        SERVER_CONFIG['webdiff'].get('diffBackend', 'git'),
+    )
+    body = RESPONSE_CACHE.get(cache_key)
+    if body is not None:
+        return body
+
+    response = {
+        'idx': idx,
+        'thick': diff.get_thick_dict(file_pair),
+        'content_a': read_side(file_pair.a_path, normalize_json) if file_pair.a else None,
+        'content_b': read_side(file_pair.b_path, normalize_json) if file_pair.b else None,
+    }
+    response.update(compute_diff_ops(file_pair, diff_options, normalize_json))
+    if diff.is_binary_diff(file_pair):
+        response['binary'] = {
+            'a': binarydiff.side_info(file_pair.a_path),
+            'b': binarydiff.side_info(file_pair.b_path),
+        }
+        if char_diffs:
+            response['char_diffs'] = []
+    elif char_diffs:
+        response['char_diffs'] = chardiff.replace_char_diffs(
+            response['diff_ops'], response['content_a'], response['content_b']
+        )
+
+    body = JSONResponse(response).body
+    RESPONSE_CACHE.put(cache_key, body)
+    return body
+
+
+def render_hunks_response(
+    diffs: list, idx: int, normalize_json: bool = False, options: Optional[str] = None, context: int = 0
+) -> dict:
+    """Like render_file_response, but only includes the lines around changes.
+
+    Each side's content is a list of {"start", "end", "text"} windows covering
+    the non-skip diff ops plus context extra lines. Skipped lines can be
+    fetched later through render_lines_response.
+    """
+    file_pair = diffs[idx]
+    response = {'idx': idx, 'thick': diff.get_thick_dict(file_pair)}
+    response.update(compute_diff_ops(file_pair, file_diff_options(options), normalize_json))
+    shown = [op for op in response['diff_ops'] if op['type'] != 'skip']
+
+    for side, present, path in (('a', file_pair.a, file_pair.a_path), ('b', file_pair.b, file_pair.b_path)):
+        response[f'num_lines_{side}'] = 0
+        response[f'lines_{side}'] = None
+        if not present:
+            continue
+        try:
+            placeholder = side_placeholder(path)
+            if placeholder is not None:
+                response[f'num_lines_{side}'] = 1
+                response[f'lines_{side}'] = [{'start': 0, 'end': 1, 'text': placeholder}]
+                continue
+            index = side_line_index(path, normalize_json)
+            ranges = [tuple(op['before' if side == 'a' else 'after']) for op in shown]
+            response[f'num_lines_{side}'] = index.num_lines
+            response[f'lines_{side}'] = [
+                {'start': start, 'end': end, 'text': index.read(start, end)}
+                for start, end in lineindex.merge_ranges(ranges, context, index.num_lines)
+            ]
+        except Exception as e:
+            response[f'lines_{side}'] = [{'start': 0, 'end': 1, 'text': f'Error reading file: {str(e)}'}]
+    return response
+
+
+def render_lines_response(
+    diffs: list, idx: int, side: str, start: int, end: int, normalize_json: bool = False
+) -> dict:
+    """Returns lines [start, end) of one side of a file pair."""
+    file_pair = diffs[idx]
+    path = file_pair.a_path if side == 'a' else file_pair.b_path
+    index = side_line_index(path, normalize_json)
+    start = max(0, min(start, index.num_lines))
+    end = max(start, min(end, index.num_lines))
+    return {'idx': idx, 'side': side, 'start': start, 'end': end, 'text': index.read(start, end)}
+
+
+def render_highlight_response(
+    diffs: list, idx: int, side: str, ranges: list, normalize_json: bool = False
+) -> bytes:
+    """Returns the JSON body for /file/{idx}/highlight/{side}."""
+    file_pair = diffs[idx]
+    path = file_pair.a_path if side == 'a' else file_pair.b_path
+    name = file_pair.a if side == 'a' else file_pair.b
+    # Tokens are cached by content; the name picks the lexer.
+    key = (diskcache.content_digest(path), normalize_json, name)
+    language, windows = highlight.render_windows(key, name, lambda: read_side(path, normalize_json), ranges)
+    return b'{"idx":%d,"side":"%s","language":%s,"windows":%s}' % (
+        idx,
+        side.encode('ascii'),
+        json.dumps(language).encode('utf8'),
+        windows,
+    )
+
+
+def render_file_line(
+    diffs: list, idx: int, normalize_json: bool = False, options: Optional[str] = None, char_diffs: bool = False
+) -> bytes:
+    """One line of a /files response: the /file/{idx} body, or an error for idx."""
+    try:
+        body = render_file_response(diffs, idx, normalize_json, options, char_diffs)
+    except Exception as e:
+        body = JSONResponse({'idx': idx, 'error': str(e)}).body
+    return body + b'\n'
+
+
+STREAM_CHUNK_BYTES = 1024 * 1024
+
+
+def stream_file_response(diffs: list, idx: int, normalize_json: bool = False, options: Optional[str] = None):
+    """Yields the /file/{idx} data as newline-delimited JSON.
+
+    The first line carries the metadata and diff ops. File contents follow
+    in chunks of about STREAM_CHUNK_BYTES, split after newlines, as
+    {"side": "a"|"b", "chunk": ...} lines. A final {"done": true} line
+    marks the end, so that clients can detect a truncated stream.
+    """
+    file_pair = diffs[idx]
+    header = {'idx': idx, 'thick': diff.get_thick_dict(file_pair)}
+    header.update(compute_diff_ops(file_pair, file_diff_options(options), normalize_json))
+    yield json.dumps(header) + '\n'
+
+    for side, present, path in (('a', file_pair.a, file_pair.a_path), ('b', file_pair.b, file_pair.b_path)):
+        if not present:
+            continue
+        try:
+            placeholder = side_placeholder(path)
+            if placeholder is not None:
+                yield json.dumps({'side': side, 'chunk': placeholder}) + '\n'
+                continue
+            if normalize_json and (normalized := util.normalized_json_bytes(path)) is not None:
+                buffer = contextlib.nullcontext(normalized)
+            else:
+                buffer = lineindex.file_buffer(path)
+            with buffer as data:
+                for chunk in lineindex.decode_chunks(data, STREAM_CHUNK_BYTES):
+                    yield json.dumps({'side': side, 'chunk': chunk}) + '\n'
+        except Exception as e:
+            yield json.dumps({'side': side, 'chunk': f'Error reading file: {str(e)}'}) + '\n'
+
+    yield json.dumps({'done': True}) + '\n'
+
+
+async def run_blocking(fn, *args):
+    """Run a blocking call (diffing, file IO, ImageMagick) on the worker pool.
+
+    The pool size caps how many of these run at once, and keeps them from
+    stalling the event loop while they do.
+    """
+    return await asyncio.get_running_loop().run_in_executor(EXECUTOR, fn, *args)
+
+
+async def iterate_blocking(gen):
+    """Iterate a blocking generator on the worker pool, one item at a time."""
+    try:
+        while (item := await run_blocking(next, gen, None)) is not None:
+            yield item
+    finally:
+        gen.close()
+
+
+def start_precomputer():
+    global PRECOMPUTER
+    # Warm the cache for the requests the frontend makes by default.
+    diffs = DIFF
+    PRECOMPUTER = precompute.Precomputer(
+        len(diffs),
+        lambda idx: render_file_response(diffs, idx, char_diffs=True),
+        EXECUTOR,
+        SERVER_CONFIG['webdiff'].get('precomputeWorkers', 4),
+        # Leave the other half for the user's own requests (other options etc.).
+        max_bytes=RESPONSE_CACHE.max_bytes // 2,
+    )
+    PRECOMPUTER.start()
+
+
+def publish_event(event: dict):
+    """Send an event to every browser listening on /events. Safe to call from any thread."""
+    data = json.dumps(event)
+    for loop, queue in list(SUBSCRIBERS):
+        loop.call_soon_threadsafe(queue.put_nowait, data)
+
+
+def refresh_diff(a_dir: str, b_dir: str, changed_paths: Optional[set]):
+    """Bring DIFF up to date after the watcher saw changes to some files."""
+    global DIFF
+    old_diff = DIFF
+    new_diff, changed = dirdiff.rediff(old_diff, a_dir, b_dir, changed_paths, SERVER_CONFIG['webdiff'])
+    if not changed and len(new_diff) == len(old_diff):
+        return
+    DIFF = new_diff
+    logging.info(f'{len(changed_paths or ())} changed files; {len(changed)} entries to refresh')
+
+    # Cached responses are keyed on file identities, so they'd miss anyway;
+    # dropping them frees the space for the new versions.
+    if changed_paths is None:
+        RESPONSE_CACHE.clear()
+    else:
+        stale = set(changed_paths)
+        for diffs in (old_diff, new_diff):
+            stale.update(p for i in changed if i < len(diffs) for p in (diffs[i].a_path, diffs[i].b_path))
+        RESPONSE_CACHE.invalidate(lambda key: any(part in stale for part in key[1:3]))
+
+    if PRECOMPUTER:
+        PRECOMPUTER.stop()
+        start_precomputer()
+    publish_event({'pairs': diff.get_thin_list(new_diff), 'changed': changed})
+
+
+def side_paths(file_pair) -> tuple:
+    """Both sides' paths; for a git diff, this reads the blobs out of the object store."""
+    return file_pair.a_path, file_pair.b_path
+
+
+def git_object_error_response(e: Exception) -> JSONResponse:
+    return JSONResponse({'error': f'Unable to read file from git: {e}'}, status_code=502)
+
+
+def pdiff_image_path(a_path: str, b_path: str) -> str:
+    """Returns the dilated pdiff image, acquired so it isn't evicted while being served."""
+    path = util.generate_dilated_pdiff_image(a_path, b_path)
+    scratch.acquire(path)
+    return path
+
+
 def create_app(root_path: str = "") -> FastAPI:
     """Create and configure the FastAPI app with the given root_path."""
+    global RESPONSE_CACHE, EXECUTOR
     app = FastAPI(root_path=root_path)
 
+    EXECUTOR = ThreadPoolExecutor(
+        max_workers=SERVER_CONFIG.get('webdiff', {}).get('maxWorkers', 8),
+        thread_name_prefix='webdiff-worker',
+    )
+
+    cache_mb = SERVER_CONFIG.get('webdiff', {}).get('cacheSizeMb', 64)
+    RESPONSE_CACHE = cache.ByteLRUCache(cache_mb * 1024 * 1024)
+
     # Add middlewares
     app.add_middleware(ClientDisconnectMiddleware)  # Handle client disconnects
-    app.add_middleware(GZipMiddleware)  # Compress responses
+    app.add_middleware(StreamingGZipMiddleware)  # Compress responses
 
     # Mount static files
     static_dir = os.path.join(WEBDIFF_DIR, 'static')
@@ -89,6 +443,11 @@ def create_app(root_path: str = "") -> FastAPI:
 
     app.mount("/static", CachedStaticFiles(directory=static_dir), name="static")
 
+    @app.exception_handler(gitobjects.GitObjectError)
+    async def handle_git_object_error(request: Request, e: gitobjects.GitObjectError):
+        # e.g. a blob which was pruned, or a cat-file process which died.
+        return git_object_error_response(e)
+
     @app.get("/favicon.ico")
     async def handle_favicon():
         favicon_path = os.path.join(WEBDIFF_DIR, 'static/img/favicon.ico')
@@ -147,6 +506,73 @@ def create_app(root_path: str = "") -> FastAPI:
             return JSONResponse({'error': str(e)}, status_code=500)
 
 
+    # These have to come before /{idx}, which would otherwise match them.
+    @app.get("/files")
+    async def get_files(
+        indices: str,
+        normalize_json: bool = False,
+        options: Optional[str] = None,
+        char_diffs: bool = False,
+    ):
+        """Several /file/{idx} responses at once, as newline-delimited JSON.
+
+        indices is comma-separated. The files are computed concurrently and
+        each line is sent as soon as its file is ready, so they can arrive in
+        any order; each one has its idx. A file which fails to load gets an
+        {"idx", "error"} line instead.
+        """
+        try:
+            idxs = list(dict.fromkeys(int(x) for x in indices.split(',') if x))
+        except ValueError:
+            return JSONResponse({'error': f'Invalid indices {indices}'}, status_code=400)
+        diffs = DIFF
+        for idx in idxs:
+            if idx < 0 or idx >= len(diffs):
+                return JSONResponse({'error': f'Invalid index {idx}'}, status_code=400)
+
+        async def lines():
+            pending = [
+                asyncio.ensure_future(run_blocking(render_file_line, diffs, idx, normalize_json, options, char_diffs))
+                for idx in idxs
+            ]
+            try:
+                for line in asyncio.as_completed(pending):
+                    yield await line
+            finally:
+                # Don't keep computing files for a client which went away.
+                for future in pending:
+                    future.cancel()
+
+        return StreamingResponse(lines(), media_type='application/x-ndjson')
+
+    @app.get("/events")
+    async def handle_events():
+        """Server-sent events with the new file list whenever --watch sees a change.
+
+        Each "diff" event's data is {"pairs": [...], "changed": [idx, ...]},
+        where changed lists the entries which need to be fetched again.
+        """
+        queue = asyncio.Queue()
+        subscriber = (asyncio.get_running_loop(), queue)
+        SUBSCRIBERS.add(subscriber)
+
+        async def events():
+            try:
+                yield 'retry: 2000\n\n'
+                while True:
+                    try:
+                        data = await asyncio.wait_for(queue.get(), SSE_KEEPALIVE_SECS)
+                    except asyncio.TimeoutError:
+                        yield ': keepalive\n\n'
+                        continue
+                    yield f'event: diff\ndata: {data}\n\n'
+            finally:
+                SUBSCRIBERS.discard(subscriber)
+
+        return StreamingResponse(
+            events(), media_type='text/event-stream', headers={'Cache-Control': 'no-cache'}
+        )
+
     @app.get("/")
     @app.get("/{idx}")
     async def handle_index(request: Request, idx: Optional[int] = None):
@@ -177,7 +603,8 @@ def create_app(root_path: str = "") -> FastAPI:
                 # Inject the root path into the data
                 data = {
                     'idx': idx if idx is not None else 0,
-                    'has_magick': util.is_imagemagick_available(),
+                    # Perceptual diffs are made in-process with Pillow, or with ImageMagick.
+                    'has_magick': pdiff.is_available() or util.is_imagemagick_available(),
                     'pairs': diff.get_thin_list(DIFF),
                     'server_config': SERVER_CONFIG,
                     'root_path': app.root_path,
@@ -200,97 +627,227 @@ def create_app(root_path: str = "") -> FastAPI:
     async def get_file_complete(
         idx: int,
         normalize_json: bool = False,
-        options: Optional[str] = None  # Comma-separated diff options
+        options: Optional[str] = None,  # Comma-separated diff options
+        char_diffs: bool = False,  # Include intra-line diffs for replace rows
     ):
         """Get all data needed to render a file diff in one request."""
-        global DIFF, SERVER_CONFIG
+        diffs = DIFF
 
         # Validate index
-        if idx < 0 or idx >= len(DIFF):
+        if idx < 0 or idx >= len(diffs):
             return JSONResponse({'error': f'Invalid index {idx}'}, status_code=400)
 
-        file_pair = DIFF[idx]
+        if PRECOMPUTER:
+            PRECOMPUTER.focus(idx)
+        body = await run_blocking(render_file_response, diffs, idx, normalize_json, options, char_diffs)
+        return Response(content=body, media_type='application/json')
 
-        # Get thick data (metadata)
-        thick_data = diff.get_thick_dict(file_pair)
+    @app.get("/file/{idx}/stream")
+    async def get_file_stream(
+        idx: int,
+        normalize_json: bool = False,
+        options: Optional[str] = None
+    ):
+        """Like /file/{idx}, but streamed as NDJSON so large files never sit in memory whole."""
+        diffs = DIFF
+        if idx < 0 or idx >= len(diffs):
+            return JSONResponse({'error': f'Invalid index {idx}'}, status_code=400)
 
-        # Prepare response
-        response = {
-            'idx': idx,
-            'thick': thick_data,
-            'content_a': None,
-            'content_b': None,
-            'diff_ops': []
-        }
+        if PRECOMPUTER:
+            PRECOMPUTER.focus(idx)
+        # Once the stream has started, an error can't change its status.
+        await run_blocking(side_paths, diffs[idx])
+        return StreamingResponse(
+            iterate_blocking(stream_file_response(diffs, idx, normalize_json, options)),
+            media_type='application/x-ndjson',
+        )
 
-        # Get content for side A
-        if file_pair.a:
-            try:
-                abs_path_a = file_pair.a_path
-                if is_binary(abs_path_a):
-                    response['content_a'] = f'Binary file ({os.path.getsize(abs_path_a)} bytes)'
-                else:
-                    path_to_read = util.normalize_json(abs_path_a) if normalize_json else abs_path_a
-                    with open(path_to_read, 'r') as f:
-                        response['content_a'] = f.read()
-            except Exception as e:
-                response['content_a'] = f'Error reading file: {str(e)}'
-
-        # Get content for side B
-        if file_pair.b:
-            try:
-                abs_path_b = file_pair.b_path
-                if is_binary(abs_path_b):
-                    response['content_b'] = f'Binary file ({os.path.getsize(abs_path_b)} bytes)'
-                else:
-                    path_to_read = util.normalize_json(abs_path_b) if normalize_json else abs_path_b
-                    with open(path_to_read, 'r') as f:
-                        response['content_b'] = f.read()
-            except Exception as e:
-                response['content_b'] = f'Error reading file: {str(e)}'
+    @app.get("/file/{idx}/hunks")
+    async def get_file_hunks(
+        idx: int,
+        normalize_json: bool = False,
+        options: Optional[str] = None,
+        context: int = 0,
+    ):
+        """Like /file/{idx}, but only sends the lines that aren't skipped."""
+        diffs = DIFF
+        if idx < 0 or idx >= len(diffs):
+            return JSONResponse({'error': f'Invalid index {idx}'}, status_code=400)
+        if context < 0:
+            return JSONResponse({'error': f'Invalid context {context}'}, status_code=400)
+
+        if PRECOMPUTER:
+            PRECOMPUTER.focus(idx)
+        response = await run_blocking(render_hunks_response, diffs, idx, normalize_json, options, context)
+        return JSONResponse(response)
+
+    @app.get("/file/{idx}/lines/{side}")
+    async def get_file_lines(
+        idx: int,
+        side: str,
+        start: int,
+        end: int,
+        normalize_json: bool = False,
+    ):
+        """Fetch lines [start, end) of one side, e.g. to expand a skipped region."""
+        diffs = DIFF
+        if idx < 0 or idx >= len(diffs):
+            return JSONResponse({'error': f'Invalid index {idx}'}, status_code=400)
+        if side not in ('a', 'b'):
+            return JSONResponse({'error': f'Invalid side {side}'}, status_code=400)
+        file_pair = diffs[idx]
+        if not (file_pair.a if side == 'a' else file_pair.b):
+            return JSONResponse({'error': f'Side {side} does not exist'}, status_code=400)
 
-        # Get diff operations
         try:
-            diff_options = options.split(',') if options else []
-            extra_args = SERVER_CONFIG['webdiff'].get('extraFileDiffArgs', '')
-            if extra_args:
-                diff_options += extra_args.split(' ')
+            response = await run_blocking(render_lines_response, diffs, idx, side, start, end, normalize_json)
+        except gitobjects.GitObjectError as e:
+            return git_object_error_response(e)
+        except Exception as e:
+            return JSONResponse({'error': str(e)}, status_code=500)
+        return JSONResponse(response)
 
-            diff_ops = [
-                dataclasses.asdict(op)
-                for op in diff.get_diff_ops(file_pair, diff_options, normalize_json=normalize_json)
-            ]
-            response['diff_ops'] = diff_ops
+    @app.get("/file/{idx}/hex")
+    async def get_file_hex(idx: int, offset: Optional[int] = None, length: int = 256):
+        """A window of the bytes of both sides as hex, by default at the first difference."""
+        diffs = DIFF
+        if idx < 0 or idx >= len(diffs):
+            return JSONResponse({'error': f'Invalid index {idx}'}, status_code=400)
+        if length <= 0 or (offset is not None and offset < 0):
+            return JSONResponse({'error': 'Invalid offset or length'}, status_code=400)
+        file_pair = diffs[idx]
+
+        def window():
+            return binarydiff.hex_window(file_pair.a_path, file_pair.b_path, offset, length)
+
+        try:
+            response = await run_blocking(window)
+        except gitobjects.GitObjectError as e:
+            return git_object_error_response(e)
         except Exception as e:
-            # Still return file contents even if diff fails
-            response['diff_error'] = str(e)
+            return JSONResponse({'error': str(e)}, status_code=500)
+        return JSONResponse({'idx': idx, **response})
 
-        return JSONResponse(response)
+    @app.get("/file/{idx}/highlight/{side}")
+    async def get_file_highlight(
+        idx: int,
+        side: str,
+        ranges: str,  # Comma-separated start-end line ranges, e.g. 0-100,250-300
+        normalize_json: bool = False,
+    ):
+        """Syntax highlighting for some lines of one side, for files too big to highlight in the browser."""
+        diffs = DIFF
+        if not SERVER_CONFIG['webdiff'].get('serverHighlight'):
+            return JSONResponse({'error': 'Server-side highlighting is off'}, status_code=400)
+        if idx < 0 or idx >= len(diffs):
+            return JSONResponse({'error': f'Invalid index {idx}'}, status_code=400)
+        if side not in ('a', 'b'):
+            return JSONResponse({'error': f'Invalid side {side}'}, status_code=400)
+        file_pair = diffs[idx]
+        if not (file_pair.a if side == 'a' else file_pair.b):
+            return JSONResponse({'error': f'Side {side} does not exist'}, status_code=400)
+        try:
+            parsed_ranges = [tuple(int(x) for x in r.split('-')) for r in ranges.split(',') if r]
+            if any(len(r) != 2 for r in parsed_ranges):
+                raise ValueError(ranges)
+        except ValueError:
+            return JSONResponse({'error': f'Invalid ranges {ranges}'}, status_code=400)
+
+        try:
+            body = await run_blocking(render_highlight_response, diffs, idx, side, parsed_ranges, normalize_json)
+        except gitobjects.GitObjectError as e:
+            return git_object_error_response(e)
+        except Exception as e:
+            return JSONResponse({'error': str(e)}, status_code=500)
+        return Response(content=body, media_type='application/json')
+
+    @app.get("/raw/{side}/{idx}")
+    async def handle_raw(idx: int, side: str):
+        """The bytes of one side of a file, as they are on disk. Supports Range requests."""
+        diffs = DIFF
+        if idx < 0 or idx >= len(diffs):
+            return JSONResponse({'error': f'Invalid index {idx}'}, status_code=400)
+        if side not in ('a', 'b'):
+            return JSONResponse({'error': f'Invalid side {side}'}, status_code=400)
+        file_pair = diffs[idx]
+        if not (file_pair.a if side == 'a' else file_pair.b):
+            return JSONResponse({'error': f'Side {side} does not exist'}, status_code=400)
+        # For a git diff, the a_path/b_path property writes the blob out of the
+        # object store on first access, so it's read on the pool.
+        path = await run_blocking(getattr, file_pair, f'{side}_path')
+        # Never let the browser render (e.g. HTML from) the diff as a page of this origin.
+        return FileResponse(
+            path, media_type='application/octet-stream', headers={'X-Content-Type-Options': 'nosniff'}
+        )
+
+    @app.get("/cache/stats")
+    async def handle_cache_stats():
+        return JSONResponse(RESPONSE_CACHE.stats())
 
     @app.get("/{side}/image/{path:path}")
-    async def handle_get_image(side: str, path: str):
-        global DIFF
+    async def handle_get_image(
+        request: Request,
+        side: str,
+        path: str,
+        max_size: Optional[int] = None,
+        format: Optional[str] = None,
+        region: Optional[str] = None,
+    ):
+        """Serve an image, or a resized/re-encoded/cropped variant of it.
+
+        max_size bounds both dimensions, format is png, jpeg or webp and
+        region=left,top,width,height crops at full resolution (e.g. for zoom).
+        """
+        diffs = DIFF
         mime_type, _ = mimetypes.guess_type(path)
         if not mime_type or not mime_type.startswith('image/'):
             return JSONResponse({'error': 'wrong type'}, status_code=400)
 
-        idx = diff.find_diff_index(DIFF, side, path)
+        idx = diff.find_diff_index(diffs, side, path)
         if idx is None:
             return JSONResponse({'error': 'not found'}, status_code=400)
 
-        d = DIFF[idx]
+        d = diffs[idx]
         abs_path = d.a_path if side == 'a' else d.b_path
-        return FileResponse(abs_path, media_type=mime_type)
+        if max_size is None and format is None and region is None:
+            return FileResponse(abs_path, media_type=mime_type)
+
+        try:
+            spec = imagevariant.VariantSpec.parse(max_size, format, region)
+        except imagevariant.VariantError as e:
+            return JSONResponse({'error': str(e)}, status_code=400)
+
+        # The key changes whenever the file does, so it doubles as the ETag.
+        cache_key = ('image', abs_path, cache.file_identity(abs_path), spec)
+        etag = '"%s"' % hashlib.sha1(repr(cache_key).encode('utf8')).hexdigest()
+        headers = {'ETag': etag, 'Cache-Control': 'private, no-cache'}
+        if request.headers.get('if-none-match') == etag:
+            return Response(status_code=304, headers=headers)
+
+        media_type = imagevariant.FORMATS[spec.format or 'png'][1]
+        body = RESPONSE_CACHE.get(cache_key)
+        if body is None:
+            try:
+                body, media_type = await run_blocking(imagevariant.render, abs_path, spec)
+            except imagevariant.ImageTooLargeError as e:
+                return JSONResponse({'error': str(e)}, status_code=413)
+            except imagevariant.VariantError as e:
+                return JSONResponse({'error': str(e)}, status_code=400)
+            RESPONSE_CACHE.put(cache_key, body)
+        return Response(content=body, media_type=media_type, headers=headers)
 
 
     @app.get("/pdiff/{idx}")
     async def handle_pdiff(idx: int):
-        global DIFF
-        d = DIFF[idx]
+        diffs = DIFF
+        if idx < 0 or idx >= len(diffs):
+            return JSONResponse({'error': f'Invalid index {idx}'}, status_code=400)
+        d = diffs[idx]
         try:
-            _, pdiff_image = util.generate_pdiff_image(d.a_path, d.b_path)
-            dilated_image_path = util.generate_dilated_pdiff_image(pdiff_image)
-            return FileResponse(dilated_image_path)
+            dilated_image_path = await run_blocking(pdiff_image_path, d.a_path, d.b_path)
+            return FileResponse(
+                dilated_image_path, background=BackgroundTask(scratch.release, dilated_image_path)
+            )
         except util.ImageMagickNotAvailableError:
             return Response(content='ImageMagick is not available', status_code=501)
         except util.ImageMagickError as e:
@@ -299,11 +856,12 @@ def create_app(root_path: str = "") -> FastAPI:
 
     @app.get("/pdiffbbox/{idx}")
     async def handle_pdiff_bbox(idx: int):
-        global DIFF
-        d = DIFF[idx]
+        diffs = DIFF
+        if idx < 0 or idx >= len(diffs):
+            return JSONResponse({'error': f'Invalid index {idx}'}, status_code=400)
+        d = diffs[idx]
         try:
-            _, pdiff_image = util.generate_pdiff_image(d.a_path, d.b_path)
-            bbox = util.get_pdiff_bbox(pdiff_image)
+            bbox = await run_blocking(util.get_pdiff_bbox, d.a_path, d.b_path)
             return JSONResponse(bbox)
         except util.ImageMagickNotAvailableError:
             return JSONResponse('ImageMagick is not available', status_code=501)
@@ -331,7 +889,7 @@ def find_port(webdiff_config):
 
 
 def run():
-    global DIFF, PORT, HOSTNAME, SERVER_CONFIG
+    global DIFF, PORT, HOSTNAME, SERVER_CONFIG, WATCHER
     try:
         parsed_args = argparser.parse(sys.argv[1:])
     except argparser.UsageError as e:
@@ -347,7 +905,21 @@ def run():
     if parsed_args.get('port') and parsed_args['port'] != -1:
         PORT = parsed_args['port']
 
-    if 'dirs' in parsed_args:
+    scratch.configure(WEBDIFF_CONFIG.get('scratchSizeMb', 1024) * 1024 * 1024)
+
+    if WEBDIFF_CONFIG.get('cacheDir'):
+        diskcache.configure(
+            os.path.expanduser(WEBDIFF_CONFIG['cacheDir']),
+            WEBDIFF_CONFIG.get('cacheDirSizeMb', 1024) * 1024 * 1024,
+        )
+
+    if 'git_args' in parsed_args:
+        try:
+            DIFF = gitobjects.gitdiff(parsed_args['git_args'], WEBDIFF_CONFIG)
+        except gitobjects.GitObjectError as e:
+            sys.stderr.write('Error: %s\n' % e)
+            sys.exit(1)
+    elif 'dirs' in parsed_args:
         DIFF = dirdiff.gitdiff(*parsed_args['dirs'], WEBDIFF_CONFIG)
     elif 'files' in parsed_args:
         a_file, b_file = parsed_args['files']
@@ -365,6 +937,13 @@ def run():
     # Create app with root_path
     app = create_app(root_path)
 
+    if WEBDIFF_CONFIG.get('precompute') and DIFF:
+        start_precomputer()
+
+    if WEBDIFF_CONFIG.get('watch') and 'dirs' in parsed_args:
+        a_dir, b_dir = parsed_args['dirs']
+        WATCHER = watch.watch([a_dir, b_dir], lambda paths: refresh_diff(a_dir, b_dir, paths))
+
     logging.basicConfig(format='%(asctime)s %(levelname)-8s %(message)s', level=logging.DEBUG)
 
     if root_path:
@@ -2,7 +2,9 @@
 
 import argparse
 import os
+import shlex
 
+from webdiff import highlight
 from webdiff.localfilediff import LocalFileDiff
 
 
@@ -10,8 +12,16 @@ class UsageError(Exception):
     pass
 
 
+def positive_int(value: str) -> int:
+    n = int(value)
+    if n < 1:
+        raise argparse.ArgumentTypeError(f'must be at least 1, got {n}')
+    return n
+
+
 USAGE = """Usage: webdiff <left_dir> <right_dir>
        webdiff <left_file> <right_file>
+       webdiff --git '<git diff args>'
 
 Or run "git webdiff" from a git repository.
 """
@@ -54,6 +64,10 @@ def parse(args):
     parser.add_argument(
         '--max-lines-for-syntax', type=int, help='Maximum lines for syntax highlighting.', default=25000
     )
+    parser.add_argument(
+        '--server-highlight', action='store_true',
+        help='Syntax highlight files over --max-lines-for-syntax on the server (requires Pygments).',
+    )
 
     # Diff algorithm option
     parser.add_argument(
@@ -61,6 +75,45 @@ def parse(args):
         choices=['myers', 'minimal', 'patience', 'histogram'], default=None
     )
 
+    parser.add_argument(
+        '--diff-backend', type=str, help='Compute file diffs with git or in-process with python.',
+        choices=['git', 'python'], default='git'
+    )
+    parser.add_argument(
+        '--max-workers', type=positive_int, help='Maximum number of diffs to compute concurrently.', default=8
+    )
+    parser.add_argument(
+        '--cache-size', type=int, help='Megabytes of memory for caching computed diffs.', default=64
+    )
+    parser.add_argument(
+        '--cache-dir', type=str, help='Directory in which to keep computed diffs between runs.', default=''
+    )
+    parser.add_argument(
+        '--cache-dir-size', type=int, help='Maximum size of --cache-dir in megabytes.', default=1024
+    )
+    parser.add_argument(
+        '--scratch-size', type=int, help='Megabytes of temporary files to keep before deleting old ones.', default=1024
+    )
+    parser.add_argument(
+        '--precompute', action='store_true', help='Compute all file diffs in the background at startup.'
+    )
+    parser.add_argument(
+        '--precompute-workers', type=int, default=4,
+        help='Number of files to precompute at once, out of the --max-workers pool.'
+    )
+    parser.add_argument(
+        '--git', type=str, metavar='ARGS', default=None,
+        help="Show `git diff ARGS` for the repository in the current directory (e.g. 'HEAD~3..HEAD' or "
+        "'--cached'), reading files from git as they're viewed instead of from two directories.",
+    )
+    parser.add_argument(
+        '--git-processes', type=int, default=4,
+        help='Number of long-running git processes to read files with in --git mode.',
+    )
+    parser.add_argument(
+        '--watch', action='store_true', help='Watch the directories and update the diff as files change.'
+    )
+
     # Color configuration options
     parser.add_argument(
         '--color-insert', type=str, help='Background color for inserted lines.', default='#efe'
@@ -95,6 +148,17 @@ def parse(args):
             'maxDiffWidth': args.max_diff_width,
             'theme': args.theme,
             'maxLinesForSyntax': args.max_lines_for_syntax,
+            'serverHighlight': args.server_highlight,
+            'diffBackend': args.diff_backend,
+            'maxWorkers': args.max_workers,
+            'cacheSizeMb': args.cache_size,
+            'cacheDir': args.cache_dir,
+            'cacheDirSizeMb': args.cache_dir_size,
+            'scratchSizeMb': args.scratch_size,
+            'precompute': args.precompute,
+            'precomputeWorkers': args.precompute_workers,
+            'watch': args.watch,
+            'gitProcesses': args.git_processes,
         },
         'webdiff.colors': {
             'insert': args.color_insert,
@@ -115,6 +179,14 @@ def parse(args):
         'timeout': args.timeout,
     }
 
+    if args.server_highlight and not highlight.is_available():
+        raise UsageError('--server-highlight requires Pygments (pip install pygments)')
+
+    if args.git is not None:
+        if args.dirs:
+            raise UsageError('--git cannot be combined with files or directories')
+        out['git_args'] = shlex.split(args.git)
+
     if len(args.dirs) > 2:
         raise UsageError('You must specify two files/dirs (got %d)' % len(args.dirs))
 
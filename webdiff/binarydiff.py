@@ -0,0 +1,100 @@
+"""Cheap diffs of binary files: sizes, hashes and windows of hex bytes.
+
+Binary files have no lines, so they skip git diff and line counting. The
+browser gets their sizes and hashes, and can page through the bytes around
+the differences with hex_window.
+"""
+
+import contextlib
+import os
+from typing import Optional
+
+from binaryornot.helpers import is_binary_string
+
+from webdiff import diskcache, lineindex
+
+# How much of the start of a file binaryornot looks at.
+BINARY_CHECK_BYTES = 1024
+# git treats a file as binary if it has a NUL byte this close to the start.
+GIT_BINARY_CHECK_BYTES = 8000
+
+MAX_HEX_WINDOW_BYTES = 64 * 1024
+HEX_ROW_BYTES = 16
+
+
+def is_binary_data(data) -> bool:
+    """Do these file contents (bytes or an mmap) look binary, to git or binaryornot?"""
+    return data.find(b'\0', 0, GIT_BINARY_CHECK_BYTES) != -1 or is_binary_string(
+        bytes(data[:BINARY_CHECK_BYTES])
+    )
+
+
+def is_binary_file(path: str) -> bool:
+    with lineindex.file_buffer(path) as data:
+        return is_binary_data(data)
+
+
+def side_info(path: str) -> Optional[dict]:
+    """Size and sha256 of one side of a binary diff; None for a missing side."""
+    if not path:
+        return None
+    return {'size': os.path.getsize(path), 'sha256': diskcache.content_digest(path)}
+
+
+def _buffer(path: str):
+    # A missing side of an add or delete reads as empty.
+    return lineindex.file_buffer(path) if path else contextlib.nullcontext(b'')
+
+
+def _first_difference(a, b) -> Optional[int]:
+    """The offset of the first byte where a and b differ, or None if they're equal."""
+    n = min(len(a), len(b))
+    chunk = lineindex.READ_CHUNK_BYTES
+    # Compare big slices, then bisect into the first one which differs.
+    lo = 0
+    while lo < n and a[lo : min(n, lo + chunk)] == b[lo : min(n, lo + chunk)]:
+        lo += chunk
+    if lo >= n:
+        return None if len(a) == len(b) else n
+    hi = min(n, lo + chunk)
+    while hi - lo > 1:
+        mid = (lo + hi) // 2
+        if a[lo:mid] == b[lo:mid]:
+            lo = mid
+        else:
+            hi = mid
+    return lo
+
+
+def hex_window(a_path: str, b_path: str, offset: Optional[int], length: int) -> dict:
+    """Bytes [offset, offset + length) of each side, as hex, and where they differ.
+
+    With offset=None, the window starts at the row of the first difference.
+    Returns {"offset", "first_difference", "a", "b", "differences"}, where a
+    and b are hex strings (None for a missing side) and differences are the
+    [start, end) offsets in the window at which the sides differ.
+    """
+    length = max(0, min(length, MAX_HEX_WINDOW_BYTES))
+    with _buffer(a_path) as a, _buffer(b_path) as b:
+        first = _first_difference(a, b)
+        if offset is None:
+            offset = (first or 0) // HEX_ROW_BYTES * HEX_ROW_BYTES
+        offset = max(0, offset)
+        a_bytes = bytes(a[offset : offset + length])
+        b_bytes = bytes(b[offset : offset + length])
+
+    differences = []
+    for i in range(max(len(a_bytes), len(b_bytes))):
+        if a_bytes[i : i + 1] != b_bytes[i : i + 1]:
+            if differences and differences[-1][1] == offset + i:
+                differences[-1][1] += 1
+            else:
+                differences.append([offset + i, offset + i + 1])
+    return {
+        'offset': offset,
+        'first_difference': first,
+        'a': a_bytes.hex() if a_path else None,
+        'b': b_bytes.hex() if b_path else None,
+        'differences': differences,
+    }
+
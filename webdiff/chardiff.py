@@ -0,0 +1,217 @@
+"""Intra-line (word-level) diffs for the rows of replace ranges.
+
+This is a port of ts/codediff/char-diffs.ts, so that the browser doesn't have
+to diff every changed line itself. That freezes the tab on files with
+thousands of changed lines, e.g. minified bundles or lockfiles.
+
+The words are diffed with the same algorithm as jsdiff's diffArrays, and the
+same 50% overlap heuristic decides whether a row gets character diffs at all.
+Offsets are in UTF-16 code units, i.e. they index into JavaScript strings.
+"""
+
+import re
+from collections import Counter
+from typing import List, Optional, Tuple
+
+# Single words can be [A-Z][a-z]+, [A-Z]+, [a-z]+, [0-9]+; anything else
+# (including each whitespace character) is a word of its own.
+_WORD = re.compile(r'[A-Z][a-z]+|[A-Z]+|[a-z]+|[0-9]+|.', re.DOTALL)
+_ALL_WHITESPACE = re.compile(r'\s*\Z')
+
+MIN_EQUAL_FRAC = 0.5
+# Budgets for the word diffs, in steps of the diff algorithm. Rows over the
+# per-line budget and everything after the per-file budget runs out are
+# shown without character diffs.
+MAX_LINE_COST = 20_000
+MAX_FILE_COST = 2_000_000
+
+# For each side, the flattened [start, end) offsets of the changed spans.
+Spans = List[int]
+
+
+def split_into_words(line: str) -> List[str]:
+    """Split a line up like splitIntoWords in char-diffs.ts; ''.join() inverts this."""
+    return _WORD.findall(line)
+
+
+def as_lines(text: str) -> List[str]:
+    """Split text into lines the same way the frontend (stringAsLines) does."""
+    lf, cr = text.find('\n'), text.find('\r')
+    linebreak = '\n' if (lf > -1 and cr > -1) or cr < 0 else '\r'
+    return [line.strip('\r\n') for line in text.split(linebreak)]
+
+
+def _diff_words(old: List[str], new: List[str], max_cost: int) -> Tuple[Optional[list], int]:
+    """Myers' diff of two word lists, following jsdiff's diffArrays step for step.
+
+    Returns ([(kind, count), ...], cost) where kind is one of '=', '-', '+', or
+    (None, cost) if the diff would cost more than max_cost.
+    """
+    old_len, new_len = len(old), len(new)
+    cost = 0
+
+    def extract_common(old_pos, components, diagonal):
+        nonlocal cost
+        new_pos = old_pos - diagonal
+        start = new_pos
+        while new_pos + 1 < new_len and old_pos + 1 < old_len and old[old_pos + 1] == new[new_pos + 1]:
+            new_pos += 1
+            old_pos += 1
+        if new_pos > start:
+            cost += new_pos - start
+            components = ('=', new_pos - start, components)
+        return old_pos, new_pos, components
+
+    def add_to_path(path, kind, old_pos_inc):
+        old_pos, last = path
+        if last and last[0] == kind:
+            return old_pos + old_pos_inc, (kind, last[1] + 1, last[2])
+        return old_pos + old_pos_inc, (kind, 1, last)
+
+    def done(components):
+        out = []
+        while components:
+            kind, count, components = components
+            out.append((kind, count))
+        out.reverse()
+        return out, cost
+
+    # Components are linked lists of (kind, count, previous).
+    old_pos, new_pos, components = extract_common(-1, None, 0)
+    if old_pos + 1 >= old_len and new_pos + 1 >= new_len:
+        return done(components)
+    best_path = {0: (old_pos, components)}
+    min_diagonal, max_diagonal = float('-inf'), float('inf')
+
+    for edit_length in range(1, old_len + new_len + 1):
+        for diagonal in range(max(min_diagonal, -edit_length), min(max_diagonal, edit_length) + 1, 2):
+            cost += 1
+            remove_path = best_path.pop(diagonal - 1, None)
+            add_path = best_path.get(diagonal + 1)
+            can_add = add_path is not None and 0 <= add_path[0] - diagonal < new_len
+            can_remove = remove_path is not None and remove_path[0] + 1 < old_len
+            if not can_add and not can_remove:
+                best_path.pop(diagonal, None)
+                continue
+            if not can_remove or (can_add and remove_path[0] + 1 < add_path[0]):
+                base_path = add_to_path(add_path, '+', 0)
+            else:
+                base_path = add_to_path(remove_path, '-', 1)
+            old_pos, new_pos, components = extract_common(*base_path, diagonal)
+            if old_pos + 1 >= old_len and new_pos + 1 >= new_len:
+                return done(components)
+            best_path[diagonal] = (old_pos, components)
+            if old_pos + 1 >= old_len:
+                max_diagonal = min(max_diagonal, diagonal - 1)
+            if new_pos + 1 >= new_len:
+                min_diagonal = max(min_diagonal, diagonal + 1)
+        if cost > max_cost:
+            return None, cost
+    return done(None)  # unreachable: edit_length = old_len + new_len always finishes
+
+
+def _utf16_units(line: str) -> str:
+    """line with characters outside the BMP split into surrogate pairs, as in JavaScript."""
+    if line.isascii() or all(ord(c) <= 0xFFFF for c in line):
+        return line
+    data = line.encode('utf-16-le', 'surrogatepass')
+    return ''.join(chr(int.from_bytes(data[i : i + 2], 'little')) for i in range(0, len(data), 2))
+
+
+def _add_span(spans: Spans, start: int, end: int):
+    if spans and spans[-1] == start:
+        spans[-1] = end  # merge runs which only an insert on the other side split up
+    else:
+        spans += [start, end]
+
+
+def character_diffs(
+    before: str, after: str, max_cost: int = MAX_LINE_COST
+) -> Tuple[Optional[Tuple[Spans, Spans]], int]:
+    """Compute an intra-line diff, like computeCharacterDiffs in char-diffs.ts.
+
+    Returns ((before spans, after spans), cost). The spans are None if
+    character differences aren't appropriate for this pair of lines, or if
+    they'd cost more than max_cost to compute.
+    """
+    before_words = split_into_words(_utf16_units(before))
+    after_words = split_into_words(_utf16_units(after))
+    cost = len(before_words) + len(after_words)
+    total_chars = sum(map(len, before_words)) + sum(map(len, after_words))
+    all_whitespace = bool(_ALL_WHITESPACE.match(before) and _ALL_WHITESPACE.match(after))
+    # Suppress char-by-char diffs if there's less than 50% character overlap.
+    # The one exception is pure whitespace diffs, which should always be shown.
+    # Only words on both sides can be equal, so if even all of those wouldn't
+    # make the cut, there's no need to diff.
+    common_words = Counter(before_words) & Counter(after_words)
+    max_equal_count = 2 * sum(len(word) * n for word, n in common_words.items())
+    if max_equal_count < MIN_EQUAL_FRAC * total_chars and not all_whitespace:
+        return None, cost
+
+    diffs, diff_cost = _diff_words(before_words, after_words, max_cost)
+    cost += diff_cost
+    if diffs is None:
+        return None, cost
+
+    equal_count = 0
+    before_spans, after_spans = [], []
+    before_idx = after_idx = 0  # in characters
+    before_word = after_word = 0  # in words
+    for kind, count in diffs:
+        if kind == '+':
+            n = sum(map(len, after_words[after_word : after_word + count]))
+            _add_span(after_spans, after_idx, after_idx + n)
+            after_idx += n
+            after_word += count
+        elif kind == '-':
+            n = sum(map(len, before_words[before_word : before_word + count]))
+            _add_span(before_spans, before_idx, before_idx + n)
+            before_idx += n
+            before_word += count
+        else:
+            n = sum(map(len, before_words[before_word : before_word + count]))
+            equal_count += 2 * n
+            before_idx += n
+            after_idx += n
+            before_word += count
+            after_word += count
+    if equal_count < MIN_EQUAL_FRAC * total_chars and not all_whitespace:
+        return None, cost
+
+    return (before_spans, after_spans), cost
+
+
+def _display_text(line: str) -> str:
+    # The frontend expands tabs before computing (and applying) character diffs.
+    return line.replace('\t', '\u00a0' * 4)
+
+
+def replace_char_diffs(
+    diff_ops: List[dict], content_a: Optional[str], content_b: Optional[str], max_cost: int = MAX_FILE_COST
+) -> list:
+    """Character diffs for every row of the replace ranges in diff_ops.
+
+    Returns a list of [before line, after line, before spans, after spans],
+    one for each row which gets character diffs. Line numbers are 0-based,
+    and null where a range has more rows on one side than on the other. Once
+    max_cost is used up, the remaining rows are left out.
+    """
+    a_lines = as_lines(content_a) if content_a else []
+    b_lines = as_lines(content_b) if content_b else []
+    out = []
+    for op in diff_ops:
+        if op['type'] != 'replace':
+            continue
+        (a_start, a_end), (b_start, b_end) = op['before'], op['after']
+        for j in range(max(a_end - a_start, b_end - b_start)):
+            a_idx = a_start + j if a_start + j < a_end else None
+            b_idx = b_start + j if b_start + j < b_end else None
+            before = _display_text(a_lines[a_idx]) if a_idx is not None and a_idx < len(a_lines) else ''
+            after = _display_text(b_lines[b_idx]) if b_idx is not None and b_idx < len(b_lines) else ''
+            spans, cost = character_diffs(before, after, min(MAX_LINE_COST, max_cost))
+            if spans is not None:
+                out.append([a_idx, b_idx, *spans])
+            max_cost -= cost
+            if max_cost <= 0:
+                return out
+    return out
@@ -7,16 +7,16 @@ Diff objects must have these properties:
     - b_path (like a_path)
     - type   One of {'change', 'move', 'add', 'delete'}
 
-For concrete implementations, see localfilediff.
+For concrete implementations, see localfilediff and gitobjects.
 """
 
-import logging
+import dataclasses
+import functools
 import mimetypes
 import os
-import subprocess
 from typing import List
 
-from webdiff import util
+from webdiff import binarydiff, cache, diskcache, gitpool, linediff, lineindex, util
 from webdiff.localfilediff import LocalFileDiff
 from webdiff.unified_diff import Code, diff_to_codes
 
@@ -38,51 +38,127 @@ def get_thin_dict(diff):
     }
 
 
-def fast_num_lines(path: str) -> int:
-    # See https://stackoverflow.com/q/9629179/388951 for the idea to use a Unix command.
-    # Unfortunately `wc -l` ignores the last line if there is no trailing newline. So
-    # instead, see https://stackoverflow.com/a/38870057/388951
-    try:
-        return int(subprocess.check_output(['grep', '-c', '', path]))
-    except subprocess.CalledProcessError as e:
-        if e.returncode == 1:
-            return 0  # grep -c returns an error code if there are no matches
-        raise
+# Above this combined size, git's C implementation beats the fork/exec overhead.
+MAX_INPROCESS_DIFF_BYTES = 1024 * 1024
+
+
+def is_binary_diff(diff) -> bool:
+    """Is this a diff of binary files, which have no lines to diff?
+
+    git's numstat reports binary files as "-", which leaves num_add and
+    num_delete None. They're also None when there are no numstats (e.g. for a
+    one-file diff), so one of the sides has to look binary as well.
+    """
+    if diff.num_add is not None or diff.num_delete is not None:
+        return False
+    a_path, b_path = diff.a_path, diff.b_path
+    return _is_binary_pair(a_path, b_path, cache.file_identity(a_path), cache.file_identity(b_path))
+
+
+@functools.lru_cache(maxsize=1024)
+def _is_binary_pair(a_path: str, b_path: str, a_identity, b_identity) -> bool:
+    # The identities are only part of the key, so that edits to the files are picked up.
+    return any(path and binarydiff.is_binary_file(path) for path in (a_path, b_path))
+
+
+def binary_diff_ops(diff) -> List[Code]:
+    """Codes for a binary diff, each of whose sides is shown as a one-line placeholder."""
+    if not diff.a_path:
+        return [Code('insert', before=(0, 0), after=(0, 1))]
+    if not diff.b_path:
+        return [Code('delete', before=(0, 1), after=(0, 0))]
+    return [Code('replace', before=(0, 1), after=(0, 1))]
 
 
 def get_diff_ops(
-    diff: LocalFileDiff, git_diff_args=None, normalize_json=False
+    diff: LocalFileDiff, git_diff_args=None, normalize_json=False, backend='git'
 ) -> List[Code]:
     """Run git diff on the file pair and convert the results to a sequence of codes.
 
     git_diff_args is passed directly to git diff. It can be something like ['-w'] or
     ['-w', '--diff-algorithm=patience'].
+
+    With backend='python', the diff is computed in-process by linediff instead.
+    This falls back to git for options or file sizes that linediff doesn't handle.
+
+    Binary diffs never get as far as git (see is_binary_diff).
     """
+    if is_binary_diff(diff):
+        return binary_diff_ops(diff)
+
     # git diff --no-index doesn't follow symlinks. So we help it a bit.
     a_path = os.path.realpath(diff.a_path) if diff.a_path else ''
     b_path = os.path.realpath(diff.b_path) if diff.b_path else ''
-    if normalize_json:
-        a_path = a_path and util.normalize_json(a_path)
-        b_path = b_path and util.normalize_json(b_path)
-
-    if a_path and b_path:
-        num_lines = fast_num_lines(b_path)
-        args = (
-            'git diff --no-index'.split(' ') + (git_diff_args or []) + [a_path, b_path]
-        )
-        logging.debug('Running git command: %s', args)
-        diff_output = subprocess.run(args, capture_output=True)
-        codes = diff_to_codes(diff_output.stdout.decode('utf8'), num_lines)
+
+    key = diskcache.is_enabled() and diskcache.make_key(
+        'codes',
+        diskcache.content_digest(a_path),
+        diskcache.content_digest(b_path),
+        # git diff reports a mode change for the executable bit.
+        bool(a_path) and os.access(a_path, os.X_OK),
+        bool(b_path) and os.access(b_path, os.X_OK),
+        git_diff_args or [],
+        normalize_json,
+    )
+    if key and (cached := diskcache.get_json(key)) is not None:
+        return [Code(c['type'], tuple(c['before']), tuple(c['after']), c['header']) for c in cached]
+    codes = _compute_diff_ops(a_path, b_path, git_diff_args, normalize_json, backend)
+    if key and codes is not None:
+        diskcache.put_json(key, [dataclasses.asdict(c) for c in codes])
+    return codes
+
+
+def _diff_side(path: str, normalize_json: bool):
+    """What to diff for one side: its path, or its normalized contents if it's JSON."""
+    if path and normalize_json and (data := util.normalized_json_bytes(path)) is not None:
+        return data
+    return path
+
+
+def _side_size(side) -> int:
+    return len(side) if isinstance(side, bytes) else os.path.getsize(side)
+
+
+def _side_num_lines(side) -> int:
+    return lineindex.count_lines(side) if isinstance(side, bytes) else lineindex.num_lines(side)
+
+
+def _side_contents(side):
+    """Returns (contents, is_executable) for one side of the diff."""
+    if isinstance(side, bytes):
+        # Normalized JSON used to be diffed as a fresh, non-executable temp file.
+        return side, False
+    # Read through lineindex so that the file contents share these reads.
+    return lineindex.read_bytes(side), linediff.is_executable(side)
+
+
+def _compute_diff_ops(a_path, b_path, git_diff_args, normalize_json, backend) -> List[Code]:
+    a_side = _diff_side(a_path, normalize_json)
+    b_side = _diff_side(b_path, normalize_json)
+
+    if a_side and b_side:
+        opts = linediff.parse_git_diff_args(git_diff_args) if backend == 'python' else None
+        if opts is not None and _side_size(a_side) + _side_size(b_side) <= MAX_INPROCESS_DIFF_BYTES:
+            a_data, a_exec = _side_contents(a_side)
+            b_data, b_exec = _side_contents(b_side)
+            codes = linediff.diff_bytes(a_data, b_data, opts, a_exec != b_exec)
+        else:
+            num_lines = _side_num_lines(b_side)
+            # Concurrent diffs (e.g. from --precompute) share a git process.
+            diff_output = gitpool.BATCHER.diff(
+                a_side, b_side, git_diff_args or [], name=os.path.basename(b_path)
+            )
+            codes = diff_to_codes(diff_output.decode('utf8'), num_lines)
         if not codes:
             # binary diff; these are rendered as "binary file (123 bytes)"
             # so a 1-line replace is best here.
             codes = [Code(type='replace', before=(0, 1), after=(0, 1))]
         return codes
-    elif a_path:
-        num_lines = fast_num_lines(a_path)
+    elif a_side:
+        num_lines = _side_num_lines(a_side)
         return [Code('delete', before=(0, num_lines), after=(0, 0))]
-    elif b_path:
-        num_lines = fast_num_lines(b_path)
+    elif b_side:
+        num_lines = _side_num_lines(b_side)
         return [Code('insert', before=(0, 0), after=(0, num_lines + 1))]
 
 
@@ -97,11 +173,7 @@ def get_thick_dict(diff):
             d['image_b'] = util.image_metadata(diff.b_path)
         if d['a'] and d['b']:
             try:
-                d['are_same_pixels'], _ = util.generate_pdiff_image(
-                    diff.a_path, diff.b_path
-                )
-            except util.ImageMagickError:
-                d['are_same_pixels'] = False
+                d['are_same_pixels'] = util.are_same_pixels(diff.a_path, diff.b_path)
             except util.ImageMagickNotAvailableError:
                 pass
     return d
@@ -147,22 +219,36 @@ def is_image_diff(diff):
     return False
 
 
+def _norm(p):
+    if p == '':
+        return ''
+    return os.path.normpath(p)
+
+
+def build_path_index(diffs):
+    """Map each (side, normalized path) to the index of the first diff with it."""
+    index = {}
+    for idx, diff in enumerate(diffs):
+        index.setdefault(('a', _norm(diff.a)), idx)
+        index.setdefault(('b', _norm(diff.b)), idx)
+    return index
+
+
+# (diffs list, its path index). DIFF is replaced rather than mutated, so the
+# identity of the list tells us whether the index is still valid.
+_path_index = (None, {})
+
+
 def find_diff_index(diffs, side, path):
     """Given a side & path, find the index in the diff for it.
 
     Returns None if there's no diff for the (side, path) pair.
     """
+    global _path_index
     assert side in ('a', 'b')
 
-    def norm(p):
-        if p == '':
-            return ''
-        return os.path.normpath(p)
-
-    path = norm(path)
-    for idx, diff in enumerate(diffs):
-        if side == 'a' and norm(diff.a) == path:
-            return idx
-        if side == 'b' and norm(diff.b) == path:
-            return idx
-    return None
+    indexed_diffs, index = _path_index
+    if indexed_diffs is not diffs:
+        index = build_path_index(diffs)
+        _path_index = (diffs, index)
+    return index.get((side, _norm(path)))
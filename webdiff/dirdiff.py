@@ -1,13 +1,15 @@
 """Compute the diff between two directories on local disk."""
 
+import bisect
 import logging
 import os
 import shutil
 import subprocess
-import tempfile
+from typing import List, Optional, Set, Tuple
 
+from webdiff import diskcache, scratch
 from webdiff.localfilediff import LocalFileDiff
-from webdiff.unified_diff import parse_raw_diff
+from webdiff.unified_diff import iter_raw_diff
 
 
 def contains_symlinks(dir: str):
@@ -27,47 +29,296 @@ def contains_symlinks(dir: str):
     return False
 
 
-def make_resolved_dir(dir: str, follow_symlinks=False) -> str:
-    # TODO: clean up this directory
-    temp_dir = tempfile.mkdtemp(prefix='webdiff')
-    for root, dirs, files in os.walk(dir):
-        for subdir in dirs:
-            rel = os.path.relpath(os.path.join(root, subdir), dir)
-            os.mkdir(os.path.join(temp_dir, rel))
-        for file_name in files:
-            src_file = os.path.join(root, file_name)
-            rel = os.path.relpath(src_file, dir)
-            dst_file = os.path.join(temp_dir, rel)
-            shutil.copy(src_file, dst_file, follow_symlinks=follow_symlinks)
+def _link_or_copy(src_file: str, dst_file: str):
+    """Hard link src_file (following symlinks) at dst_file, copying if that's not possible."""
+    try:
+        os.link(os.path.realpath(src_file), dst_file)
+    except OSError:
+        # e.g. a cross-device link or a filesystem without hard links.
+        shutil.copy(src_file, dst_file, follow_symlinks=True)
+
+
+def make_resolved_dir(dir: str, follow_symlinks=False, rels=None) -> str:
+    """Mirror dir into a temp dir that git diff --no-index can read.
+
+    If rels is set, only the files at those relative paths (which exist) are
+    mirrored. With follow_symlinks, files are hard linked to their real paths,
+    so no file contents are copied unless linking fails.
+    """
+    temp_dir = scratch.new_dir()
+    if rels is None:
+        rels = [
+            os.path.relpath(os.path.join(root, file_name), dir)
+            for root, _dirs, files in os.walk(dir)
+            for file_name in files
+        ]
+    for rel in rels:
+        src_file = os.path.join(dir, rel)
+        if not os.path.lexists(src_file):
+            continue
+        dst_file = os.path.join(temp_dir, rel)
+        os.makedirs(os.path.dirname(dst_file), exist_ok=True)
+        if follow_symlinks:
+            _link_or_copy(src_file, dst_file)
+        else:
+            shutil.copy(src_file, dst_file, follow_symlinks=False)
     return temp_dir
 
 
+def _symlinked_files(dir: str) -> Set[str]:
+    """Relative paths of the files in dir which are symlinks."""
+    return {
+        os.path.relpath(os.path.join(root, file_name), dir)
+        for root, _dirs, files in os.walk(dir)
+        # (git difftool should not produce directory symlinks)
+        for file_name in files
+        if os.path.islink(os.path.join(root, file_name))
+    }
+
+
+def tree_manifest(dir: str):
+    """Returns sorted (relative path, content digest, executable) tuples for a directory.
+
+    Digests are remembered in the disk cache along with each file's stat, so
+    that only files whose stat has changed since the last run are hashed.
+    """
+    stats_key = diskcache.make_key('tree_stats', os.path.realpath(dir))
+    known = diskcache.get_json(stats_key) or {}
+    stats = {}
+    manifest = []
+    for root, _dirs, files in os.walk(dir):
+        for file_name in files:
+            path = os.path.join(root, file_name)
+            rel_path = os.path.relpath(path, dir)
+            st = os.stat(path)
+            stat_key = [st.st_ino, st.st_size, st.st_mtime_ns, st.st_mode]
+            entry = known.get(rel_path)
+            digest = entry[1] if entry and entry[0] == stat_key else diskcache.content_digest(path)
+            stats[rel_path] = [stat_key, digest]
+            manifest.append((rel_path, digest, os.access(path, os.X_OK)))
+    if stats != known:
+        diskcache.put_json(stats_key, stats)
+    return sorted(manifest)
+
+
+def _is_difftool_dir(dir: str) -> bool:
+    """Is dir inside one of the temp dirs which git difftool -d makes afresh on every run?"""
+    return any(part.startswith('git-difftool.') for part in os.path.realpath(dir).split(os.sep))
+
+
 def gitdiff(a_dir: str, b_dir: str, webdiff_config):
+    """Returns a list of LocalFileDiffs for the changes between two directories."""
+    if not diskcache.is_enabled() or _is_difftool_dir(a_dir) or _is_difftool_dir(b_dir):
+        # git difftool checks files out anew (new inodes and mtimes) on every
+        # run, so a manifest of them would mean hashing every file each time,
+        # which costs about as much as the git diff it would save. Their diffs
+        # are still cached file by file.
+        return _gitdiff(a_dir, b_dir, webdiff_config)
+
+    # Cache the pairing and numstats of the whole tree, relative to its roots.
+    key = diskcache.make_key(
+        'dirdiff', tree_manifest(a_dir), tree_manifest(b_dir), webdiff_config['extraDirDiffArgs']
+    )
+    cached = diskcache.get_json(key)
+    if cached is not None:
+        return [
+            LocalFileDiff(
+                a_dir,
+                os.path.join(a_dir, d['a']) if d['a'] else '',
+                b_dir,
+                os.path.join(b_dir, d['b']) if d['b'] else '',
+                is_move=d['is_move'],
+                num_add=d['num_add'],
+                num_delete=d['num_delete'],
+            )
+            for d in cached
+        ]
+    diffs = _gitdiff(a_dir, b_dir, webdiff_config)
+    diskcache.put_json(
+        key,
+        [
+            {'a': d.a, 'b': d.b, 'is_move': d.is_move, 'num_add': d.num_add, 'num_delete': d.num_delete}
+            for d in diffs
+        ],
+    )
+    return diffs
+
+
+def _gitdiff(a_dir: str, b_dir: str, webdiff_config):
+    symlinked = _symlinked_files(a_dir) | _symlinked_files(b_dir)
+    diffs = _diff_dirs(a_dir, b_dir, a_dir, b_dir, webdiff_config)
+    if not symlinked:
+        return diffs
+
+    # git diff --no-index compares the target names of symlinks rather than
+    # their contents. Re-diff those files from mirrors which hold their
+    # contents. Every add, delete and move goes in the mirrors too, so that
+    # git can pair them up with the symlinked files as moves.
+    rels = set(symlinked)
+    for d in diffs:
+        if d.type != 'change':
+            rels.update(rel for rel in (d.a, d.b) if rel)
+    kept = [d for d in diffs if d.a not in rels and d.b not in rels]
+    a_mirror = make_resolved_dir(a_dir, follow_symlinks=True, rels=rels)
+    b_mirror = make_resolved_dir(b_dir, follow_symlinks=True, rels=rels)
+    logging.debug(f'Inlined {len(rels)} symlinked or unpaired files -> {a_mirror}, {b_mirror}')
+    try:
+        resolved = _diff_dirs(a_mirror, b_mirror, a_dir, b_dir, webdiff_config)
+    finally:
+        # After this point, the mirrors are no longer needed.
+        scratch.remove(a_mirror)
+        scratch.remove(b_mirror)
+    return _merge(kept, resolved)
+
+
+def _diff_dirs(a_src: str, b_src: str, a_dir: str, b_dir: str, webdiff_config) -> List[LocalFileDiff]:
+    """Diff a_src and b_src with git, as though they were a_dir and b_dir."""
     extra_args = webdiff_config['extraDirDiffArgs']
     cmd = 'git diff --raw -z --no-index --numstat'
     if extra_args:
         cmd += ' ' + extra_args
-    a_dir_nosym = a_dir
-    if contains_symlinks(a_dir):
-        a_dir_nosym = make_resolved_dir(a_dir, follow_symlinks=True)
-        logging.debug(f'Inlined symlinks in left directory {a_dir} -> {a_dir_nosym}')
-    b_dir_nosym = b_dir
-    if contains_symlinks(b_dir):
-        b_dir_nosym = make_resolved_dir(b_dir, follow_symlinks=True)
-        logging.debug(f'Inlined symlinks in right directory {b_dir} -> {b_dir_nosym}')
-    args = cmd.split(' ') + [a_dir_nosym, b_dir_nosym]
+    args = cmd.split(' ') + [a_src, b_src]
     logging.debug('Running git command: %s', args)
-    diff_output = subprocess.run(args, capture_output=True)
     # git diff has an exit code of 1 on either a diff _or_ an error.
     # TODO: how to distinguish these cases?
-    diff_stdout = diff_output.stdout.decode('utf8')
-    # Make it look like the diff was between directories containing symlinks.
-    # After this point, the resolved directories are no longer needed.
-    if a_dir != a_dir_nosym:
-        diff_stdout = diff_stdout.replace(a_dir_nosym, a_dir)
-        shutil.rmtree(a_dir_nosym)
-    if b_dir != b_dir_nosym:
-        diff_stdout = diff_stdout.replace(b_dir_nosym, b_dir)
-        shutil.rmtree(b_dir_nosym)
-    lines = parse_raw_diff(diff_stdout)
-    return [LocalFileDiff.from_diff_raw_line(line, a_dir, b_dir) for line in lines]
+    with subprocess.Popen(args, stdout=subprocess.PIPE, stderr=subprocess.DEVNULL) as proc:
+        diffs = []
+        for line in iter_raw_diff(proc.stdout):
+            line.path = _restore_dir(line.path, a_src, a_dir, b_src, b_dir)
+            if line.dst_path:
+                line.dst_path = _restore_dir(line.dst_path, a_src, a_dir, b_src, b_dir)
+            diffs.append(LocalFileDiff.from_diff_raw_line(line, a_dir, b_dir))
+    return diffs
+
+
+def _restore_dir(path: str, a_dir_nosym: str, a_dir: str, b_dir_nosym: str, b_dir: str) -> str:
+    """Map a path in a resolved (symlink-free) directory back to the original directory."""
+    if a_dir_nosym != a_dir and path.startswith(a_dir_nosym):
+        return a_dir + path[len(a_dir_nosym):]
+    if b_dir_nosym != b_dir and path.startswith(b_dir_nosym):
+        return b_dir + path[len(b_dir_nosym):]
+    return path
+
+
+# Past this many changed files, re-diffing the whole tree is about as quick.
+MAX_INCREMENTAL_PATHS = 64
+
+
+def rediff(
+    diffs: List[LocalFileDiff], a_dir: str, b_dir: str, changed_paths: Optional[Set[str]], webdiff_config
+) -> Tuple[List[LocalFileDiff], List[int]]:
+    """Update diffs, a gitdiff of a_dir and b_dir, after some files changed.
+
+    changed_paths are absolute paths under either directory (files or
+    directories), or None if they aren't known. Only the affected files are
+    re-diffed, unless the change could create or break up a move, in which
+    case the whole tree is.
+
+    Returns a new list and the indices in it whose pair or contents may differ
+    from the entry at the same index in diffs.
+    """
+    rels = None if changed_paths is None else _changed_rel_paths(diffs, a_dir, b_dir, changed_paths)
+    if rels is not None and len(rels) <= MAX_INCREMENTAL_PATHS:
+        new_diffs = _splice(diffs, a_dir, b_dir, rels, webdiff_config)
+        if new_diffs is not None:
+            return new_diffs, [
+                i for i, d in enumerate(new_diffs) if i >= len(diffs) or diffs[i] is not d
+            ]
+    new_diffs = gitdiff(a_dir, b_dir, webdiff_config)
+    return new_diffs, list(range(len(new_diffs)))
+
+
+def _changed_rel_paths(diffs, a_dir: str, b_dir: str, changed_paths: Set[str]) -> Optional[Set[str]]:
+    """Map changed paths to the relative paths of the files which may differ now."""
+    rels = set()
+    for path in changed_paths:
+        for root in (os.path.abspath(a_dir), os.path.abspath(b_dir)):
+            if path.startswith(root + os.sep):
+                rels.add(os.path.relpath(path, root))
+                break
+        else:
+            # e.g. one of the directories itself was replaced.
+            return None
+
+    # A directory which appeared or vanished stands for every file under it.
+    prefixes = tuple(rel + os.sep for rel in rels)
+    for root in (a_dir, b_dir):
+        for rel in list(rels):
+            top = os.path.join(root, rel)
+            if os.path.isdir(top):
+                for dirpath, _dirs, files in os.walk(top):
+                    rels.update(os.path.relpath(os.path.join(dirpath, f), root) for f in files)
+    for d in diffs:
+        for rel in (d.a, d.b):
+            if rel and rel.startswith(prefixes):
+                rels.add(rel)
+    return rels
+
+
+def _sort_key(rel: str):
+    # git diff --no-index sorts the entries of each directory by name, and
+    # places moves by their destination.
+    return rel.split(os.sep)
+
+
+def _splice(diffs, a_dir: str, b_dir: str, rels: Set[str], webdiff_config) -> Optional[List[LocalFileDiff]]:
+    """Re-diff the files at rels and splice them into diffs; None if that's not safe."""
+    if any(d.is_move and (d.a in rels or d.b in rels) for d in diffs):
+        return None
+    new_pairs = [p for rel in sorted(rels) if (p := _diff_one(a_dir, b_dir, rel, webdiff_config))]
+
+    kept = [d for d in diffs if (d.a or d.b) not in rels]
+    # git might pair a new add or delete up with another one as a move (or
+    # find a better match for an existing move).
+    new_types = {p.type for p in new_pairs}
+    kept_types = {d.type for d in kept}
+    if ('add' in new_types and kept_types & {'delete', 'move'} | new_types & {'delete'}) or (
+        'delete' in new_types and kept_types & {'add', 'move'}
+    ):
+        return None
+
+    return _merge(kept, new_pairs)
+
+
+def _merge(kept: List[LocalFileDiff], new_pairs: List[LocalFileDiff]) -> List[LocalFileDiff]:
+    """Insert new_pairs into kept (in git's order), in place."""
+    keys = [_sort_key(d.b or d.a) for d in kept]
+    for pair in new_pairs:
+        key = _sort_key(pair.b or pair.a)
+        i = bisect.bisect(keys, key)
+        keys.insert(i, key)
+        kept.insert(i, pair)
+    return kept
+
+
+def _diff_one(a_dir: str, b_dir: str, rel: str, webdiff_config) -> Optional[LocalFileDiff]:
+    """Returns the pair for one relative path, or None if it's unchanged or gone."""
+    a_path = os.path.join(a_dir, rel)
+    b_path = os.path.join(b_dir, rel)
+    a_exists = os.path.isfile(a_path)
+    b_exists = os.path.isfile(b_path)
+    if not a_exists and not b_exists:
+        return None
+
+    extra_args = webdiff_config['extraDirDiffArgs']
+    args = ['git', 'diff', '--raw', '-z', '--no-index', '--numstat']
+    if extra_args:
+        args += extra_args.split(' ')
+    # Like _gitdiff, diff the contents of symlinked files.
+    args += [
+        os.path.realpath(a_path) if a_exists else os.devnull,
+        os.path.realpath(b_path) if b_exists else os.devnull,
+    ]
+    with subprocess.Popen(args, stdout=subprocess.PIPE, stderr=subprocess.DEVNULL) as proc:
+        lines = list(iter_raw_diff(proc.stdout))
+    if not lines:
+        return None
+    return LocalFileDiff(
+        a_dir,
+        a_path if a_exists else '',
+        b_dir,
+        b_path if b_exists else '',
+        is_move=False,
+        num_add=lines[0].num_add,
+        num_delete=lines[0].num_delete,
+    )
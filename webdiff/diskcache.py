@@ -0,0 +1,174 @@
+"""Content-addressed on-disk cache that persists between webdiff runs.
+
+Entries are keyed by the hashes of the files involved, the arguments used to
+compute them and the webdiff version, so they never go stale: a changed file
+simply produces a different key. The cache is opt-in (--cache-dir); until
+configure() is called every lookup misses and nothing is written.
+"""
+
+import functools
+import hashlib
+import json
+import logging
+import os
+import tempfile
+import threading
+from importlib import metadata
+from typing import Any, Optional
+
+from . import cache
+
+READ_CHUNK_BYTES = 1024 * 1024
+
+_cache = None
+
+
+def webdiff_version() -> str:
+    try:
+        return metadata.version('webdiff')
+    except metadata.PackageNotFoundError:
+        return 'dev'
+
+
+@functools.lru_cache(maxsize=4096)
+def _digest(path: str, identity) -> str:
+    h = hashlib.sha256()
+    with open(path, 'rb') as f:
+        while chunk := f.read(READ_CHUNK_BYTES):
+            h.update(chunk)
+    return h.hexdigest()
+
+
+def content_digest(path: str) -> str:
+    """sha256 of the file's contents; '' for a missing side of a diff."""
+    if not path:
+        return ''
+    return _digest(path, cache.file_identity(path))
+
+
+def make_key(kind: str, *parts) -> str:
+    """Hash a kind (e.g. 'codes') and JSON-serializable parts into a cache key."""
+    payload = json.dumps([webdiff_version(), kind, *parts], sort_keys=True)
+    return hashlib.sha256(payload.encode('utf8')).hexdigest()
+
+
+class DiskCache:
+    """Files under root, named by key, evicted least-recently-used first.
+
+    Reads bump a file's mtime, so mtime order is recency order.
+    """
+
+    def __init__(self, root: str, max_bytes: int):
+        self.root = root
+        self.max_bytes = max_bytes
+        self._lock = threading.Lock()
+        os.makedirs(root, exist_ok=True)
+        self.num_bytes = sum(os.path.getsize(p) for p in self._entries())
+
+    def _entries(self):
+        for dirpath, _dirs, files in os.walk(self.root):
+            for name in files:
+                if not name.startswith('.'):
+                    yield os.path.join(dirpath, name)
+
+    def path_for(self, key: str, suffix: str = '') -> str:
+        return os.path.join(self.root, key[:2], key + suffix)
+
+    def lookup(self, key: str, suffix: str = '') -> Optional[str]:
+        """Returns the path of the entry for key, or None if it isn't cached."""
+        path = self.path_for(key, suffix)
+        try:
+            os.utime(path)
+        except OSError:
+            return None
+        return path
+
+    def store(self, key: str, data: bytes, suffix: str = '') -> str:
+        path = self.path_for(key, suffix)
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        # Write to a temp file and rename so concurrent readers (including
+        # other webdiff processes) never see a partial entry.
+        fd, tmp_path = tempfile.mkstemp(dir=os.path.dirname(path), prefix='.')
+        with os.fdopen(fd, 'wb') as f:
+            f.write(data)
+        with self._lock:
+            # An existing entry for key is overwritten, so its bytes no longer count.
+            try:
+                old_size = os.path.getsize(path)
+            except OSError:
+                old_size = 0
+            os.replace(tmp_path, path)
+            self.num_bytes += len(data) - old_size
+            if self.num_bytes > self.max_bytes:
+                self._evict()
+        return path
+
+    def _evict(self):
+        entries = []
+        for path in self._entries():
+            try:
+                st = os.stat(path)
+            except OSError:
+                continue
+            entries.append((st.st_mtime_ns, st.st_size, path))
+        self.num_bytes = sum(size for _, size, _ in entries)
+        # Drop down to 90% of the budget so that we don't evict on every store.
+        target = self.max_bytes * 9 // 10
+        for _, size, path in sorted(entries):
+            if self.num_bytes <= target:
+                break
+            try:
+                os.remove(path)
+            except OSError:
+                continue
+            self.num_bytes -= size
+        logging.debug(f'Evicted disk cache entries; {self.num_bytes} bytes remain')
+
+
+def configure(root: str, max_bytes: int):
+    global _cache
+    _cache = DiskCache(root, max_bytes)
+
+
+def is_enabled() -> bool:
+    return _cache is not None
+
+
+def get_json(key: str) -> Optional[Any]:
+    if _cache is None:
+        return None
+    path = _cache.lookup(key, '.json')
+    if path is None:
+        return None
+    try:
+        with open(path) as f:
+            return json.load(f)
+    except (OSError, ValueError):
+        return None
+
+
+def put_json(key: str, value: Any):
+    if _cache is not None:
+        _cache.store(key, json.dumps(value).encode('utf8'), '.json')
+
+
+def get_file(key: str, suffix: str) -> Optional[str]:
+    """Returns a path to the cached file for key, or None."""
+    if _cache is None:
+        return None
+    return _cache.lookup(key, suffix)
+
+
+def put_file(key: str, src_path: str, suffix: str) -> str:
+    """Moves src_path into the cache and returns its new path.
+
+    Without a cache, this returns src_path unchanged.
+    """
+    if _cache is None:
+        return src_path
+    with open(src_path, 'rb') as f:
+        data = f.read()
+    path = _cache.store(key, data, suffix)
+    os.remove(src_path)
+    return path
+
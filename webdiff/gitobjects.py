@@ -0,0 +1,194 @@
+"""Diff git revisions directly, reading file contents from the object store.
+
+git difftool -d checks out both sides of the diff into temp directories
+before webdiff starts. Here, the file list comes from a single git diff --raw
+and each blob is only read (through a pool of long-running git cat-file
+--batch processes) when something asks for its path, i.e. when the user
+opens that file.
+"""
+
+import logging
+import os
+import stat
+import subprocess
+import tempfile
+from dataclasses import dataclass
+from typing import List, Union
+
+from webdiff import scratch
+from webdiff.gitpool import CatFilePool, GitObjectError
+from webdiff.unified_diff import RawDiffLine, iter_raw_diff
+
+NULL_SHA = '0' * 40
+GITLINK_MODE = '160000'
+
+
+@scratch.memoize_paths(maxsize=4096)
+def _blob_file(cat_file: CatFilePool, sha: str, mode: str, suffix: str) -> str:
+    # The suffix keeps the extension, which is how images are recognized.
+    path = scratch.new_file(suffix)
+    try:
+        with open(path, 'wb') as out:
+            if mode == GITLINK_MODE:
+                # A submodule; show it the way git diff does.
+                out.write(f'Subproject commit {sha}\n'.encode('ascii'))
+            else:
+                cat_file.copy_to(sha, out)
+    except GitObjectError:
+        scratch.remove(path)
+        raise
+    if int(mode, 8) & stat.S_IXUSR:
+        # git diff reports a mode change for the executable bit.
+        os.chmod(path, 0o755)
+    logging.debug(f'Read blob {sha} -> {path}')
+    return path
+
+
+@dataclass(slots=True)
+class GitFileDiff:
+    """A before/after file pair in a git repository.
+
+    This has the same interface as LocalFileDiff, but a_path and b_path are
+    only written to disk (from the object store) on first access. A side
+    with a null sha is the working tree, which is read in place.
+    """
+
+    cat_file: CatFilePool
+    root: str
+    """The top level of the working tree"""
+    a: str
+    """Path of the left file relative to root (empty for an add)"""
+    b: str
+    """Path of the right file relative to root (empty for a delete)"""
+    a_sha: str
+    b_sha: str
+    a_mode: str
+    b_mode: str
+    is_move: bool
+    num_add: Union[int, None] = None
+    num_delete: Union[int, None] = None
+
+    def _side_path(self, rel: str, sha: str, mode: str) -> str:
+        if not rel:
+            return ''
+        if sha == NULL_SHA:
+            return os.path.join(self.root, rel)
+        return _blob_file(self.cat_file, sha, mode, os.path.splitext(rel)[1])
+
+    @property
+    def a_path(self):
+        return self._side_path(self.a, self.a_sha, self.a_mode)
+
+    @property
+    def b_path(self):
+        return self._side_path(self.b, self.b_sha, self.b_mode)
+
+    @property
+    def type(self):
+        if self.a == '':
+            return 'add'
+        elif self.b == '':
+            return 'delete'
+        elif self.is_move:
+            return 'move'
+        return 'change'
+
+    @staticmethod
+    def from_diff_raw_line(line: RawDiffLine, cat_file: CatFilePool, root: str):
+        a, b = line.path, line.dst_path or line.path
+        if line.status == 'A':
+            a = ''
+        elif line.status == 'D':
+            b = ''
+        return GitFileDiff(
+            cat_file,
+            root,
+            a,
+            b,
+            line.src_sha,
+            line.dst_sha,
+            line.src_mode,
+            line.dst_mode,
+            is_move=bool(line.dst_path),
+            num_add=line.num_add,
+            num_delete=line.num_delete,
+        )
+
+
+def gitdiff(git_args: List[str], webdiff_config) -> List[GitFileDiff]:
+    """Returns a GitFileDiff for each file in `git diff <git_args>`.
+
+    git_args are anything git diff accepts: a revision range, --cached, a
+    single revision to compare with the working tree, pathspecs, etc.
+    Nothing but the file list is read here.
+    """
+    try:
+        root = subprocess.check_output(
+            ['git', 'rev-parse', '--show-toplevel'], stderr=subprocess.PIPE, text=True
+        ).strip()
+    except subprocess.CalledProcessError as e:
+        raise GitObjectError(e.stderr.strip()) from e
+    cat_file = CatFilePool(root, webdiff_config.get('gitProcesses', 4))
+
+    extra_args = webdiff_config['extraDirDiffArgs']
+    # Paths are relative to root, whatever diff.relative is set to.
+    args = ['git', 'diff', '--raw', '-z', '--numstat', '--no-abbrev', '--no-relative']
+    if extra_args:
+        args += extra_args.split(' ')
+    args += git_args
+    logging.debug('Running git command: %s', args)
+    # stderr goes to a file: a pipe which nobody reads until stdout is done
+    # would block git (and so this) once it filled up with warnings.
+    with tempfile.TemporaryFile() as err_file:
+        with subprocess.Popen(args, stdout=subprocess.PIPE, stderr=err_file) as proc:
+            diffs = [
+                GitFileDiff.from_diff_raw_line(line, cat_file, root) for line in iter_raw_diff(proc.stdout)
+            ]
+        if proc.returncode != 0:
+            err_file.seek(0)
+            raise GitObjectError(err_file.read().decode('utf8', 'replace').strip())
+    if diffs and _compares_worktree(git_args):
+        _read_unstored_from_worktree(diffs, root)
+    return diffs
+
+
+def _compares_worktree(git_args: List[str]) -> bool:
+    """Is one side of `git diff <git_args>` the working tree?
+
+    That's the case unless the diff is of the index or between two commits.
+    """
+    args = git_args[: git_args.index('--')] if '--' in git_args else git_args
+    if '--cached' in args or '--staged' in args:
+        return False
+    revs = subprocess.run(
+        ['git', 'rev-parse', '--revs-only', *args], capture_output=True, text=True
+    ).stdout.split()
+    return len(revs) < 2
+
+
+def _read_unstored_from_worktree(diffs: List[GitFileDiff], root: str):
+    """Give sides whose blobs aren't in the object store the null sha.
+
+    For a working tree file which git matched up as a rename or copy, git diff
+    --raw reports the sha of its contents, but never writes that blob. Those
+    files can only be read in place.
+    """
+    shas = {
+        sha
+        for d in diffs
+        for sha, mode in ((d.a_sha, d.a_mode), (d.b_sha, d.b_mode))
+        if sha != NULL_SHA and mode != GITLINK_MODE
+    }
+    out = subprocess.run(
+        ['git', 'cat-file', '--batch-check'],
+        cwd=root,
+        input=''.join(sha + '\n' for sha in shas),
+        capture_output=True,
+        text=True,
+    ).stdout
+    missing = {line.split()[0] for line in out.splitlines() if line.endswith(' missing')}
+    for d in diffs:
+        if d.a_sha in missing:
+            d.a_sha = NULL_SHA
+        if d.b_sha in missing:
+            d.b_sha = NULL_SHA
@@ -0,0 +1,355 @@
+"""Long-lived and batched git processes, to avoid a fork/exec per request.
+
+CatFilePool keeps a few `git cat-file --batch` processes running for reading
+blobs. DiffBatcher combines concurrent `git diff --no-index` calls on file
+pairs into a single run over two directories of hard links to the files.
+"""
+
+import atexit
+import errno
+import logging
+import os
+import queue
+import re
+import select
+import subprocess
+import threading
+import time
+from dataclasses import dataclass, field
+from typing import BinaryIO, List, Optional, Union
+
+from webdiff import scratch
+
+COPY_CHUNK_BYTES = 1 << 16
+# git knows the empty tree even in repositories which don't contain it.
+EMPTY_TREE_SHA = '4b825dc642cb6eb9a060e54bf8d69288fbee4904'
+HEALTH_CHECK_IDLE_SECS = 30
+HEALTH_CHECK_TIMEOUT_SECS = 5
+
+
+class GitObjectError(Exception):
+    pass
+
+
+class CatFile:
+    """A long-running `git cat-file --batch` process for one repository.
+
+    Requests are serialized; the process is (re)started on demand, so one
+    that dies or gets out of sync only costs the request that saw it.
+    """
+
+    def __init__(self, cwd: str):
+        self.cwd = cwd
+        self.last_used = time.monotonic()
+        self._proc = None
+        self._lock = threading.Lock()
+        atexit.register(self.close)
+
+    def _process(self) -> subprocess.Popen:
+        if self._proc is None or self._proc.poll() is not None:
+            self._proc = subprocess.Popen(
+                ['git', 'cat-file', '--batch'],
+                cwd=self.cwd,
+                stdin=subprocess.PIPE,
+                stdout=subprocess.PIPE,
+                stderr=subprocess.DEVNULL,
+            )
+        return self._proc
+
+    def copy_to(self, sha: str, out: BinaryIO) -> int:
+        """Write the contents of the object sha to out; returns its size."""
+        with self._lock:
+            self.last_used = time.monotonic()
+            try:
+                size = self._copy(self._process(), sha, out)
+            except (OSError, ValueError, EOFError) as e:
+                # The process is in an unknown state; start a new one next time.
+                self._kill()
+                raise GitObjectError(f'Unable to read {sha}: {e}') from e
+        if size is None:
+            raise GitObjectError(f'{sha} is missing')
+        return size
+
+    @staticmethod
+    def _copy(proc: subprocess.Popen, sha: str, out: BinaryIO) -> Optional[int]:
+        proc.stdin.write(sha.encode('ascii') + b'\n')
+        proc.stdin.flush()
+        header = proc.stdout.readline().split()
+        if header[1:] == [b'missing']:
+            return None
+        if len(header) != 3:
+            raise ValueError(f'unexpected cat-file output {header}')
+        size = remaining = int(header[2])
+        while remaining:
+            chunk = proc.stdout.read(min(remaining, COPY_CHUNK_BYTES))
+            if not chunk:
+                raise EOFError('cat-file exited')
+            out.write(chunk)
+            remaining -= len(chunk)
+        proc.stdout.read(1)  # the newline after the contents
+        return size
+
+    def check_health(self, timeout: float = HEALTH_CHECK_TIMEOUT_SECS) -> bool:
+        """Make sure the process answers; kills it (for a restart) if it doesn't."""
+        with self._lock:
+            proc = self._proc
+            if proc is None or proc.poll() is not None:
+                return True
+            try:
+                proc.stdin.write(EMPTY_TREE_SHA.encode('ascii') + b'\n')
+                proc.stdin.flush()
+                ready, _, _ = select.select([proc.stdout], [], [], timeout)
+                if ready and proc.stdout.readline().split()[2:] == [b'0']:
+                    proc.stdout.read(1)
+                    return True
+            except (OSError, ValueError):
+                pass
+            logging.warning(f'Restarting unresponsive git cat-file in {self.cwd}')
+            self._kill()
+            return False
+
+    def _kill(self):
+        if self._proc:
+            self._proc.kill()
+            self._proc.wait()
+            self._proc = None
+
+    def close(self):
+        with self._lock:
+            if self._proc:
+                self._proc.stdin.close()
+                self._proc.wait()
+                self._proc = None
+
+
+class CatFilePool:
+    """Up to size CatFiles, so that concurrent reads don't queue behind each other.
+
+    Processes which have sat idle for a while are health-checked before use.
+    """
+
+    def __init__(self, cwd: str, size: int = 4):
+        self._idle: queue.LifoQueue[CatFile] = queue.LifoQueue()
+        for _ in range(max(1, size)):
+            self._idle.put(CatFile(cwd))
+
+    def copy_to(self, sha: str, out: BinaryIO) -> int:
+        cat_file = self._idle.get()
+        try:
+            if time.monotonic() - cat_file.last_used > HEALTH_CHECK_IDLE_SECS:
+                cat_file.check_health()
+            return cat_file.copy_to(sha, out)
+        finally:
+            self._idle.put(cat_file)
+
+
+@dataclass(eq=False)
+class _DiffRequest:
+    # Each side is a path, or the contents to diff as bytes.
+    a: Union[str, bytes]
+    b: Union[str, bytes]
+    # The file name git sees for both sides; diff drivers can depend on it.
+    name: str
+    output: bytes = b''
+    error: Optional[Exception] = None
+    # Set when the batch hands the request back to be diffed on its own.
+    run_alone: bool = False
+    done: threading.Event = field(default_factory=threading.Event)
+
+
+class DiffBatcher:
+    """Runs concurrent `git diff --no-index` calls with the same args as one git process.
+
+    Up to max_running git processes run at once. Requests which arrive while
+    they're all busy queue up, and the next free slot takes every queued
+    request with the same args (up to max_batch) as one batch. So a lone
+    request runs straight away, and only a backlog gets batched.
+
+    A batch hard-links each pair into numbered subdirectories of two scratch
+    directories, diffs those and splits the output back up by pair. Pairs
+    which can't be hard-linked (e.g. on another filesystem) go back to their
+    callers to be diffed on their own, in parallel, and files on that
+    filesystem skip batching from then on. Sides given as bytes are written
+    out to scratch files for the run.
+    """
+
+    def __init__(self, max_running: Optional[int] = None, max_batch: int = 64):
+        self.max_running = max_running or os.cpu_count() or 1
+        self.max_batch = max_batch
+        self._cond = threading.Condition()
+        self._queued: dict = {}
+        self._running = 0
+        # Devices whose files can't be hard linked into the scratch area.
+        self._unlinkable_devices: set = set()
+
+    def diff(
+        self, a: Union[str, bytes], b: Union[str, bytes], git_diff_args: List[str], name: Optional[str] = None
+    ) -> bytes:
+        """Returns the stdout of `git diff --no-index <git_diff_args> a b`.
+
+        Either side can be the contents to diff (e.g. normalized JSON) rather
+        than a path; name is then the file name to give them, which defaults
+        to that of the path.
+        """
+        key = tuple(git_diff_args)
+        if name is None:
+            name = os.path.basename(b if isinstance(b, str) else a)
+        request = _DiffRequest(a, b, name)
+        if self._can_link(request):
+            with self._cond:
+                self._queued.setdefault(key, []).append(request)
+            while (batch := self._next_batch(key, request)) is not None:
+                try:
+                    self._run(batch, git_diff_args)
+                finally:
+                    with self._cond:
+                        self._running -= 1
+                        self._cond.notify_all()
+        else:
+            request.run_alone = True
+        if request.run_alone:
+            self._run_one(request, git_diff_args)
+        if request.error:
+            raise request.error
+        return request.output
+
+    def _can_link(self, request: _DiffRequest) -> bool:
+        with self._cond:
+            return not _devices(request) & self._unlinkable_devices
+
+    def _next_batch(self, key, request: _DiffRequest) -> Optional[List[_DiffRequest]]:
+        """Wait until request is done (None) or there's a free slot to run its queue in."""
+        with self._cond:
+            while not request.done.is_set():
+                queued = self._queued.get(key)
+                if queued and self._running < self.max_running:
+                    batch, rest = queued[: self.max_batch], queued[self.max_batch :]
+                    if rest:
+                        self._queued[key] = rest
+                    else:
+                        del self._queued[key]
+                    self._running += 1
+                    return batch
+                self._cond.wait()
+            return None
+
+    def _run(self, batch: List[_DiffRequest], git_diff_args: List[str]):
+        try:
+            if len(batch) == 1:
+                self._run_one(batch[0], git_diff_args)
+            else:
+                self._run_batch(batch, git_diff_args)
+        except Exception as e:
+            for request in batch:
+                if not request.done.is_set() and not request.run_alone:
+                    request.error = e
+        finally:
+            for request in batch:
+                request.done.set()
+
+    @staticmethod
+    def _run_one(request: _DiffRequest, git_diff_args: List[str]):
+        written = []
+        try:
+            paths = []
+            for side in (request.a, request.b):
+                if isinstance(side, bytes):
+                    path = scratch.new_file(os.path.splitext(request.name)[1])
+                    written.append(path)
+                    with open(path, 'wb') as f:
+                        f.write(side)
+                    side = path
+                paths.append(side)
+            args = ['git', 'diff', '--no-index'] + git_diff_args + paths
+            logging.debug('Running git command: %s', args)
+            request.output = subprocess.run(args, capture_output=True).stdout
+        finally:
+            for path in written:
+                scratch.remove(path)
+        request.done.set()
+
+    def _run_batch(self, batch: List[_DiffRequest], git_diff_args: List[str]):
+        root = scratch.new_dir()
+        a_dir, b_dir = os.path.join(root, 'a'), os.path.join(root, 'b')
+        linked = {}
+        try:
+            for i, request in enumerate(batch):
+                try:
+                    _link_pair(request, i, a_dir, b_dir)
+                    linked[i] = request
+                except OSError as e:
+                    if e.errno in (errno.EXDEV, errno.EPERM, errno.EMLINK):
+                        with self._cond:
+                            self._unlinkable_devices |= _devices(request)
+                    request.run_alone = True
+
+            if not linked:
+                return
+            # Hard links would look like renames of one another. Unquoted
+            # non-ASCII paths keep the headers easy to match to their pairs.
+            args = (
+                ['git', '-c', 'core.quotePath=false', 'diff', '--no-index']
+                + git_diff_args
+                + ['--no-renames', a_dir, b_dir]
+            )
+            logging.debug('Running batched git command for %d pairs: %s', len(linked), args)
+            output = subprocess.run(args, capture_output=True).stdout
+            sections, all_matched = _split_by_pair(output, a_dir)
+            for i, request in linked.items():
+                if i in sections:
+                    request.output = sections[i]
+                elif not all_matched:
+                    # Its section may be the one which didn't match; an
+                    # unchanged pair has no section at all.
+                    request.run_alone = True
+        finally:
+            scratch.remove(root)
+
+
+def _devices(request: _DiffRequest) -> set:
+    """The devices of the request's sides which are paths."""
+    devices = set()
+    for side in (request.a, request.b):
+        if isinstance(side, str):
+            try:
+                devices.add(os.stat(side).st_dev)
+            except OSError:
+                pass  # git diff will report it
+    return devices
+
+
+def _link_pair(request: _DiffRequest, i: int, a_dir: str, b_dir: str):
+    """Hard link (or write) the pair's sides as a_dir/i/name and b_dir/i/name."""
+    # Both sides need the same name to be compared. Keep the real one, since
+    # diff drivers (and so hunk headers) can depend on it.
+    for side, side_dir in ((request.a, a_dir), (request.b, b_dir)):
+        pair_dir = os.path.join(side_dir, str(i))
+        os.makedirs(pair_dir)
+        path = os.path.join(pair_dir, request.name)
+        if isinstance(side, bytes):
+            with open(path, 'wb') as f:
+                f.write(side)
+        else:
+            os.link(side, path)
+
+
+def _split_by_pair(output: bytes, a_dir: str):
+    """Splits a batched diff's output into {pair number: its part of the diff}.
+
+    Also returns whether every section's header could be matched to a pair.
+    """
+    # The header is like "diff --git a/<a_dir>/3/name b/<b_dir>/3/name", modulo
+    # prefix settings and quoting of unusual names.
+    pair_path = re.compile(re.escape(os.fsencode(a_dir).lstrip(b'/')) + rb'/(\d+)/')
+    sections = {}
+    all_matched = True
+    for section in re.split(rb'(?m)^(?=diff --git )', output)[1:]:
+        m = pair_path.search(section, 0, section.find(b'\n'))
+        if m:
+            sections[int(m.group(1))] = section
+        else:
+            all_matched = False
+    return sections, all_matched
+
+
+BATCHER = DiffBatcher()
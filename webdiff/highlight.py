@@ -0,0 +1,185 @@
+"""Syntax highlighting on the server, for files too big to highlight in the browser.
+
+Files are tokenized with Pygments (an optional dependency) in a pool of worker
+processes, since tokenizing is CPU-bound. The tokens are cached by content
+hash, one JSON array per line, so that any window of lines can be sent
+without tokenizing the file again. Token types are mapped onto the
+highlight.js classes which the themes style.
+"""
+
+import concurrent.futures
+import functools
+import importlib.util
+import json
+import logging
+import multiprocessing
+import os
+import threading
+from typing import Callable, Hashable, List, Optional, Tuple
+
+from webdiff import cache
+
+# Larger files aren't highlighted at all.
+MAX_HIGHLIGHT_CHARS = 32 * 1024 * 1024
+
+# The highlight.js class for each Pygments token type. A token gets the class
+# of its most specific type which is listed here, if any.
+HLJS_CLASSES = {
+    'Comment': 'hljs-comment',
+    'Comment.Preproc': 'hljs-meta',
+    'Comment.PreprocFile': 'hljs-string',
+    'Generic.Deleted': 'hljs-deletion',
+    'Generic.Emph': 'hljs-emphasis',
+    'Generic.Heading': 'hljs-section',
+    'Generic.Inserted': 'hljs-addition',
+    'Generic.Strong': 'hljs-strong',
+    'Generic.Subheading': 'hljs-section',
+    'Keyword': 'hljs-keyword',
+    'Keyword.Constant': 'hljs-literal',
+    'Keyword.Type': 'hljs-type',
+    'Literal.Number': 'hljs-number',
+    'Literal.String': 'hljs-string',
+    'Literal.String.Escape': 'hljs-char escape_',
+    'Literal.String.Interpol': 'hljs-subst',
+    'Literal.String.Regex': 'hljs-regexp',
+    'Name.Attribute': 'hljs-attr',
+    'Name.Builtin': 'hljs-built_in',
+    'Name.Builtin.Pseudo': 'hljs-variable language_',
+    'Name.Class': 'hljs-title class_',
+    'Name.Constant': 'hljs-variable constant_',
+    'Name.Decorator': 'hljs-meta',
+    'Name.Entity': 'hljs-symbol',
+    'Name.Exception': 'hljs-title class_',
+    'Name.Function': 'hljs-title function_',
+    'Name.Label': 'hljs-symbol',
+    'Name.Tag': 'hljs-name',
+    'Name.Variable': 'hljs-variable',
+    'Operator.Word': 'hljs-keyword',
+}
+
+# Tokenized files by key: the lexer name, then one JSON array per line, all
+# separated by newlines. An empty lexer name means "not highlighted".
+_TOKENS = cache.ByteLRUCache(64 * 1024 * 1024)
+_in_flight: dict = {}
+_lock = threading.Lock()
+_pool = None
+num_processes = min(4, os.cpu_count() or 1)
+
+
+def is_available() -> bool:
+    return importlib.util.find_spec('pygments') is not None
+
+
+def _get_pool() -> concurrent.futures.ProcessPoolExecutor:
+    global _pool
+    with _lock:
+        if _pool is None:
+            # Forking a process with running threads (the server's) isn't safe.
+            _pool = concurrent.futures.ProcessPoolExecutor(
+                max_workers=num_processes, mp_context=multiprocessing.get_context('spawn')
+            )
+        return _pool
+
+
+@functools.lru_cache(maxsize=None)
+def _hljs_class(ttype) -> Optional[str]:
+    while ttype.parent is not None:
+        cls = HLJS_CLASSES.get(str(ttype)[len('Token.') :])
+        if cls:
+            return cls
+        ttype = ttype.parent
+    return None
+
+
+def _utf16_len(s: str) -> int:
+    return len(s) if s.isascii() else len(s.encode('utf-16-le')) // 2
+
+
+def _tokenize(name: str, text: str) -> bytes:
+    """Tokenize text as the file name would be; runs in a worker process.
+
+    Pygments turns CRLF and CR line endings into LF. The offsets within each
+    line don't include its line ending, so the text is normalized the same
+    way up front and its tokens still line up with the browser's lines.
+    """
+    from pygments.lexers import get_lexer_for_filename
+    from pygments.util import ClassNotFound
+
+    try:
+        lexer = get_lexer_for_filename(name, stripnl=False, ensurenl=False)
+    except ClassNotFound:
+        return b''
+    if lexer.name == 'Text only' or len(text) > MAX_HIGHLIGHT_CHARS:
+        return b''
+    if '\r' in text:
+        text = text.replace('\r\n', '\n').replace('\r', '\n')
+
+    # Pygments drops a BOM, but it's still part of the first line in the browser.
+    bom = text.startswith('\ufeff')
+    lines = [[1, None] if bom else []]
+    tokenized = []
+    for ttype, value in lexer.get_tokens(text[1:] if bom else text):
+        tokenized.append(value)
+        cls = _hljs_class(ttype)
+        for i, part in enumerate(value.split('\n')):
+            if i:
+                lines.append([])
+            if not part:
+                continue
+            line = lines[-1]
+            if line and line[-1] == cls:
+                line[-2] += _utf16_len(part)
+            else:
+                line += [_utf16_len(part), cls]
+    if ''.join(tokenized) != (text[1:] if bom else text):
+        # The lexer changed the text some other way, so the offsets would be off.
+        logging.debug(f'Not highlighting {name}: tokens do not match the text')
+        return b''
+    return b'\n'.join([lexer.aliases[0].encode('utf8')] + [json.dumps(line).encode('utf8') for line in lines])
+
+
+def _tokenized(key: Hashable, name: str, read_text: Callable[[], str]) -> List[bytes]:
+    data = _TOKENS.get(key)
+    if data is None:
+        with _lock:
+            future = _in_flight.get(key)
+            owner = future is None
+            if owner:
+                future = _in_flight[key] = concurrent.futures.Future()
+        if owner:
+            try:
+                data = _get_pool().submit(_tokenize, name, read_text()).result()
+                _TOKENS.put(key, data)
+                future.set_result(data)
+            except Exception as e:
+                future.set_exception(e)
+                raise
+            finally:
+                with _lock:
+                    del _in_flight[key]
+        else:
+            data = future.result()
+    return data.split(b'\n')
+
+
+def render_windows(
+    key: Hashable, name: str, read_text: Callable[[], str], ranges: List[Tuple[int, int]]
+) -> Tuple[Optional[str], bytes]:
+    """Returns (lexer name, JSON windows) for lines [start, end) of each range.
+
+    key identifies the file's contents (e.g. its hash). read_text is only
+    called to tokenize it if the tokens aren't cached. The windows are a
+    JSON list of {"start", "end", "lines"}; each line is a flattened list of
+    [length, class, length, class, ...], with lengths in UTF-16 code units
+    and a null class for plain text. The lexer name is None (and there are
+    no windows) if the file isn't highlighted.
+    """
+    language, *lines = _tokenized(key, name, read_text)
+    if not language:
+        return None, b'[]'
+    windows = []
+    for start, end in ranges:
+        start = max(0, min(start, len(lines)))
+        end = max(start, min(end, len(lines)))
+        windows.append(b'{"start":%d,"end":%d,"lines":[%s]}' % (start, end, b','.join(lines[start:end])))
+    return language.decode('utf8'), b'[' + b','.join(windows) + b']'
@@ -0,0 +1,89 @@
+"""Resized, re-encoded and cropped variants of images, generated with Pillow."""
+
+import io
+from dataclasses import dataclass
+from typing import Optional, Tuple
+
+from PIL import Image
+
+FORMATS = {
+    'png': ('PNG', 'image/png'),
+    'jpeg': ('JPEG', 'image/jpeg'),
+    'webp': ('WEBP', 'image/webp'),
+}
+MAX_DIMENSION = 8192
+
+
+class VariantError(Exception):
+    pass
+
+
+class ImageTooLargeError(VariantError):
+    """The image has more pixels than Pillow will decode (Image.MAX_IMAGE_PIXELS)."""
+
+
+@dataclass(frozen=True)
+class VariantSpec:
+    """What to do to an image; frozen so that it can be part of a cache key."""
+
+    max_size: Optional[int] = None
+    """Scale down (never up) so that neither dimension exceeds this."""
+    format: Optional[str] = None
+    """One of FORMATS; defaults to PNG."""
+    region: Optional[Tuple[int, int, int, int]] = None
+    """(left, top, width, height) to crop at full resolution before resizing."""
+
+    @staticmethod
+    def parse(max_size: Optional[int], format: Optional[str], region: Optional[str]) -> 'VariantSpec':
+        if max_size is not None and not 1 <= max_size <= MAX_DIMENSION:
+            raise VariantError(f'max_size must be between 1 and {MAX_DIMENSION}')
+        if format is not None:
+            format = format.lower().replace('jpg', 'jpeg')
+            if format not in FORMATS:
+                raise VariantError(f'Unsupported format {format}')
+        box = None
+        if region is not None:
+            try:
+                box = tuple(int(x) for x in region.split(','))
+            except ValueError:
+                box = ()
+            if len(box) != 4 or box[0] < 0 or box[1] < 0 or box[2] <= 0 or box[3] <= 0:
+                raise VariantError('region must be left,top,width,height')
+        return VariantSpec(max_size, format, box)
+
+
+def render(path: str, spec: VariantSpec) -> Tuple[bytes, str]:
+    """Returns (encoded image, media type) for the variant of the image at path."""
+    try:
+        im = Image.open(path)
+        im.load()
+    except Image.DecompressionBombError as e:
+        raise ImageTooLargeError(str(e))
+    except OSError as e:
+        raise VariantError(f'Unable to read image: {e}')
+
+    if spec.region:
+        left, top, width, height = spec.region
+        if left + width > im.width or top + height > im.height:
+            raise VariantError(f'region is outside the {im.width}x{im.height} image')
+        im = im.crop((left, top, left + width, top + height))
+    if spec.max_size:
+        # thumbnail() preserves the aspect ratio and only ever shrinks.
+        im.thumbnail((spec.max_size, spec.max_size), Image.Resampling.LANCZOS)
+
+    pil_format, media_type = FORMATS[spec.format or 'png']
+    if pil_format == 'JPEG':
+        if im.mode in ('RGBA', 'LA', 'P'):
+            # JPEG has no alpha; flatten onto white like a browser would show it.
+            im = im.convert('RGBA')
+            background = Image.new('RGB', im.size, (255, 255, 255))
+            background.paste(im, mask=im.getchannel('A'))
+            im = background
+        elif im.mode != 'RGB':
+            im = im.convert('RGB')
+    elif im.mode not in ('RGB', 'RGBA') and (pil_format == 'WEBP' or im.mode not in ('L', 'LA', 'P')):
+        im = im.convert('RGBA')
+
+    out = io.BytesIO()
+    im.save(out, format=pil_format, **({'quality': 85} if pil_format != 'PNG' else {}))
+    return out.getvalue(), media_type
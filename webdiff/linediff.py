@@ -0,0 +1,1048 @@
+"""In-process line diff engine that mirrors git's xdiff.
+
+get_diff_ops normally runs `git diff --no-index` and parses the unified diff it
+prints. This module computes the same list of Codes directly in Python, without
+forking git or round-tripping through a textual patch. It is a port of the
+parts of git's xdiff (xprepare.c, xdiffi.c, xpatience.c, xhistogram.c and
+xemit.c) that affect which lines are reported as changed, so the output matches
+what the git backend produces for the options it understands.
+"""
+
+import os
+import re
+import stat
+from collections import Counter
+from dataclasses import dataclass
+from typing import List, Optional, Tuple, Union
+
+from webdiff.unified_diff import Code, add_end_skip, add_replaces
+
+# git's isspace() only treats these as whitespace (see git's ctype.c).
+WHITESPACE = b' \t\n\r'
+_WHITESPACE_RUN = re.compile(b'[ \t\n\r]+')
+
+# git only looks for NUL bytes in this many leading bytes to detect binaries.
+FIRST_FEW_BYTES = 8000
+
+XDL_MAX_COST_MIN = 256
+XDL_HEUR_MIN_COST = 256
+XDL_SNAKE_CNT = 20
+XDL_K_HEUR = 4
+XDL_LINE_MAX = (1 << 63) - 1
+XDL_MAX_EQLIMIT = 1024
+XDL_SIMSCAN_WINDOW = 100
+XDL_KPDIS_RUN = 4
+
+MAX_INDENT = 200
+MAX_BLANKS = 20
+INDENT_HEURISTIC_MAX_SLIDING = 100
+
+HISTOGRAM_MAX_CHAIN_LENGTH = 64
+
+FUNC_LINE_SIZE = 80
+
+ALGORITHMS = ('myers', 'minimal', 'patience', 'histogram')
+
+
+@dataclass
+class DiffOptions:
+    """The subset of `git diff` options that this engine understands."""
+
+    algorithm: str = 'myers'
+    """One of "myers" | "patience" | "histogram"."""
+    need_minimal: bool = False
+    """Spend extra time to find the smallest diff (--minimal)."""
+    context: int = 3
+    """Number of unified context lines (-U)."""
+    whitespace: Optional[str] = None
+    """One of "all" (-w) | "change" (-b) | "eol" | "cr", or None."""
+    indent_heuristic: bool = True
+
+
+def parse_git_diff_args(args: Union[List[str], None]) -> Optional[DiffOptions]:
+    """Convert `git diff` flags to DiffOptions.
+
+    Returns None if any flag isn't supported, in which case the caller should
+    fall back to running git.
+    """
+    opts = DiffOptions()
+    ignore = set()
+    for arg in args or []:
+        if arg in ('-w', '--ignore-all-space'):
+            ignore.add('all')
+        elif arg in ('-b', '--ignore-space-change'):
+            ignore.add('change')
+        elif arg == '--ignore-space-at-eol':
+            ignore.add('eol')
+        elif arg == '--ignore-cr-at-eol':
+            ignore.add('cr')
+        elif arg == '--minimal':
+            opts.need_minimal = True
+        elif arg == '--patience':
+            opts.algorithm = 'patience'
+        elif arg == '--histogram':
+            opts.algorithm = 'histogram'
+        elif arg.startswith('--diff-algorithm='):
+            algo = arg.split('=', 1)[1]
+            if algo == 'default':
+                algo = 'myers'
+            if algo not in ALGORITHMS:
+                return None
+            opts.need_minimal = algo == 'minimal'
+            opts.algorithm = 'myers' if algo == 'minimal' else algo
+        elif arg == '--indent-heuristic':
+            opts.indent_heuristic = True
+        elif arg == '--no-indent-heuristic':
+            opts.indent_heuristic = False
+        elif m := re.fullmatch(r'(?:-U|--unified=)(\d+)', arg):
+            opts.context = int(m.group(1))
+        elif re.fullmatch(r'(-M|-C|--find-renames|--find-copies)(=?\d+%?)?', arg):
+            # Rename & copy detection don't matter when diffing a single pair.
+            pass
+        elif arg == '--find-copies-harder':
+            pass
+        else:
+            return None
+    for kind in ('all', 'change', 'eol', 'cr'):
+        if kind in ignore:
+            opts.whitespace = kind
+            break
+    return opts
+
+
+def _record_key(whitespace: Optional[str]):
+    """Return a function mapping a line to a key with xdl_recmatch equality."""
+    if whitespace == 'all':
+        return lambda rec: rec.translate(None, WHITESPACE)
+    if whitespace == 'change':
+        return lambda rec: _WHITESPACE_RUN.sub(b' ', rec).rstrip(b' ')
+    if whitespace == 'eol':
+        return lambda rec: rec.rstrip(WHITESPACE)
+    if whitespace == 'cr':
+        return lambda rec: rec[:-2] if rec.endswith(b'\r\n') else rec.rstrip(b'\n')
+    return None
+
+
+def split_records(data: bytes) -> List[bytes]:
+    """Split file contents into lines, each including its trailing newline."""
+    lines = data.split(b'\n')
+    last = lines.pop()
+    recs = [line + b'\n' for line in lines]
+    if last:
+        recs.append(last)
+    return recs
+
+
+def num_lines(data: bytes) -> int:
+    """Count lines the same way `grep -c ''` does."""
+    n = data.count(b'\n')
+    if data and not data.endswith(b'\n'):
+        n += 1
+    return n
+
+
+def _bogosqrt(n: int) -> int:
+    i = 1
+    while n > 0:
+        i <<= 1
+        n >>= 2
+    return i
+
+
+def _classify(recs1, recs2, whitespace):
+    """Map each line to an integer such that equal lines get equal ids."""
+    key = _record_key(whitespace)
+    classes = {}
+    ha1 = [classes.setdefault(key(r) if key else r, len(classes)) for r in recs1]
+    ha2 = [classes.setdefault(key(r) if key else r, len(classes)) for r in recs2]
+    return ha1, ha2
+
+
+# --- Myers (xdiffi.c) ---
+
+
+def _clean_mmatch(dis, i, s, e):
+    if i - s > XDL_SIMSCAN_WINDOW:
+        s = i - XDL_SIMSCAN_WINDOW
+    if e - i > XDL_SIMSCAN_WINDOW:
+        e = i + XDL_SIMSCAN_WINDOW
+
+    rdis0 = 0
+    rpdis0 = 1
+    r = 1
+    while i - r >= s:
+        if not dis[i - r]:
+            rdis0 += 1
+        elif dis[i - r] == 2:
+            rpdis0 += 1
+        else:
+            break
+        r += 1
+    if rdis0 == 0:
+        return False
+    rdis1 = 0
+    rpdis1 = 1
+    r = 1
+    while i + r <= e:
+        if not dis[i + r]:
+            rdis1 += 1
+        elif dis[i + r] == 2:
+            rpdis1 += 1
+        else:
+            break
+        r += 1
+    if rdis1 == 0:
+        return False
+    rdis1 += rdis0
+    rpdis1 += rpdis0
+    return rpdis1 * XDL_KPDIS_RUN < rpdis1 + rdis1
+
+
+def _split(ha1, off1, lim1, ha2, off2, lim2, kvdf, kvdb, koff, need_min, mxcost):
+    """Port of xdl_split. Returns (i1, i2, min_lo, min_hi)."""
+    dmin = off1 - lim2
+    dmax = lim1 - off2
+    fmid = off1 - off2
+    bmid = lim1 - lim2
+    odd = (fmid - bmid) & 1
+    fmin = fmax = fmid
+    bmin = bmax = bmid
+
+    kvdf[fmid + koff] = off1
+    kvdb[bmid + koff] = lim1
+
+    ec = 0
+    while True:
+        ec += 1
+        got_snake = False
+
+        if fmin > dmin:
+            fmin -= 1
+            kvdf[fmin - 1 + koff] = -1
+        else:
+            fmin += 1
+        if fmax < dmax:
+            fmax += 1
+            kvdf[fmax + 1 + koff] = -1
+        else:
+            fmax -= 1
+
+        for d in range(fmax, fmin - 1, -2):
+            if kvdf[d - 1 + koff] >= kvdf[d + 1 + koff]:
+                i1 = kvdf[d - 1 + koff] + 1
+            else:
+                i1 = kvdf[d + 1 + koff]
+            prev1 = i1
+            i2 = i1 - d
+            while i1 < lim1 and i2 < lim2 and ha1[i1] == ha2[i2]:
+                i1 += 1
+                i2 += 1
+            if i1 - prev1 > XDL_SNAKE_CNT:
+                got_snake = True
+            kvdf[d + koff] = i1
+            if odd and bmin <= d <= bmax and kvdb[d + koff] <= i1:
+                return i1, i2, True, True
+
+        if bmin > dmin:
+            bmin -= 1
+            kvdb[bmin - 1 + koff] = XDL_LINE_MAX
+        else:
+            bmin += 1
+        if bmax < dmax:
+            bmax += 1
+            kvdb[bmax + 1 + koff] = XDL_LINE_MAX
+        else:
+            bmax -= 1
+
+        for d in range(bmax, bmin - 1, -2):
+            if kvdb[d - 1 + koff] < kvdb[d + 1 + koff]:
+                i1 = kvdb[d - 1 + koff]
+            else:
+                i1 = kvdb[d + 1 + koff] - 1
+            prev1 = i1
+            i2 = i1 - d
+            while i1 > off1 and i2 > off2 and ha1[i1 - 1] == ha2[i2 - 1]:
+                i1 -= 1
+                i2 -= 1
+            if prev1 - i1 > XDL_SNAKE_CNT:
+                got_snake = True
+            kvdb[d + koff] = i1
+            if not odd and fmin <= d <= fmax and i1 <= kvdf[d + koff]:
+                return i1, i2, True, True
+
+        if need_min:
+            continue
+
+        if got_snake and ec > XDL_HEUR_MIN_COST:
+            best = 0
+            spl = None
+            for d in range(fmax, fmin - 1, -2):
+                dd = d - fmid if d > fmid else fmid - d
+                i1 = kvdf[d + koff]
+                i2 = i1 - d
+                v = (i1 - off1) + (i2 - off2) - dd
+                if (
+                    v > XDL_K_HEUR * ec
+                    and v > best
+                    and off1 + XDL_SNAKE_CNT <= i1 < lim1
+                    and off2 + XDL_SNAKE_CNT <= i2 < lim2
+                ):
+                    k = 1
+                    while ha1[i1 - k] == ha2[i2 - k]:
+                        if k == XDL_SNAKE_CNT:
+                            best = v
+                            spl = (i1, i2)
+                            break
+                        k += 1
+            if best > 0:
+                return spl[0], spl[1], True, False
+
+            best = 0
+            for d in range(bmax, bmin - 1, -2):
+                dd = d - bmid if d > bmid else bmid - d
+                i1 = kvdb[d + koff]
+                i2 = i1 - d
+                v = (lim1 - i1) + (lim2 - i2) - dd
+                if (
+                    v > XDL_K_HEUR * ec
+                    and v > best
+                    and off1 < i1 <= lim1 - XDL_SNAKE_CNT
+                    and off2 < i2 <= lim2 - XDL_SNAKE_CNT
+                ):
+                    k = 0
+                    while ha1[i1 + k] == ha2[i2 + k]:
+                        if k == XDL_SNAKE_CNT - 1:
+                            best = v
+                            spl = (i1, i2)
+                            break
+                        k += 1
+            if best > 0:
+                return spl[0], spl[1], False, True
+
+        if ec >= mxcost:
+            fbest = fbest1 = -1
+            for d in range(fmax, fmin - 1, -2):
+                i1 = min(kvdf[d + koff], lim1)
+                i2 = i1 - d
+                if lim2 < i2:
+                    i1 = lim2 + d
+                    i2 = lim2
+                if fbest < i1 + i2:
+                    fbest = i1 + i2
+                    fbest1 = i1
+
+            bbest = bbest1 = XDL_LINE_MAX
+            for d in range(bmax, bmin - 1, -2):
+                i1 = max(off1, kvdb[d + koff])
+                i2 = i1 - d
+                if i2 < off2:
+                    i1 = off2 + d
+                    i2 = off2
+                if i1 + i2 < bbest:
+                    bbest = i1 + i2
+                    bbest1 = i1
+
+            if (lim1 + lim2) - bbest < fbest - (off1 + off2):
+                return fbest1, fbest - fbest1, True, False
+            return bbest1, bbest - bbest1, False, True
+
+
+def _recs_cmp(ha1, rindex1, rchg1, ha2, rindex2, rchg2, need_min):
+    """Port of xdl_recs_cmp, using an explicit stack instead of recursion."""
+    ndiags = len(ha1) + len(ha2) + 3
+    kvdf = [0] * ndiags
+    kvdb = [0] * ndiags
+    koff = len(ha2) + 1
+    mxcost = max(_bogosqrt(ndiags), XDL_MAX_COST_MIN)
+
+    stack = [(0, len(ha1), 0, len(ha2), need_min)]
+    while stack:
+        off1, lim1, off2, lim2, need_min = stack.pop()
+        while off1 < lim1 and off2 < lim2 and ha1[off1] == ha2[off2]:
+            off1 += 1
+            off2 += 1
+        while off1 < lim1 and off2 < lim2 and ha1[lim1 - 1] == ha2[lim2 - 1]:
+            lim1 -= 1
+            lim2 -= 1
+
+        if off1 == lim1:
+            for i in range(off2, lim2):
+                rchg2[rindex2[i]] = 1
+        elif off2 == lim2:
+            for i in range(off1, lim1):
+                rchg1[rindex1[i]] = 1
+        else:
+            i1, i2, min_lo, min_hi = _split(
+                ha1, off1, lim1, ha2, off2, lim2, kvdf, kvdb, koff, need_min, mxcost
+            )
+            stack.append((i1, lim1, i2, lim2, min_hi))
+            stack.append((off1, i1, off2, i2, min_lo))
+
+
+def _myers(ha1, ha2, need_min) -> Tuple[bytearray, bytearray]:
+    """Port of xdl_do_diff for the classic (Myers) algorithm.
+
+    The returned change arrays have one extra trailing zero, which also serves
+    as the sentinel that xdiff keeps before the first line (index -1).
+    """
+    n1 = len(ha1)
+    n2 = len(ha2)
+    rchg1 = bytearray(n1 + 1)
+    rchg2 = bytearray(n2 + 1)
+
+    # xdl_trim_ends
+    lim = min(n1, n2)
+    i = 0
+    while i < lim and ha1[i] == ha2[i]:
+        i += 1
+    dstart = i
+    lim -= i
+    i = 0
+    while i < lim and ha1[n1 - i - 1] == ha2[n2 - i - 1]:
+        i += 1
+    dend1 = n1 - i - 1
+    dend2 = n2 - i - 1
+
+    # xdl_cleanup_records: lines with no match on the other side are changes.
+    count1 = Counter(ha1)
+    count2 = Counter(ha2)
+    reduced = []
+    for ha, rchg, dend, other_count, n in (
+        (ha1, rchg1, dend1, count2, n1),
+        (ha2, rchg2, dend2, count1, n2),
+    ):
+        mlim = min(_bogosqrt(n), XDL_MAX_EQLIMIT)
+        dis = bytearray(n + 1)
+        for i in range(dstart, dend + 1):
+            nm = other_count.get(ha[i], 0)
+            dis[i] = 0 if nm == 0 else 2 if nm >= mlim and not need_min else 1
+        rindex = []
+        rha = []
+        for i in range(dstart, dend + 1):
+            if dis[i] == 1 or (dis[i] == 2 and not _clean_mmatch(dis, i, dstart, dend)):
+                rindex.append(i)
+                rha.append(ha[i])
+            else:
+                rchg[i] = 1
+        reduced.append((rha, rindex, rchg))
+
+    (rha1, rindex1, _), (rha2, rindex2, _) = reduced
+    _recs_cmp(rha1, rindex1, rchg1, rha2, rindex2, rchg2, need_min)
+    return rchg1, rchg2
+
+
+def _fall_back_diff(ha1, ha2, rchg1, rchg2, line1, count1, line2, count2, need_min):
+    """Run the classic diff on a (1-based) sub-range of lines."""
+    sub1, sub2 = _myers(
+        ha1[line1 - 1 : line1 - 1 + count1], ha2[line2 - 1 : line2 - 1 + count2], need_min
+    )
+    rchg1[line1 - 1 : line1 - 1 + count1] = sub1[:count1]
+    rchg2[line2 - 1 : line2 - 1 + count2] = sub2[:count2]
+
+
+# --- Patience (xpatience.c) ---
+
+
+def _patience(ha1, ha2, need_min) -> Tuple[bytearray, bytearray]:
+    rchg1 = bytearray(len(ha1) + 1)
+    rchg2 = bytearray(len(ha2) + 1)
+    stack = [(1, len(ha1), 1, len(ha2))]
+    while stack:
+        line1, count1, line2, count2 = stack.pop()
+        if not count1:
+            rchg2[line2 - 1 : line2 - 1 + count2] = b'\1' * count2
+            continue
+        if not count2:
+            rchg1[line1 - 1 : line1 - 1 + count1] = b'\1' * count1
+            continue
+
+        # fill_hashmap: lines which are unique on both sides, in file1 order.
+        line2_of = {}
+        order = []
+        for line in range(line1, line1 + count1):
+            h = ha1[line - 1]
+            if h in line2_of:
+                line2_of[h] = -1
+            else:
+                line2_of[h] = 0
+                order.append((h, line))
+        has_matches = False
+        for line in range(line2, line2 + count2):
+            h = ha2[line - 1]
+            if h in line2_of:
+                has_matches = True
+                line2_of[h] = -1 if line2_of[h] else line
+        if not has_matches:
+            rchg1[line1 - 1 : line1 - 1 + count1] = b'\1' * count1
+            rchg2[line2 - 1 : line2 - 1 + count2] = b'\1' * count2
+            continue
+
+        # find_longest_common_sequence
+        sequence = []
+        sequence_l2 = []
+        previous = {}
+        for h, l1 in order:
+            l2 = line2_of[h]
+            if l2 <= 0:
+                continue
+            left, right = -1, len(sequence)
+            while left + 1 < right:
+                middle = left + (right - left) // 2
+                if sequence_l2[middle] > l2:
+                    right = middle
+                else:
+                    left = middle
+            previous[l1] = sequence[left] if left >= 0 else None
+            entry = (l1, l2)
+            i = left + 1
+            if i == len(sequence):
+                sequence.append(entry)
+                sequence_l2.append(l2)
+            else:
+                sequence[i] = entry
+                sequence_l2[i] = l2
+
+        if not sequence:
+            _fall_back_diff(
+                ha1, ha2, rchg1, rchg2, line1, count1, line2, count2, need_min
+            )
+            continue
+
+        common = []
+        entry = sequence[-1]
+        while entry:
+            common.append(entry)
+            entry = previous[entry[0]]
+        common.reverse()
+
+        # walk_common_sequence
+        end1 = line1 + count1
+        end2 = line2 + count2
+        k = 0
+        while True:
+            if k < len(common):
+                next1, next2 = common[k]
+                while (
+                    next1 > line1
+                    and next2 > line2
+                    and ha1[next1 - 2] == ha2[next2 - 2]
+                ):
+                    next1 -= 1
+                    next2 -= 1
+            else:
+                next1 = end1
+                next2 = end2
+            while line1 < next1 and line2 < next2 and ha1[line1 - 1] == ha2[line2 - 1]:
+                line1 += 1
+                line2 += 1
+
+            if next1 > line1 or next2 > line2:
+                stack.append((line1, next1 - line1, line2, next2 - line2))
+
+            if k == len(common):
+                break
+
+            while (
+                k + 1 < len(common)
+                and common[k + 1][0] == common[k][0] + 1
+                and common[k + 1][1] == common[k][1] + 1
+            ):
+                k += 1
+            line1 = common[k][0] + 1
+            line2 = common[k][1] + 1
+            k += 1
+
+    return rchg1, rchg2
+
+
+# --- Histogram (xhistogram.c) ---
+
+
+def _find_lcs(ha1, ha2, line1, count1, line2, count2):
+    """Returns the longest common region, or None to fall back to Myers."""
+    end1 = line1 + count1 - 1
+    end2 = line2 + count2 - 1
+
+    # scanA: records are [first occurrence, count], chained via next_ptrs.
+    records = {}
+    line_map = [None] * count1
+    next_ptrs = [0] * count1
+    for ptr in range(end1, line1 - 1, -1):
+        h = ha1[ptr - 1]
+        rec = records.get(h)
+        if rec:
+            next_ptrs[ptr - line1] = rec[0]
+            rec[0] = ptr
+            rec[1] += 1
+        else:
+            rec = records[h] = [ptr, 1]
+        line_map[ptr - line1] = rec
+
+    cnt = HISTOGRAM_MAX_CHAIN_LENGTH + 1
+    has_common = False
+    begin1 = lcs_end1 = begin2 = lcs_end2 = 0
+
+    b_ptr = line2
+    while b_ptr <= end2:
+        b_next = b_ptr + 1
+        rec = records.get(ha2[b_ptr - 1])
+        if rec:
+            has_common = True
+        if rec and rec[1] <= cnt:
+            as_ = rec[0]
+            while True:
+                np = next_ptrs[as_ - line1]
+                bs = b_ptr
+                ae = as_
+                be = bs
+                rc = rec[1]
+
+                while line1 < as_ and line2 < bs and ha1[as_ - 2] == ha2[bs - 2]:
+                    as_ -= 1
+                    bs -= 1
+                    if 1 < rc:
+                        rc = min(rc, line_map[as_ - line1][1])
+                while ae < end1 and be < end2 and ha1[ae] == ha2[be]:
+                    ae += 1
+                    be += 1
+                    if 1 < rc:
+                        rc = min(rc, line_map[ae - line1][1])
+
+                if b_next <= be:
+                    b_next = be + 1
+                if lcs_end1 - begin1 < ae - as_ or rc < cnt:
+                    begin1, begin2, lcs_end1, lcs_end2 = as_, bs, ae, be
+                    cnt = rc
+
+                if np == 0:
+                    break
+                while np and np <= ae:
+                    np = next_ptrs[np - line1]
+                if np == 0:
+                    break
+                as_ = np
+        b_ptr = b_next
+
+    if has_common and HISTOGRAM_MAX_CHAIN_LENGTH < cnt:
+        return None
+    return begin1, lcs_end1, begin2, lcs_end2
+
+
+def _histogram(ha1, ha2, need_min) -> Tuple[bytearray, bytearray]:
+    rchg1 = bytearray(len(ha1) + 1)
+    rchg2 = bytearray(len(ha2) + 1)
+    stack = [(1, len(ha1), 1, len(ha2))]
+    while stack:
+        line1, count1, line2, count2 = stack.pop()
+        if count1 <= 0 and count2 <= 0:
+            continue
+        if not count1:
+            rchg2[line2 - 1 : line2 - 1 + count2] = b'\1' * count2
+            continue
+        if not count2:
+            rchg1[line1 - 1 : line1 - 1 + count1] = b'\1' * count1
+            continue
+
+        lcs = _find_lcs(ha1, ha2, line1, count1, line2, count2)
+        if lcs is None:
+            _fall_back_diff(
+                ha1, ha2, rchg1, rchg2, line1, count1, line2, count2, need_min
+            )
+            continue
+        begin1, end1, begin2, end2 = lcs
+        if begin1 == 0 and begin2 == 0:
+            rchg1[line1 - 1 : line1 - 1 + count1] = b'\1' * count1
+            rchg2[line2 - 1 : line2 - 1 + count2] = b'\1' * count2
+            continue
+        stack.append(
+            (end1 + 1, line1 + count1 - 1 - end1, end2 + 1, line2 + count2 - 1 - end2)
+        )
+        stack.append((line1, begin1 - line1, line2, begin2 - line2))
+    return rchg1, rchg2
+
+
+# --- Change compaction (xdl_change_compact) ---
+
+
+def _get_indent(rec: bytes) -> int:
+    ret = 0
+    for c in rec:
+        if c not in WHITESPACE:
+            return ret
+        if c == 0x20:
+            ret += 1
+        elif c == 0x09:
+            ret += 8 - ret % 8
+        if ret >= MAX_INDENT:
+            return MAX_INDENT
+    return -1
+
+
+def _measure_split(recs, split):
+    """Returns (end_of_file, indent, pre_blank, pre_indent, post_blank, post_indent)."""
+    nrec = len(recs)
+    if split >= nrec:
+        end_of_file = True
+        indent = -1
+    else:
+        end_of_file = False
+        indent = _get_indent(recs[split])
+
+    pre_blank = 0
+    pre_indent = -1
+    for i in range(split - 1, -1, -1):
+        pre_indent = _get_indent(recs[i])
+        if pre_indent != -1:
+            break
+        pre_blank += 1
+        if pre_blank == MAX_BLANKS:
+            pre_indent = 0
+            break
+
+    post_blank = 0
+    post_indent = -1
+    for i in range(split + 1, nrec):
+        post_indent = _get_indent(recs[i])
+        if post_indent != -1:
+            break
+        post_blank += 1
+        if post_blank == MAX_BLANKS:
+            post_indent = 0
+            break
+
+    return end_of_file, indent, pre_blank, pre_indent, post_blank, post_indent
+
+
+def _score_split(m):
+    """Returns (effective_indent, penalty) for one split (score_add_split)."""
+    end_of_file, indent, pre_blank, pre_indent, post_blank, post_indent = m
+    penalty = 0
+    if pre_indent == -1 and pre_blank == 0:
+        penalty += 1  # START_OF_FILE_PENALTY
+    if end_of_file:
+        penalty += 21  # END_OF_FILE_PENALTY
+
+    post_blank = 1 + post_blank if indent == -1 else 0
+    total_blank = pre_blank + post_blank
+    penalty += -30 * total_blank  # TOTAL_BLANK_WEIGHT
+    penalty += 6 * post_blank  # POST_BLANK_WEIGHT
+
+    if indent == -1:
+        indent = post_indent
+    any_blanks = total_blank != 0
+
+    if indent == -1 or pre_indent == -1:
+        pass
+    elif indent > pre_indent:
+        # RELATIVE_INDENT_WITH_BLANK_PENALTY / RELATIVE_INDENT_PENALTY
+        penalty += 10 if any_blanks else -4
+    elif indent == pre_indent:
+        pass
+    elif post_indent != -1 and post_indent > indent:
+        # RELATIVE_OUTDENT_WITH_BLANK_PENALTY / RELATIVE_OUTDENT_PENALTY
+        penalty += 17 if any_blanks else 24
+    else:
+        # RELATIVE_DEDENT_WITH_BLANK_PENALTY / RELATIVE_DEDENT_PENALTY
+        penalty += 17 if any_blanks else 23
+    return indent, penalty
+
+
+def _score_cmp(s1, s2):
+    cmp_indents = (s1[0] > s2[0]) - (s1[0] < s2[0])
+    return 60 * cmp_indents + (s1[1] - s2[1])  # INDENT_WEIGHT
+
+
+class _Groups:
+    """A cursor over the groups of changed lines in one file (struct xdlgroup)."""
+
+    def __init__(self, ha, rchg):
+        self.ha = ha
+        self.rchg = rchg
+        self.nrec = len(ha)
+        self.start = self.end = 0
+        while rchg[self.end]:
+            self.end += 1
+
+    def next(self):
+        if self.end == self.nrec:
+            return False
+        self.start = self.end + 1
+        self.end = self.start
+        while self.rchg[self.end]:
+            self.end += 1
+        return True
+
+    def previous(self):
+        if self.start == 0:
+            return False
+        self.end = self.start - 1
+        self.start = self.end
+        while self.rchg[self.start - 1]:
+            self.start -= 1
+        return True
+
+    def slide_down(self):
+        if self.end < self.nrec and self.ha[self.start] == self.ha[self.end]:
+            self.rchg[self.start] = 0
+            self.rchg[self.end] = 1
+            self.start += 1
+            self.end += 1
+            while self.rchg[self.end]:
+                self.end += 1
+            return True
+        return False
+
+    def slide_up(self):
+        if self.start > 0 and self.ha[self.start - 1] == self.ha[self.end - 1]:
+            self.start -= 1
+            self.end -= 1
+            self.rchg[self.start] = 1
+            self.rchg[self.end] = 0
+            while self.rchg[self.start - 1]:
+                self.start -= 1
+            return True
+        return False
+
+
+def _change_compact(ha, recs, rchg, ha_other, rchg_other, indent_heuristic):
+    g = _Groups(ha, rchg)
+    go = _Groups(ha_other, rchg_other)
+
+    while True:
+        if g.end != g.start:
+            while True:
+                groupsize = g.end - g.start
+                end_matching_other = -1
+
+                while g.slide_up():
+                    go.previous()
+                earliest_end = g.end
+                if go.end > go.start:
+                    end_matching_other = g.end
+
+                while g.slide_down():
+                    go.next()
+                    if go.end > go.start:
+                        end_matching_other = g.end
+
+                if groupsize == g.end - g.start:
+                    break
+
+            if g.end == earliest_end:
+                pass
+            elif end_matching_other != -1:
+                while go.end == go.start:
+                    g.slide_up()
+                    go.previous()
+            elif indent_heuristic:
+                # Prefer the lowest-scoring shift; ties go to the bottommost.
+                best_shift = -1
+                best_score = None
+                shift = max(
+                    earliest_end,
+                    g.end - groupsize - 1,
+                    g.end - INDENT_HEURISTIC_MAX_SLIDING,
+                )
+                for shift in range(shift, g.end + 1):
+                    s1 = _score_split(_measure_split(recs, shift))
+                    s2 = _score_split(_measure_split(recs, shift - groupsize))
+                    score = (s1[0] + s2[0], s1[1] + s2[1])
+                    if best_shift == -1 or _score_cmp(score, best_score) <= 0:
+                        best_score = score
+                        best_shift = shift
+                while g.end > best_shift:
+                    g.slide_up()
+                    go.previous()
+
+        if not g.next():
+            break
+        go.next()
+
+
+def _build_script(rchg1, n1, rchg2, n2):
+    """Returns a list of (i1, i2, chg1, chg2) changes in file order."""
+    script = []
+    i1 = n1
+    i2 = n2
+    while i1 >= 0 or i2 >= 0:
+        if rchg1[i1 - 1] or rchg2[i2 - 1]:
+            l1 = i1
+            while rchg1[i1 - 1]:
+                i1 -= 1
+            l2 = i2
+            while rchg2[i2 - 1]:
+                i2 -= 1
+            script.append((i1, i2, l1 - i1, l2 - i2))
+        i1 -= 1
+        i2 -= 1
+    script.reverse()
+    return script
+
+
+# --- Hunks & codes (xemit.c + unified_diff.read_codes) ---
+
+
+def _func_name(rec: bytes) -> Optional[bytes]:
+    """git's default funcname matcher (def_ff)."""
+    if rec and (rec[:1].isalpha() or rec[0] in b'_$'):
+        return rec[:FUNC_LINE_SIZE].rstrip(WHITESPACE)
+    return None
+
+
+def _get_hunks(script, context):
+    """Group changes into hunks (xdl_get_hunk)."""
+    max_common = 2 * context
+    hunks = []
+    for change in script:
+        if hunks:
+            prev = hunks[-1][-1]
+            if change[0] - (prev[0] + prev[2]) <= max_common:
+                hunks[-1].append(change)
+                continue
+        hunks.append([change])
+    return hunks
+
+
+def _trim_common_tail(a: bytes, b: bytes) -> Tuple[bytes, bytes]:
+    """git skips identical trailing blocks when no context is requested."""
+    blk = 1024
+    trimmed = 0
+    smaller = min(len(a), len(b))
+    while (
+        blk + trimmed <= smaller
+        and a[len(a) - trimmed - blk : len(a) - trimmed]
+        == b[len(b) - trimmed - blk : len(b) - trimmed]
+    ):
+        trimmed += blk
+    recovered = 0
+    ap = len(a) - trimmed
+    while recovered < trimmed:
+        recovered += 1
+        if a[ap + recovered - 1] == 0x0A:
+            break
+    return a[: len(a) - trimmed + recovered], b[: len(b) - trimmed + recovered]
+
+
+def hunks_to_codes(recs1, recs2, hunks, context) -> List[Code]:
+    """Convert hunks to codes, exactly as read_codes would from git's output."""
+    n1 = len(recs1)
+    n2 = len(recs2)
+    out = []
+    last_source = 0
+    last_target = 0
+    func_line = None
+    funclineprev = -1
+
+    for hunk in hunks:
+        first_i1, first_i2, _, _ = hunk[0]
+        last_i1, last_i2, last_chg1, last_chg2 = hunk[-1]
+        s1 = max(first_i1 - context, 0)
+        s2 = max(first_i2 - context, 0)
+        lctx = min(context, n1 - (last_i1 + last_chg1), n2 - (last_i2 + last_chg2))
+        e1 = last_i1 + last_chg1 + lctx
+        e2 = last_i2 + last_chg2 + lctx
+
+        # get_func_line: search upwards, but not past the previous hunk's start.
+        for line in range(s1 - 1, funclineprev, -1):
+            name = _func_name(recs1[line])
+            if name is not None:
+                func_line = name
+                break
+        funclineprev = s1 - 1
+
+        header = func_line.decode('utf8', errors='replace') if func_line else None
+        source_start = s1 + 1 if e1 > s1 else s1
+        target_start = s2 + 1 if e2 > s2 else s2
+
+        if source_start != last_source + 1:
+            out.append(
+                Code(
+                    'skip',
+                    (last_source, source_start - 1),
+                    (last_target, target_start - 1),
+                    header,
+                )
+            )
+            last_source = source_start
+            last_target = target_start
+            header = None
+
+        # Walk the hunk as a sequence of (type, count) runs of lines.
+        runs = []
+        pos1 = s1
+        for i1, i2, chg1, chg2 in hunk:
+            runs.append((' ', i1 - pos1))
+            runs.append(('-', chg1))
+            runs.append(('+', chg2))
+            pos1 = i1 + chg1
+        runs.append((' ', e1 - pos1))
+
+        src = source_start
+        tgt = target_start
+        for type, count in runs:
+            if not count:
+                continue
+            if type == ' ':
+                out.append(
+                    Code('equal', (src - 1, src - 1 + count), (tgt - 1, tgt - 1 + count), header)
+                )
+                src += count
+                tgt += count
+                last_source = src - 1
+                last_target = tgt - 1
+            elif type == '-':
+                out.append(
+                    Code('delete', (src - 1, src - 1 + count), (last_target, last_target), header)
+                )
+                src += count
+                last_source = src - 1
+            else:
+                out.append(
+                    Code('insert', (last_source, last_source), (tgt - 1, tgt - 1 + count), header)
+                )
+                tgt += count
+                last_target = tgt - 1
+            header = None
+    return out
+
+
+def diff_bytes(a: bytes, b: bytes, opts: DiffOptions, modes_differ=False):
+    """Diff two file contents, returning what diff_to_codes would for git's output.
+
+    Returns None for binary files.
+    """
+    after_num_lines = num_lines(b)
+    if b'\0' in a[:FIRST_FEW_BYTES] or b'\0' in b[:FIRST_FEW_BYTES]:
+        if a != b:
+            return None
+        hunks = []
+    else:
+        if opts.context == 0:
+            a, b = _trim_common_tail(a, b)
+        recs1 = split_records(a)
+        recs2 = split_records(b)
+        ha1, ha2 = _classify(recs1, recs2, opts.whitespace)
+        if opts.algorithm == 'patience':
+            rchg1, rchg2 = _patience(ha1, ha2, opts.need_minimal)
+        elif opts.algorithm == 'histogram':
+            rchg1, rchg2 = _histogram(ha1, ha2, opts.need_minimal)
+        else:
+            rchg1, rchg2 = _myers(ha1, ha2, opts.need_minimal)
+        _change_compact(ha1, recs1, rchg1, ha2, rchg2, opts.indent_heuristic)
+        _change_compact(ha2, recs2, rchg2, ha1, rchg1, opts.indent_heuristic)
+        script = _build_script(rchg1, len(recs1), rchg2, len(recs2))
+        hunks = _get_hunks(script, opts.context)
+
+    if not hunks:
+        if modes_differ:
+            # git prints a mode change header with no hunks.
+            return None
+        return [Code('equal', (0, after_num_lines), (0, after_num_lines))]
+
+    codes = hunks_to_codes(recs1, recs2, hunks, opts.context)
+    codes = add_replaces(codes)
+    return add_end_skip(codes, after_num_lines)
+
+
+def is_executable(path: str) -> bool:
+    return bool(os.stat(path).st_mode & stat.S_IXUSR)
@@ -0,0 +1,161 @@
+"""Shared, read-once access to file contents and their lines.
+
+Small files are read into memory and kept in a byte cache, so that the diff
+and the file contents sent to the browser come from the same read. Big files
+are mmap'd instead of being copied onto the heap. Line counts are cached by
+file identity, and a line-offset index gives random access to line ranges of
+large files.
+"""
+
+import contextlib
+import functools
+import mmap
+import os
+import re
+from array import array
+from typing import Optional
+
+from . import cache
+
+READ_CHUNK_BYTES = 1024 * 1024
+
+# Files at least this big are mmap'd rather than read and cached.
+MMAP_MIN_BYTES = 1024 * 1024
+
+_NEWLINE = re.compile(b'\n')
+
+# Contents of small files by (path, file identity).
+_SMALL_FILES = cache.ByteLRUCache(32 * 1024 * 1024)
+
+
+@contextlib.contextmanager
+def file_buffer(path: str):
+    """Yields the contents of the file at path, as bytes or a read-only mmap.
+
+    An mmap is only valid inside the with block; slice it to keep any data.
+    """
+    key = (path, cache.file_identity(path))
+    data = _SMALL_FILES.get(key)
+    if data is not None:
+        yield data
+        return
+    with open(path, 'rb') as f:
+        if os.fstat(f.fileno()).st_size < MMAP_MIN_BYTES:
+            data = f.read()
+            _SMALL_FILES.put(key, data)
+            yield data
+        else:
+            with mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as mm:
+                yield mm
+
+
+def count_lines(data) -> int:
+    """Count lines the same way `grep -c ''` does: a final unterminated line counts."""
+    if isinstance(data, bytes):
+        n = data.count(b'\n')
+    else:
+        # mmap has no count(); counting a chunk at a time keeps the copies small.
+        n = sum(data[i : i + READ_CHUNK_BYTES].count(b'\n') for i in range(0, len(data), READ_CHUNK_BYTES))
+    if len(data) and data[-1:] != b'\n':
+        n += 1
+    return n
+
+
+@functools.lru_cache(maxsize=1024)
+def _cached_num_lines(path: str, identity) -> int:
+    with file_buffer(path) as data:
+        return count_lines(data)
+
+
+def num_lines(path: str) -> int:
+    """Returns the number of lines in the file at path, as `grep -c ''` would."""
+    return _cached_num_lines(path, cache.file_identity(path))
+
+
+def read_bytes(path: str) -> bytes:
+    with file_buffer(path) as data:
+        return bytes(data)
+
+
+def decode(data) -> str:
+    """Decodes file contents as UTF-8, without copying an mmap first."""
+    # Match the universal-newlines translation of open(path, 'r').
+    text = str(data, 'utf8')
+    if '\r' in text:
+        text = text.replace('\r\n', '\n').replace('\r', '\n')
+    return text
+
+
+def decode_chunks(data, chunk_bytes: int = READ_CHUNK_BYTES):
+    """Yields decode(data) in pieces of up to about chunk_bytes.
+
+    Pieces end just after a newline, so that no UTF-8 sequence or CRLF is
+    split between two of them. A line longer than chunk_bytes is one piece.
+    """
+    start, size = 0, len(data)
+    while start < size:
+        end = start + chunk_bytes
+        if end < size:
+            i = data.rfind(b'\n', start, end)
+            end = i + 1 if i != -1 else (data.find(b'\n', end) + 1 or size)
+        yield decode(data[start:end])
+        start = end
+
+
+class LineIndex:
+    """Byte offsets of the start of each line in a file.
+
+    offsets[i] is where line i starts; offsets[-1] is the file size. A final
+    line without a trailing newline still counts as a line.
+    """
+
+    def __init__(self, path: str, data: Optional[bytes] = None):
+        # data, if given, is indexed in place of the file (e.g. normalized JSON).
+        self.path = path
+        self.data = data
+        self.offsets = array('Q', [0])
+        with self._buffer() as data:
+            # finditer scans in C (and an mmap in place), ~3x faster than a find() loop.
+            self.offsets.extend(m.end() for m in _NEWLINE.finditer(data))
+            size = len(data)
+        if self.offsets[-1] != size:
+            self.offsets.append(size)
+
+    def _buffer(self):
+        return contextlib.nullcontext(self.data) if self.data is not None else file_buffer(self.path)
+
+    @property
+    def num_lines(self) -> int:
+        return len(self.offsets) - 1
+
+    def read(self, start: int, end: int) -> str:
+        """Returns lines [start, end) as text, clipped to the file."""
+        start = max(0, min(start, self.num_lines))
+        end = max(start, min(end, self.num_lines))
+        with self._buffer() as data:
+            return decode(data[self.offsets[start] : self.offsets[end]])
+
+
+@functools.lru_cache(maxsize=64)
+def _cached_index(path: str, identity) -> LineIndex:
+    return LineIndex(path)
+
+
+def line_index(path: str) -> LineIndex:
+    """Returns a (cached) LineIndex for path, rebuilt if the file changes."""
+    return _cached_index(path, cache.file_identity(path))
+
+
+def merge_ranges(ranges: list[tuple[int, int]], context: int, limit: int) -> list[tuple[int, int]]:
+    """Pads each [start, end) range by context lines, clips to limit and merges overlaps."""
+    merged = []
+    for start, end in sorted(ranges):
+        start = max(0, start - context)
+        end = min(limit, end + context)
+        if start >= end:
+            continue
+        if merged and start <= merged[-1][1]:
+            merged[-1] = (merged[-1][0], max(merged[-1][1], end))
+        else:
+            merged.append((start, end))
+    return merged
@@ -1,15 +1,39 @@
 """This class represents the diff between two files on local disk."""
 
 import os
-from dataclasses import dataclass
+import sys
+from dataclasses import dataclass, field
 from typing import Union
 
 from webdiff.unified_diff import RawDiffLine
 
 
-@dataclass
+def _relpath(path: str, root: str) -> str:
+    """os.path.relpath(path, root), without the path math in the common case.
+
+    Paths that git reports for files under root are usually just root, a
+    separator and a normalized relative path, which we can slice off.
+    """
+    if not path:
+        return ''
+    n = len(root)
+    if n and path.startswith(root) and path[n : n + 1] == os.sep:
+        rel = path[n + 1 :]
+        # Anything with empty, '.' or '..' components needs normalizing.
+        slashed = '/' + rel + '/'
+        if '//' not in slashed and '/./' not in slashed and '/../' not in slashed:
+            return rel
+    return os.path.relpath(path, root)
+
+
+@dataclass(slots=True)
 class LocalFileDiff:
-    """A before/after file pair on local disk"""
+    """A before/after file pair on local disk
+
+    Large directory diffs hold one of these per file, so they use slots and
+    share (interned) root strings. The relative paths and type are read for
+    every file each time the file list is sent, so they're computed once, here.
+    """
 
     a_root: str
     """Path to the root dir of the left side of the diff"""
@@ -23,28 +47,26 @@ class LocalFileDiff:
     """Is this a move between the two files?"""
     num_add: Union[int, None] = None
     num_delete: Union[int, None] = None
+    a: str = field(init=False)
+    """Path of the left file relative to a_root (empty for an add)"""
+    b: str = field(init=False)
+    """Path of the right file relative to b_root (empty for a delete)"""
+    type: str = field(init=False)
+    """One of add, delete, move or change"""
 
-    @property
-    def a(self):
-        if self.a_path == '':
-            return ''
-        return os.path.relpath(self.a_path, self.a_root)
-
-    @property
-    def b(self):
-        if self.b_path == '':
-            return ''
-        return os.path.relpath(self.b_path, self.b_root)
-
-    @property
-    def type(self):
+    def __post_init__(self):
+        self.a_root = sys.intern(self.a_root)
+        self.b_root = sys.intern(self.b_root)
+        self.a = _relpath(self.a_path, self.a_root)
+        self.b = _relpath(self.b_path, self.b_root)
         if self.a_path == '':
-            return 'add'
+            self.type = 'add'
         elif self.b_path == '':
-            return 'delete'
+            self.type = 'delete'
         elif self.is_move:
-            return 'move'
-        return 'change'
+            self.type = 'move'
+        else:
+            self.type = 'change'
 
     @staticmethod
     def from_diff_raw_line(line: RawDiffLine, a_dir: str, b_dir: str):
@@ -56,5 +78,5 @@ class LocalFileDiff:
             return LocalFileDiff(a_dir, line.path, b_dir, '', is_move=False, num_add=line.num_add, num_delete=line.num_delete)
         if line.dst_path:
             return LocalFileDiff(a_dir, line.path, b_dir, line.dst_path, is_move=True, num_add=line.num_add, num_delete=line.num_delete)
-        dst_path = os.path.join(b_dir, os.path.relpath(line.path, a_dir))
+        dst_path = os.path.join(b_dir, _relpath(line.path, a_dir))
         return LocalFileDiff(a_dir, line.path, b_dir, dst_path, is_move=False, num_add=line.num_add, num_delete=line.num_delete)
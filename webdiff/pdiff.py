@@ -0,0 +1,126 @@
+"""In-process perceptual diffs of images using Pillow.
+
+These mirror the ImageMagick pipeline in util (compare, convert -morphology
+Dilate Disk:5.5, identify -format %@) but work on decoded pixel buffers
+instead of forking a process per step. The mask of differing pixels is
+computed once per pair of images and the dilated highlight and its bounding
+box are both derived from it; a PNG is only written for the highlight, which
+is what gets served. Pixel-level work all happens inside Pillow's C
+operations.
+"""
+
+import functools
+import math
+
+from PIL import Image, ImageChops, UnidentifiedImageError
+
+from webdiff import cache, scratch
+
+RED = (255, 0, 0)
+WHITE = (255, 255, 255)
+DILATE_RADIUS = 5.5
+
+
+class UnsupportedImageError(Exception):
+    """Pillow can't decode one of the images; ImageMagick might."""
+
+
+class SizeMismatchError(Exception):
+    pass
+
+
+@functools.lru_cache(maxsize=1)
+def is_available() -> bool:
+    """Can Pillow read and write the PNGs which pdiffs are saved as?
+
+    Pillow built without zlib can't, and then only ImageMagick can make pdiffs.
+    """
+    Image.init()
+    return 'PNG' in Image.OPEN and 'PNG' in Image.SAVE
+
+
+def _open_rgba(path: str) -> Image.Image:
+    try:
+        im = Image.open(path)
+        im.load()
+    except (UnidentifiedImageError, OSError) as e:
+        raise UnsupportedImageError(str(e)) from e
+    return im.convert('RGBA')
+
+
+def diff_mask(before_path: str, after_path: str) -> Image.Image:
+    """Returns an 'L' image which is 255 wherever any RGBA channel differs."""
+    a = _open_rgba(before_path)
+    b = _open_rgba(after_path)
+    if a.size != b.size:
+        raise SizeMismatchError(f'{a.size} != {b.size}')
+    channels = ImageChops.difference(a, b).split()
+    mask = channels[0]
+    for c in channels[1:]:
+        mask = ImageChops.lighter(mask, c)
+    return mask.point(lambda v: 255 if v else 0)
+
+
+def pair_mask(before_path: str, after_path: str) -> Image.Image:
+    """diff_mask, memoized by the identities of both files."""
+    return _pair_mask(
+        before_path, after_path, cache.file_identity(before_path), cache.file_identity(after_path)
+    )
+
+
+# Masks are a byte per pixel, so only keep the few most recent (e.g. for the
+# /pdiff and /pdiffbbox requests for the image being viewed).
+@functools.lru_cache(maxsize=4)
+def _pair_mask(before_path, after_path, *_identities) -> Image.Image:
+    return diff_mask(before_path, after_path)
+
+
+def _save_highlight(mask: Image.Image) -> str:
+    """Save a PNG which is red where mask is set and white elsewhere."""
+    out = Image.new('RGB', mask.size, WHITE)
+    out.paste(RED, mask=mask)
+    path = scratch.new_file('.png')
+    # These are short-lived and served locally; favour speed over size.
+    out.save(path, compress_level=1)
+    return path
+
+
+def _shifted(mask: Image.Image, dx: int, dy: int) -> Image.Image:
+    out = Image.new('L', mask.size, 0)
+    out.paste(mask, (dx, dy))
+    return out
+
+
+def dilate(mask: Image.Image, radius: float = DILATE_RADIUS) -> Image.Image:
+    """Binary dilation by a disk, like ImageMagick's -morphology Dilate Disk:radius."""
+    r = int(radius)
+    # Horizontal dilations by 0..r pixels, each built on the previous one.
+    rows = [mask]
+    for w in range(1, r + 1):
+        rows.append(
+            ImageChops.lighter(rows[-1], ImageChops.lighter(_shifted(mask, w, 0), _shifted(mask, -w, 0)))
+        )
+    out = mask
+    for dy in range(-r, r + 1):
+        half_width = int(math.sqrt(radius * radius - dy * dy))
+        out = ImageChops.lighter(out, _shifted(rows[half_width], 0, dy))
+    return out
+
+
+def generate_dilated_pdiff_image(before_path: str, after_path: str) -> str:
+    """Returns the path to a PNG which highlights the (dilated) differences in red."""
+    return _save_highlight(dilate(pair_mask(before_path, after_path)))
+
+
+def get_pdiff_bbox(before_path: str, after_path: str):
+    """Returns {top,left,width,height,bottom,right} for the pixels which differ."""
+    bbox = pair_mask(before_path, after_path).getbbox()
+    left, top, right, bottom = bbox or (0, 0, 0, 0)
+    return {
+        'width': right - left,
+        'height': bottom - top,
+        'left': left,
+        'top': top,
+        'bottom': bottom,
+        'right': right,
+    }
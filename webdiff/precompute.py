@@ -0,0 +1,127 @@
+"""Warm the response cache by computing file diffs in the background."""
+
+import logging
+import threading
+from concurrent.futures import Executor
+from typing import Callable, Optional
+
+
+class Precomputer:
+    """Runs compute(idx) once for every index on a shared executor.
+
+    At most num_workers of these jobs are queued or running at a time, so
+    requests submitted to the same executor aren't stuck behind all of them.
+    Indices nearest the one most recently passed to focus() go first, so the
+    file being viewed and its neighbours are ready before distant ones.
+
+    If max_bytes is set, warming pauses once the bytes returned by compute
+    since the last focus() add up to it, so that distant files don't evict
+    the ones near the focus from a cache of that size. The next focus()
+    picks up from there.
+    """
+
+    def __init__(
+        self,
+        num_items: int,
+        compute: Callable[[int], object],
+        executor: Executor,
+        num_workers: int = 4,
+        max_bytes: Optional[int] = None,
+    ):
+        self._compute = compute
+        self._executor = executor
+        self._num_workers = max(1, num_workers)
+        self._max_bytes = max_bytes
+        self._num_items = num_items
+        self._taken = bytearray(num_items)
+        self._num_pending = num_items
+        self._focus = 0
+        # Cursors which walk outward from the focus: the next candidates at
+        # or after it, and before it.
+        self._after = 0
+        self._before = -1
+        self._warmed_bytes = 0
+        self._lock = threading.Lock()
+        self._stopped = False
+        self._running = 0
+        self._done = threading.Event()
+
+    def start(self):
+        self._fill()
+        self._check_done()
+
+    def focus(self, idx: int):
+        """Prioritise idx and the files around it."""
+        with self._lock:
+            self._focus = self._after = min(max(idx, 0), self._num_items)
+            self._before = self._focus - 1
+            self._warmed_bytes = 0
+            self._done.clear()
+        self._fill()
+        self._check_done()
+
+    def stop(self):
+        with self._lock:
+            self._stopped = True
+
+    def join(self):
+        """Wait until nothing is running and nothing more will be until the next focus()."""
+        self._done.wait()
+
+    def _is_idle(self) -> bool:
+        return (
+            self._stopped
+            or not self._num_pending
+            or (self._max_bytes is not None and self._warmed_bytes >= self._max_bytes)
+        )
+
+    def _next(self) -> Optional[int]:
+        with self._lock:
+            if self._running >= self._num_workers or self._is_idle():
+                return None
+            while self._after < self._num_items and self._taken[self._after]:
+                self._after += 1
+            while self._before >= 0 and self._taken[self._before]:
+                self._before -= 1
+            # The nearer of the two, breaking ties in favour of the next file.
+            if self._after < self._num_items and (
+                self._before < 0 or self._after - self._focus <= self._focus - self._before
+            ):
+                idx = self._after
+            else:
+                idx = self._before
+            self._taken[idx] = 1
+            self._num_pending -= 1
+            self._running += 1
+            return idx
+
+    def _fill(self):
+        """Submit jobs until num_workers are in flight or there's nothing to do."""
+        while (idx := self._next()) is not None:
+            try:
+                self._executor.submit(self._run, idx)
+            except RuntimeError:
+                # The executor has been shut down.
+                with self._lock:
+                    self._running -= 1
+                    self._stopped = True
+                return
+
+    def _run(self, idx: int):
+        size = 0
+        try:
+            result = self._compute(idx)
+            if isinstance(result, bytes):
+                size = len(result)
+        except Exception as e:
+            logging.warning(f'Failed to precompute diff {idx}: {e}')
+        with self._lock:
+            self._running -= 1
+            self._warmed_bytes += size
+        self._fill()
+        self._check_done()
+
+    def _check_done(self):
+        with self._lock:
+            if not self._running and self._is_idle():
+                self._done.set()
@@ -0,0 +1,206 @@
+"""A managed scratch directory for the temp files webdiff creates.
+
+Inputs to git diff, pdiff images and symlink-resolved directories all live
+in a single per-process directory which is deleted at exit. Files are evicted
+least-recently-used first once their total size exceeds a cap, skipping any
+which are currently acquired (e.g. while a response is streaming them).
+
+Because files can disappear (evicted here, or removed by something like
+tmpreaper), functions which return scratch paths should be memoized with
+memoize_paths rather than functools.lru_cache: it recomputes results whose
+files no longer exist.
+"""
+
+import atexit
+import functools
+import logging
+import os
+import shutil
+import tempfile
+import threading
+from collections import OrderedDict
+from dataclasses import dataclass
+
+DEFAULT_MAX_BYTES = 1024 * 1024 * 1024
+
+
+@dataclass
+class _Entry:
+    is_dir: bool
+    refs: int = 0
+
+
+class ScratchArea:
+    def __init__(self, max_bytes: int = DEFAULT_MAX_BYTES):
+        self.max_bytes = max_bytes
+        self._root = None
+        self._entries: OrderedDict[str, _Entry] = OrderedDict()
+        self._lock = threading.Lock()
+
+    @property
+    def root(self) -> str:
+        with self._lock:
+            if self._root is None:
+                self._root = tempfile.mkdtemp(prefix='webdiff-')
+                atexit.register(self.cleanup)
+            return self._root
+
+    def new_file(self, suffix: str = '') -> str:
+        """Create an empty file in the scratch area and return its path."""
+        fd, path = tempfile.mkstemp(suffix=suffix, dir=self.root)
+        os.close(fd)
+        self._add(path, is_dir=False)
+        return path
+
+    def new_dir(self) -> str:
+        """Create an empty directory in the scratch area and return its path.
+
+        Directories don't count towards the size cap and are never evicted;
+        remove() them when done.
+        """
+        path = tempfile.mkdtemp(dir=self.root)
+        self._add(path, is_dir=True)
+        return path
+
+    def _add(self, path: str, is_dir: bool):
+        with self._lock:
+            self._entries[path] = _Entry(is_dir)
+        self.evict()
+
+    def touch(self, path: str):
+        """Mark path as recently used."""
+        with self._lock:
+            if path in self._entries:
+                self._entries.move_to_end(path)
+
+    def acquire(self, path: str):
+        """Protect path from eviction until a matching release()."""
+        with self._lock:
+            entry = self._entries.get(path)
+            if entry:
+                entry.refs += 1
+                self._entries.move_to_end(path)
+
+    def release(self, path: str):
+        with self._lock:
+            entry = self._entries.get(path)
+            if entry and entry.refs > 0:
+                entry.refs -= 1
+
+    def remove(self, path: str):
+        with self._lock:
+            entry = self._entries.pop(path, None)
+        if entry is None:
+            return
+        if entry.is_dir:
+            shutil.rmtree(path, ignore_errors=True)
+        else:
+            _unlink(path)
+
+    def evict(self):
+        """Delete unreferenced files, oldest first, until under max_bytes."""
+        with self._lock:
+            sizes = {}
+            for path, entry in list(self._entries.items()):
+                if entry.is_dir:
+                    continue
+                try:
+                    sizes[path] = os.path.getsize(path)
+                except OSError:
+                    # Removed behind our back (or moved into the disk cache).
+                    del self._entries[path]
+            total = sum(sizes.values())
+            for path, size in sizes.items():
+                if total <= self.max_bytes:
+                    break
+                if self._entries[path].refs:
+                    continue
+                del self._entries[path]
+                _unlink(path)
+                total -= size
+                logging.debug(f'Evicted scratch file {path}')
+
+    def cleanup(self):
+        with self._lock:
+            root, self._root = self._root, None
+            self._entries.clear()
+        if root:
+            shutil.rmtree(root, ignore_errors=True)
+
+
+def _unlink(path: str):
+    try:
+        os.remove(path)
+    except OSError:
+        pass
+
+
+AREA = ScratchArea()
+
+
+def configure(max_bytes: int):
+    AREA.max_bytes = max_bytes
+
+
+def new_file(suffix: str = '') -> str:
+    return AREA.new_file(suffix)
+
+
+def new_dir() -> str:
+    return AREA.new_dir()
+
+
+def acquire(path: str):
+    AREA.acquire(path)
+
+
+def release(path: str):
+    AREA.release(path)
+
+
+def remove(path: str):
+    AREA.remove(path)
+
+
+def _paths_in(result):
+    if isinstance(result, str):
+        return [result]
+    if isinstance(result, tuple):
+        return [x for x in result if isinstance(x, str)]
+    return []
+
+
+def memoize_paths(maxsize: int = 128):
+    """Like functools.lru_cache, for functions whose results contain file paths.
+
+    A cached result is only reused while all of its paths still exist.
+    """
+
+    def decorator(fn):
+        results: OrderedDict = OrderedDict()
+        lock = threading.Lock()
+
+        @functools.wraps(fn)
+        def wrapper(*args):
+            with lock:
+                result = results.get(args)
+                if result is not None:
+                    results.move_to_end(args)
+            if result is not None:
+                paths = _paths_in(result)
+                if all(os.path.exists(p) for p in paths):
+                    for p in paths:
+                        AREA.touch(p)
+                    return result
+            result = fn(*args)
+            with lock:
+                results[args] = result
+                results.move_to_end(args)
+                while len(results) > maxsize:
+                    results.popitem(last=False)
+            return result
+
+        wrapper.cache_clear = results.clear
+        return wrapper
+
+    return decorator
@@ -1,6 +1,8 @@
+from collections import deque
 from dataclasses import dataclass
 from itertools import groupby
-from typing import List, Optional, Tuple, Union
+from typing import BinaryIO, Iterator, List, Optional, Tuple, Union
+import os
 import re
 
 from unidiff import PatchSet
@@ -128,6 +130,11 @@ def diff_to_codes(diff: str, after_num_lines=None) -> Union[List[Code], None]:
     # Go through and combine sequential delete/insert into "replace"
     codes = add_replaces(codes)
 
+    return add_end_skip(codes, after_num_lines)
+
+
+def add_end_skip(codes: List[Code], after_num_lines=None) -> List[Code]:
+    """Add a skip for any lines after the last hunk."""
     if after_num_lines:
         (_, a2) = codes[-1].before
         (_, b2) = codes[-1].after
@@ -146,7 +153,7 @@ def diff_to_codes(diff: str, after_num_lines=None) -> Union[List[Code], None]:
 
 
 # See https://git-scm.com/docs/git-diff#_raw_output_format
-@dataclass
+@dataclass(slots=True)
 class RawDiffLine:
     src_mode: str
     """e.g. 100644; 000000 for creation/unmerged"""
@@ -216,3 +223,59 @@ def parse_raw_diff(diff: str) -> List[RawDiffLine]:
         diff.num_delete = stats[1]
         diff_lines.append(diff)
     return diff_lines
+
+
+def _iter_nul_fields(stream: BinaryIO, chunk_size: int) -> Iterator[bytes]:
+    """Yields the NUL-terminated fields of stream, reading it chunk_size bytes at a time."""
+    buf = b''
+    while chunk := stream.read(chunk_size):
+        fields = (buf + chunk).split(b'\0')
+        buf = fields.pop()
+        yield from fields
+    if buf:
+        yield buf
+
+
+def _parse_numstat(field: bytes) -> Tuple[Union[int, None], Union[int, None], bytes]:
+    add, drop, path = field.split(b'\t', 2)
+    return (
+        int(add) if add != b'-' else None,
+        int(drop) if drop != b'-' else None,
+        path,
+    )
+
+
+def iter_raw_diff(stream: BinaryIO, chunk_size: int = 1 << 16) -> Iterator[RawDiffLine]:
+    """Incrementally parse the bytes of `git diff --raw -z --numstat`.
+
+    This is the streaming counterpart of parse_raw_diff: it reads the output as
+    it arrives, only decodes the paths, and yields each RawDiffLine as soon as
+    its numstat has been seen. git writes all the raw records before any of the
+    numstat records, and both in the same order.
+    """
+    fields = _iter_nul_fields(stream, chunk_size)
+    pending = deque()
+    for field in fields:
+        if field.startswith(b':'):
+            src_mode, dst_mode, src_sha, dst_sha, status = field[1:].decode('ascii').split(' ')
+            score = None
+            if len(status) > 1:
+                score = int(status[1:])
+                status = status[0]
+            path = os.fsdecode(next(fields))
+            dst_path = os.fsdecode(next(fields)) if status in ('C', 'R') else None
+            pending.append(
+                RawDiffLine(src_mode, dst_mode, src_sha, dst_sha, status, path, score, dst_path)
+            )
+        else:
+            num_add, num_delete, path = _parse_numstat(field)
+            if not path:
+                # Renames and --no-index pairs list both paths in separate fields.
+                next(fields)
+                next(fields)
+            if not pending:
+                continue
+            line = pending.popleft()
+            line.num_add = num_add
+            line.num_delete = num_delete
+            yield line
@@ -7,10 +7,12 @@ import logging
 import os
 import re
 import subprocess
-import tempfile
+from typing import Optional
 
 from PIL import Image
 
+from webdiff import cache, diskcache, pdiff, scratch
+
 
 class ImageMagickNotAvailableError(Exception):
     pass
@@ -20,8 +22,13 @@ class ImageMagickError(Exception):
     pass
 
 
-@functools.lru_cache(maxsize=128)
 def contentHash(path):
+    return _content_hash(path, cache.file_identity(path))
+
+
+@functools.lru_cache(maxsize=128)
+def _content_hash(path, identity):
+    # identity is only part of the key, so that edits to the file are picked up.
     return hashlib.sha512(open(path, mode='rb').read()).digest()
 
 
@@ -35,12 +42,17 @@ def are_files_identical(path1, path2):
 
 def image_metadata(path):
     """Returns a dict with metadata about the image located at path."""
+    key = diskcache.is_enabled() and diskcache.make_key('image_metadata', diskcache.content_digest(path))
+    if key and (md := diskcache.get_json(key)) is not None:
+        return md
     md = {'num_bytes': os.path.getsize(path)}
     try:
         im = Image.open(path)
         width, height = im.size
         md.update({'width': width, 'height': height})
     finally:
+        if key:
+            diskcache.put_json(key, md)
         return md
 
 
@@ -54,18 +66,73 @@ def is_imagemagick_available():
     return True
 
 
+def are_same_pixels(before_path, after_path):
+    """Do the two images have identical pixels?
+
+    This tries cheap checks (identical bytes, then the dimensions in the
+    image headers) before decoding the pixels. It only falls back to a full
+    perceptual diff for formats which Pillow can't read.
+    """
+    return _are_same_pixels(
+        before_path, after_path, cache.file_identity(before_path), cache.file_identity(after_path)
+    )
+
+
 @functools.lru_cache(maxsize=128)
+def _are_same_pixels(before_path, after_path, *_identities):
+    if are_files_identical(before_path, after_path):
+        return True
+    try:
+        with Image.open(before_path) as a, Image.open(after_path) as b:
+            # Image.open only reads the headers; pixels are decoded on demand.
+            if a.size != b.size:
+                return False
+            return a.convert('RGBA').tobytes() == b.convert('RGBA').tobytes()
+    except OSError:
+        pass
+    try:
+        same, _ = generate_pdiff_image(before_path, after_path)
+    except ImageMagickError:
+        return False
+    return same
+
+
 def generate_pdiff_image(before_path, after_path):
-    """Generate a perceptual diff between the before/after images.
+    """Generate a perceptual diff between the before/after images with ImageMagick.
 
-    This runs the ImageMagick compare command.
+    This is the fallback for formats which Pillow can't read; otherwise
+    generate_dilated_pdiff_image and get_pdiff_bbox work in-process.
 
     Returns: (are_images_identical, path_to_pdiff_png)
     """
+    return _generate_pdiff_image(
+        before_path, after_path, cache.file_identity(before_path), cache.file_identity(after_path)
+    )
+
+
+@scratch.memoize_paths(maxsize=128)
+def _generate_pdiff_image(before_path, after_path, *_identities):
+    key = diskcache.is_enabled() and diskcache.make_key(
+        'pdiff', diskcache.content_digest(before_path), diskcache.content_digest(after_path)
+    )
+    if key:
+        cached_path = diskcache.get_file(key, '.png')
+        identical = diskcache.get_json(key)
+        if cached_path and identical is not None:
+            return identical, cached_path
+
+    identical, diff_path = _magick_pdiff_image(before_path, after_path)
+    if key:
+        diff_path = diskcache.put_file(key, diff_path, '.png')
+        diskcache.put_json(key, identical)
+    return identical, diff_path
+
+
+def _magick_pdiff_image(before_path, after_path):
     if not is_imagemagick_available():
         raise ImageMagickNotAvailableError()
 
-    _, diff_path = tempfile.mkstemp(suffix='.png')
+    diff_path = scratch.new_file('.png')
 
     # The compare command returns:
     #   0 on success & similar images
@@ -94,19 +161,43 @@ def generate_pdiff_image(before_path, after_path):
 
     if result == 2:
         raise ImageMagickError('compare failed. Perhaps image dimensions differ.')
-    if result == 0:
-        return True, diff_path
-    return False, diff_path
+    return result == 0, diff_path
 
 
-@functools.lru_cache(maxsize=128)
-def generate_dilated_pdiff_image(diff_path):
-    """Given a pdiff image, dilate it to highlight small differences."""
+def generate_dilated_pdiff_image(before_path, after_path):
+    """The perceptual diff of the images, dilated to highlight small differences."""
+    return _generate_dilated_pdiff_image(
+        before_path, after_path, cache.file_identity(before_path), cache.file_identity(after_path)
+    )
+
+
+@scratch.memoize_paths(maxsize=128)
+def _generate_dilated_pdiff_image(before_path, after_path, *_identities):
+    key = diskcache.is_enabled() and diskcache.make_key(
+        'dilated', diskcache.content_digest(before_path), diskcache.content_digest(after_path)
+    )
+    if key and (cached_path := diskcache.get_file(key, '.png')):
+        return cached_path
+
+    try:
+        diff_dilate_path = pdiff.generate_dilated_pdiff_image(before_path, after_path)
+    except pdiff.SizeMismatchError:
+        raise ImageMagickError('compare failed. Perhaps image dimensions differ.')
+    except pdiff.UnsupportedImageError:
+        _, diff_path = generate_pdiff_image(before_path, after_path)
+        diff_dilate_path = _magick_dilated_pdiff_image(diff_path)
+
+    if key:
+        diff_dilate_path = diskcache.put_file(key, diff_dilate_path, '.png')
+    return diff_dilate_path
+
+
+def _magick_dilated_pdiff_image(diff_path):
     if not is_imagemagick_available():
         raise ImageMagickNotAvailableError()
 
     # Dilate the diff image (to highlight small differences) and make it red.
-    _, diff_dilate_path = tempfile.mkstemp(suffix='.png')
+    diff_dilate_path = scratch.new_file('.png')
     subprocess.check_call(
         [
             'convert',
@@ -127,9 +218,35 @@ def generate_dilated_pdiff_image(diff_path):
     return diff_dilate_path
 
 
+def get_pdiff_bbox(before_path, after_path):
+    """Returns {top,left,width,height} for the differences between the images."""
+    return _get_pdiff_bbox(
+        before_path, after_path, cache.file_identity(before_path), cache.file_identity(after_path)
+    )
+
+
 @functools.lru_cache(maxsize=128)
-def get_pdiff_bbox(diff_path):
-    """Returns {top,left,width,height} for the content of a pdiff."""
+def _get_pdiff_bbox(before_path, after_path, *_identities):
+    key = diskcache.is_enabled() and diskcache.make_key(
+        'bbox', diskcache.content_digest(before_path), diskcache.content_digest(after_path)
+    )
+    if key and (bbox := diskcache.get_json(key)) is not None:
+        return bbox
+
+    try:
+        bbox = pdiff.get_pdiff_bbox(before_path, after_path)
+    except pdiff.SizeMismatchError:
+        raise ImageMagickError('compare failed. Perhaps image dimensions differ.')
+    except pdiff.UnsupportedImageError:
+        _, diff_path = generate_pdiff_image(before_path, after_path)
+        bbox = _magick_pdiff_bbox(diff_path)
+
+    if key:
+        diskcache.put_json(key, bbox)
+    return bbox
+
+
+def _magick_pdiff_bbox(diff_path):
     if not is_imagemagick_available():
         raise ImageMagickNotAvailableError()
 
@@ -149,17 +266,62 @@ def get_pdiff_bbox(diff_path):
     }
 
 
-@functools.lru_cache(maxsize=128)
-def normalize_json(in_path: str):
-    with open(in_path) as f:
+# Only files with these extensions, up to this size, are normalized.
+JSON_EXTENSIONS = ('.json', '.jsonc', '.json5')
+MAX_NORMALIZE_JSON_BYTES = 16 * 1024 * 1024
+
+# Normalized JSON by the sha256 of the original. b'' means "not JSON".
+_NORMALIZED_JSON = cache.ByteLRUCache(64 * 1024 * 1024)
+
+# A string (possibly unterminated), which is kept, or a comment, which isn't.
+_JSONC_COMMENT = re.compile(r'("[^"\\]*(?:\\.[^"\\]*)*"?)|//[^\n]*|/\*.*?(?:\*/|\Z)', re.S)
+# A string, which is kept, or a comma before a closing bracket, which isn't.
+_JSONC_TRAILING_COMMA = re.compile(r'("[^"\\]*(?:\\.[^"\\]*)*"?)|,(?=\s*[}\]])', re.S)
+
+
+def _keep_strings(m: re.Match) -> str:
+    return m.group(1) or ''
+
+
+def _strip_jsonc(text: str) -> str:
+    """Remove // and /* */ comments and trailing commas (JSONC) outside of strings."""
+    text = _JSONC_COMMENT.sub(_keep_strings, text)
+    return _JSONC_TRAILING_COMMA.sub(_keep_strings, text)
+
+
+def _normalize_json_bytes(in_path: str) -> bytes:
+    with open(in_path, 'rb') as f:
+        raw = f.read()
+    try:
+        text = raw.decode('utf-8-sig')
         try:
-            data = json.load(f)
+            data = json.loads(text)
         except json.JSONDecodeError:
-            # This would be a good place to try parsing as JSON5/JSONC.
-            logging.debug(f'Unable to parse {in_path} as JSON')
-            return in_path
-    _, norm_path = tempfile.mkstemp(suffix='.json')
-    with open(norm_path, 'w') as out:
-        json.dump(data, out, indent=2, sort_keys=True)
-    logging.debug(f'Normalized JSON {in_path} -> {norm_path}')
-    return norm_path
+            data = json.loads(_strip_jsonc(text))
+    except ValueError:  # includes UnicodeDecodeError and JSONDecodeError
+        logging.debug(f'Unable to parse {in_path} as JSON')
+        return b''
+    return json.dumps(data, indent=2, sort_keys=True).encode('utf8')
+
+
+def normalized_json_bytes(in_path: str) -> Optional[bytes]:
+    """Returns the file pretty-printed with sorted keys, or None if it isn't JSON.
+
+    Only JSON_EXTENSIONS files of up to MAX_NORMALIZE_JSON_BYTES are tried.
+    Comments and trailing commas (JSONC) are tolerated. Results are cached in
+    memory by content hash, so edits to the file are picked up.
+    """
+    if not in_path.lower().endswith(JSON_EXTENSIONS):
+        return None
+    try:
+        if os.path.getsize(in_path) > MAX_NORMALIZE_JSON_BYTES:
+            return None
+    except OSError:
+        return None
+    digest = diskcache.content_digest(in_path)
+    data = _NORMALIZED_JSON.get(digest)
+    if data is None:
+        data = _normalize_json_bytes(in_path)
+        _NORMALIZED_JSON.put(digest, data)
+    return data or None
+
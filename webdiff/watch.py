@@ -0,0 +1,204 @@
+"""Watch the two sides of a directory diff for changes.
+
+On Linux this uses inotify (through ctypes, so there's nothing to install).
+Elsewhere, or if inotify can't be used, it falls back to polling file stats.
+Polling is also used for directories containing symlinks: inotify would only
+see changes to the links themselves, not to the files they point at, and
+git difftool -d represents the working tree as symlinks.
+"""
+
+import ctypes
+import ctypes.util
+import logging
+import os
+import select
+import struct
+import threading
+from typing import Callable, Iterable, Optional, Set
+
+from webdiff import cache, dirdiff
+
+ChangeCallback = Callable[[Optional[Set[str]]], None]
+"""Called with the absolute paths which changed, or None if that's unknown."""
+
+POLL_INTERVAL_SECS = 1.0
+DEBOUNCE_SECS = 0.2
+
+IN_MODIFY = 0x00000002
+IN_ATTRIB = 0x00000004
+IN_CLOSE_WRITE = 0x00000008
+IN_MOVED_FROM = 0x00000040
+IN_MOVED_TO = 0x00000080
+IN_CREATE = 0x00000100
+IN_DELETE = 0x00000200
+IN_Q_OVERFLOW = 0x00004000
+IN_IGNORED = 0x00008000
+IN_ISDIR = 0x40000000
+IN_NONBLOCK = 0o4000
+IN_CLOEXEC = 0o2000000
+WATCH_MASK = IN_MODIFY | IN_ATTRIB | IN_CLOSE_WRITE | IN_MOVED_FROM | IN_MOVED_TO | IN_CREATE | IN_DELETE
+# struct inotify_event: int wd; uint32_t mask, cookie, len; char name[len]
+_EVENT = struct.Struct('iIII')
+
+
+class Watcher:
+    """Collects changed paths and reports them once they stop changing.
+
+    Subclasses implement _wait(), which blocks for up to timeout seconds and
+    returns the paths that changed in the meantime (None if unknown).
+    """
+
+    def __init__(self, dirs: Iterable[str], on_change: ChangeCallback, debounce: float = DEBOUNCE_SECS):
+        self.dirs = [os.path.abspath(d) for d in dirs]
+        self.on_change = on_change
+        self.debounce = debounce
+        self._stopped = threading.Event()
+        self._thread = None
+
+    def start(self):
+        self._thread = threading.Thread(target=self._run, name='webdiff-watcher', daemon=True)
+        self._thread.start()
+
+    def stop(self):
+        self._stopped.set()
+        if self._thread:
+            self._thread.join()
+
+    def _run(self):
+        pending: Set[str] = set()
+        unknown = False
+        try:
+            while not self._stopped.is_set():
+                changes = self._wait(self.debounce if pending or unknown else 0.5)
+                if changes is None:
+                    unknown = True
+                elif changes:
+                    pending |= changes
+                elif pending or unknown:
+                    # Nothing new for a whole debounce period; report what we have.
+                    try:
+                        self.on_change(None if unknown else pending)
+                    except Exception:
+                        logging.exception('Failed to update the diff after a change')
+                    pending, unknown = set(), False
+        finally:
+            self.close()
+
+    def _wait(self, timeout: float) -> Optional[Set[str]]:
+        raise NotImplementedError
+
+    def close(self):
+        pass
+
+
+class PollingWatcher(Watcher):
+    """Compares the stats of every file every interval seconds."""
+
+    def __init__(self, dirs, on_change, interval: float = POLL_INTERVAL_SECS):
+        super().__init__(dirs, on_change)
+        self.interval = interval
+        self._snapshot = self._take_snapshot()
+
+    def _take_snapshot(self) -> dict:
+        snapshot = {}
+        for top in self.dirs:
+            for root, _dirs, files in os.walk(top):
+                for name in files:
+                    path = os.path.join(root, name)
+                    snapshot[path] = cache.file_identity(path)
+        return snapshot
+
+    def _wait(self, timeout):
+        if self._stopped.wait(self.interval):
+            return set()
+        old, new = self._snapshot, self._take_snapshot()
+        self._snapshot = new
+        return {path for path in old.keys() | new.keys() if old.get(path) != new.get(path)}
+
+
+class InotifyWatcher(Watcher):
+    def __init__(self, dirs, on_change):
+        super().__init__(dirs, on_change)
+        self._libc = ctypes.CDLL(ctypes.util.find_library('c') or 'libc.so.6', use_errno=True)
+        self._fd = self._libc.inotify_init1(IN_NONBLOCK | IN_CLOEXEC)
+        if self._fd < 0:
+            _raise_errno('inotify_init1')
+        self._watches = {}  # wd -> directory
+        try:
+            for top in self.dirs:
+                self._add_tree(top)
+        except OSError:
+            self.close()
+            raise
+
+    def _add_tree(self, top: str) -> Set[str]:
+        """Watch top and every directory under it; returns the files found."""
+        files = set()
+        for root, _dirs, names in os.walk(top):
+            wd = self._libc.inotify_add_watch(self._fd, os.fsencode(root), WATCH_MASK)
+            if wd < 0:
+                _raise_errno(root)
+            self._watches[wd] = root
+            files.update(os.path.join(root, name) for name in names)
+        return files
+
+    def _wait(self, timeout):
+        ready, _, _ = select.select([self._fd], [], [], timeout)
+        if not ready:
+            return set()
+        try:
+            data = os.read(self._fd, 64 * 1024)
+        except BlockingIOError:
+            return set()
+
+        changed = set()
+        offset = 0
+        while offset < len(data):
+            wd, mask, _cookie, length = _EVENT.unpack_from(data, offset)
+            offset += _EVENT.size
+            name = data[offset : offset + length].rstrip(b'\0')
+            offset += length
+            if mask & IN_Q_OVERFLOW:
+                return None
+            if mask & IN_IGNORED:
+                self._watches.pop(wd, None)
+                continue
+            root = self._watches.get(wd)
+            if root is None or not name:
+                continue
+            path = os.path.join(root, os.fsdecode(name))
+            changed.add(path)
+            if mask & IN_ISDIR and mask & (IN_CREATE | IN_MOVED_TO):
+                # Files can land in a new directory before it's being watched.
+                try:
+                    changed |= self._add_tree(path)
+                except OSError as e:
+                    logging.warning(f'Unable to watch {path}: {e}')
+                    return None
+        return changed
+
+    def close(self):
+        if self._fd >= 0:
+            os.close(self._fd)
+            self._fd = -1
+
+
+def _raise_errno(what: str):
+    err = ctypes.get_errno()
+    raise OSError(err, os.strerror(err), what)
+
+
+def watch(dirs: Iterable[str], on_change: ChangeCallback) -> Watcher:
+    """Start watching dirs, calling on_change (on another thread) after changes."""
+    dirs = list(dirs)
+    watcher = None
+    if not any(dirdiff.contains_symlinks(d) for d in dirs):
+        try:
+            watcher = InotifyWatcher(dirs, on_change)
+        except (OSError, AttributeError) as e:
+            # AttributeError: there's no inotify in this libc.
+            logging.debug(f'Unable to use inotify ({e}); polling instead')
+    if watcher is None:
+        watcher = PollingWatcher(dirs, on_change)
+    watcher.start()
+    return watcher